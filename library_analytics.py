@@ -0,0 +1,234 @@
+# Vectorized loan-history analytics for what-if questions the rollups do not
+# answer (another due period, overdue rates by membership type, duration
+# histograms). loan, book and member columns are pulled with one binary COPY
+# each, from one snapshot, straight into NumPy arrays; every report is then a
+# handful of array operations. Needs the optional numpy package:
+#     pip install numpy
+#     python main.py loan-analytics --due-days 7 14 21
+import io
+import time
+import threading
+from datetime import date
+
+from library_service import get_pool, get_query_log
+
+try:
+    import numpy as np
+except ImportError:
+    raise RuntimeError('Loan analytics need the numpy package (pip install numpy)')
+
+
+# get_loan_history() reloads after ttl seconds
+LOAN_HISTORY_CONFIG = {
+    'ttl': 300
+}
+
+EPOCH = date(1970, 1, 1)
+
+# dates travel as days since EPOCH and NULLs as -1, so every row of a COPY
+# has the same width and the whole buffer maps onto one structured dtype
+LOAN_COLUMNS_QUERY = """
+    SELECT COALESCE(book_id, -1), COALESCE(member_id, -1), loan_date - DATE '1970-01-01',
+           COALESCE(due_date - DATE '1970-01-01', -1), COALESCE(return_date - DATE '1970-01-01', -1)
+    FROM loan WHERE loan_date IS NOT NULL
+"""
+LOAN_COLUMNS = ('book_id', 'member_id', 'loan_day', 'due_day', 'return_day')
+
+# segment -> (table, label expression); labels are fetched first and the COPY
+# sends each row's position in that list
+SEGMENT_SOURCES = {
+    'genre': ('book', "COALESCE(genre, 'Unknown')"),
+    'membership_type': ('member', "COALESCE(membership_type, 'Unknown')")
+}
+SEGMENT_KEYS = {'genre': 'book_id', 'membership_type': 'member_id'}
+
+_PGCOPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+
+def copy_out_ints(cur, query, names):
+    # COPY (query) TO STDOUT in binary -> {name: int32 array}; every column
+    # must be a non-NULL int4
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buf)
+    data = buf.getbuffer()
+    if bytes(data[:11]) != _PGCOPY_SIGNATURE:
+        raise ValueError('unexpected COPY header')
+    # signature, flags, header extension length + extension
+    offset = 19 + int.from_bytes(data[15:19], 'big')
+    fields = [('count', '>i2')]
+    for name in names:
+        fields += [(name + '_len', '>i4'), (name, '>i4')]
+    # the file ends with a -1 field count
+    rows = np.frombuffer(data[offset:len(data) - 2], dtype=np.dtype(fields))
+    get_query_log().record(query, time.perf_counter() - start, len(rows), tag='analytics.copy')
+    return {name: rows[name].astype(np.int32) for name in names}
+
+
+def copy_in_columns(cur, table, columns):
+    # binary COPY of parallel arrays (int32 / float32, no NULLs) into table;
+    # columns is [(column name, array)]
+    arrays = [np.asarray(values) for _, values in columns]
+    fields = [('count', '>i2')]
+    for i, values in enumerate(arrays):
+        fields += [(f'len{i}', '>i4'), (f'v{i}', values.dtype.newbyteorder('>'))]
+    rows = np.empty(len(arrays[0]) if arrays else 0, dtype=np.dtype(fields))
+    rows['count'] = len(arrays)
+    for i, values in enumerate(arrays):
+        rows[f'len{i}'] = values.dtype.itemsize
+        rows[f'v{i}'] = values
+    buf = io.BytesIO()
+    buf.write(_PGCOPY_SIGNATURE + bytes(8))
+    buf.write(rows.tobytes())
+    buf.write(b'\xff\xff')
+    buf.seek(0)
+    names = ', '.join(name for name, _ in columns)
+    start = time.perf_counter()
+    cur.copy_expert(f"COPY {table} ({names}) FROM STDIN WITH (FORMAT binary)", buf)
+    get_query_log().record(f"COPY {table} ({names}) FROM STDIN", time.perf_counter() - start, len(rows),
+                           tag='analytics.copy')
+    return len(rows)
+
+
+def _segment_codes(cur, table, label_sql):
+    # (ids, codes, labels) for one label column; labels end with '(none)'
+    cur.execute(f"SELECT {label_sql} FROM {table} GROUP BY 1 ORDER BY 1")
+    labels = [r[0] for r in cur.fetchall()]
+    codes_sql = cur.mogrify(f"array_position(%s::text[], {label_sql}) - 1", (labels,)).decode()
+    columns = copy_out_ints(cur, f"SELECT id, {codes_sql} FROM {table}", ('id', 'code'))
+    return columns['id'], columns['code'], labels + ['(none)']
+
+
+def _lookup_table(ids, values, default):
+    # array indexed by id; one extra slot at the end so an id of -1 maps to default
+    size = int(ids.max()) + 2 if len(ids) else 1
+    table = np.full(size, default, dtype=np.int32)
+    table[ids] = values
+    return table
+
+
+def load_loan_history(as_of=None):
+    # one REPEATABLE READ snapshot, so loans and their books/members agree
+    with get_pool().connection() as conn:
+        conn.autocommit = False
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        try:
+            cur = conn.cursor()
+            loans = copy_out_ints(cur, LOAN_COLUMNS_QUERY, LOAN_COLUMNS)
+            segments = {}
+            for segment, (table, label_sql) in SEGMENT_SOURCES.items():
+                ids, codes, labels = _segment_codes(cur, table, label_sql)
+                lookup = _lookup_table(ids, codes, len(labels) - 1)
+                keys = loans[SEGMENT_KEYS[segment]]
+                # ids beyond the table (rows added after the labels) count as none
+                segments[segment] = (lookup[np.where(keys < len(lookup) - 1, keys, -1)], labels)
+            cur.close()
+        finally:
+            conn.rollback()
+            conn.set_session(isolation_level='DEFAULT', readonly=False)
+            conn.autocommit = True
+    return LoanHistory(loans, segments, as_of)
+
+
+class LoanHistory:
+    # Loan columns as parallel int32 arrays (days since EPOCH, -1 = NULL) plus
+    # per-loan segment codes. Loans still open count up to `as_of`.
+    def __init__(self, loans, segments, as_of=None):
+        for name in LOAN_COLUMNS:
+            setattr(self, name, loans[name])
+        self.segments = segments
+        self.as_of = ((as_of or date.today()) - EPOCH).days
+        self.loaded_at = time.monotonic()
+        self.returned = self.return_day >= 0
+        self.end_day = np.where(self.returned, self.return_day, self.as_of)
+        self._sorted_durations = None
+
+    def __len__(self):
+        return len(self.loan_day)
+
+    def durations(self):
+        # days out: to the return date, or to as_of for open loans
+        return self.end_day - self.loan_day
+
+    def overdue(self, due_days=None):
+        # boolean mask; due_days replaces each loan's own due date with
+        # loan_date + due_days
+        if due_days is None:
+            return (self.due_day >= 0) & (self.end_day > self.due_day)
+        return self.end_day > self.loan_day + due_days
+
+    def _group(self, segment, weights=None):
+        codes, labels = self.segments[segment]
+        return np.bincount(codes, weights=weights, minlength=len(labels)), labels
+
+    def overdue_rates(self, segment='membership_type', due_days=None):
+        # [(label, loans, overdue, rate)], busiest segment first
+        counts, labels = self._group(segment)
+        late, _ = self._group(segment, self.overdue(due_days))
+        order = np.argsort(-counts, kind='stable')
+        return [(labels[i], int(counts[i]), int(late[i]), float(late[i] / counts[i]) if counts[i] else 0.0)
+                for i in order if counts[i]]
+
+    def duration_stats(self, segment='genre'):
+        # [(label, loans, returned, mean days of returned loans)]
+        counts, labels = self._group(segment)
+        returned, _ = self._group(segment, self.returned)
+        days, _ = self._group(segment, np.where(self.returned, self.durations(), 0))
+        order = np.argsort(-counts, kind='stable')
+        return [(labels[i], int(counts[i]), int(returned[i]), float(days[i] / returned[i]) if returned[i] else None)
+                for i in order if counts[i]]
+
+    def duration_histogram(self, bin_days=7, max_days=84, segment=None):
+        # (bin start days, counts); the last bin also takes everything longer.
+        # With a segment, counts has one row per label and the labels come third.
+        bins = max_days // bin_days + 1
+        index = np.minimum(np.maximum(self.durations(), 0) // bin_days, bins - 1)
+        starts = [i * bin_days for i in range(bins)]
+        if segment is None:
+            return starts, np.bincount(index, minlength=bins)
+        codes, labels = self.segments[segment]
+        counts = np.bincount(codes.astype(np.int64) * bins + index, minlength=len(labels) * bins)
+        return starts, counts.reshape(len(labels), bins), labels
+
+    def what_if(self, due_days_list):
+        # [(due_days, loans that would run over, rate)] for each candidate
+        # period, from one sort of the durations
+        if self._sorted_durations is None:
+            self._sorted_durations = np.sort(self.durations())
+        n = len(self._sorted_durations)
+        over = n - np.searchsorted(self._sorted_durations, np.asarray(due_days_list), side='right')
+        return [(int(d), int(o), float(o / n) if n else 0.0) for d, o in zip(due_days_list, over)]
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_loan_history(max_age=None):
+    # shared snapshot, reloaded once it is older than LOAN_HISTORY_CONFIG['ttl']
+    global _history
+    max_age = LOAN_HISTORY_CONFIG['ttl'] if max_age is None else max_age
+    with _history_lock:
+        if _history is None or time.monotonic() - _history.loaded_at >= max_age:
+            _history = load_loan_history()
+        return _history
+
+
+def format_loan_report(history, due_days_list=(7, 14, 21, 28)):
+    lines = [f"{len(history)} loans, {int(history.returned.sum())} returned"]
+    lines.append("\nIf the loan period were ...")
+    for days, over, rate in history.what_if(due_days_list):
+        lines.append(f"  {days:>4} days: {over:>9} loans over ({rate:.1%})")
+    lines.append("\nOverdue rate by membership type")
+    for label, loans, late, rate in history.overdue_rates('membership_type'):
+        lines.append(f"  {label:<20} {loans:>9} loans {late:>9} overdue ({rate:.1%})")
+    lines.append("\nDuration by genre")
+    for label, loans, returned, mean in history.duration_stats('genre'):
+        mean_text = f"{mean:.1f} days" if mean is not None else '-'
+        lines.append(f"  {label:<20} {loans:>9} loans {returned:>9} returned, mean {mean_text}")
+    lines.append("\nDuration histogram")
+    starts, counts = history.duration_histogram()
+    for i, (start, count) in enumerate(zip(starts, counts)):
+        label = f"{start}+ days" if i == len(starts) - 1 else f"{start}-{starts[i + 1] - 1} days"
+        lines.append(f"  {label:<12} {int(count):>9}")
+    return '\n'.join(lines)
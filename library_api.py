@@ -0,0 +1,359 @@
+# Asyncio HTTP/JSON API over the library operations, for self-service kiosks
+# and the web catalogue. It shares the database, SQL and entity cache of the
+# desktop app. Needs the optional aiohttp and asyncpg packages:
+#     pip install aiohttp asyncpg
+#     python main.py serve --port 8080
+# Several processes can serve the same port (SO_REUSEPORT) to use more cores.
+import re
+import hmac
+import json
+import time
+import asyncio
+import ipaddress
+import itertools
+from datetime import date, timedelta
+from functools import lru_cache
+
+from library_service import (
+    API_CONFIG, CHANGE_CONFIG, CHECKOUT_QUERY, DB_CONFIG, ENTITY_CACHE_QUERIES, HOLD_CONFIG,
+    HOLD_QUEUE_QUERY, LISTING_FIELDS, LISTING_NAME_COLUMNS, LOAN_LISTING, LOGIN_QUERY,
+    OPEN_DUE_DATES_QUERY, PLACE_HOLD_QUERY, RETURN_QUERY, STATS_CONFIG, STATS_KEYS, STATS_QUERY,
+    STATS_SUMMARY_QUERY, forecast_availability, get_entity_cache, get_query_log, hash_password,
+    listing, listing_page_query, parse_change
+)
+
+try:
+    import asyncpg
+    from aiohttp import web
+except ImportError:
+    raise RuntimeError('The HTTP API needs the aiohttp and asyncpg packages (pip install aiohttp asyncpg)')
+
+
+# largest page a client may ask for
+MAX_PAGE = 200
+
+# longest loan POST /loans accepts, in days
+MAX_LOAN_DAYS = 365
+
+# entities the public catalogue lists
+CATALOGUE = {'books': 'book', 'authors': 'author'}
+
+_PARAM_RE = re.compile(r'%s')
+
+
+@lru_cache(maxsize=256)
+def to_asyncpg(query):
+    # psycopg2 %s placeholders -> asyncpg $1, $2, ...
+    counter = itertools.count(1)
+    return _PARAM_RE.sub(lambda _: f'${next(counter)}', query)
+
+
+def _dumps(data):
+    # dates go out as ISO strings
+    return json.dumps(data, default=str)
+
+
+# ids and counts go to int4 columns
+INT4_MIN, INT4_MAX = -2**31, 2**31 - 1
+
+
+class BadRequest(Exception):
+    # a malformed request; the errors middleware answers it with a 400
+    pass
+
+
+def _int(value, name, low=INT4_MIN, high=INT4_MAX):
+    try:
+        num = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f'{name} must be an integer')
+    if not low <= num <= high:
+        raise BadRequest(f'{name} must be between {low} and {high}')
+    return num
+
+
+def _int_param(query, name, default):
+    return _int(query.get(name, default), name)
+
+
+def _field(body, name, kind=int):
+    # a required JSON body field, as an int or a string
+    if body.get(name) is None:
+        raise BadRequest(f'{name} is required')
+    if kind is int:
+        return _int(body[name], name)
+    return str(body[name])
+
+
+def _path_id(request):
+    return _int(request.match_info['id'], 'id')
+
+
+def _as_dict(entity, row):
+    return dict(zip(LISTING_FIELDS[entity], row))
+
+
+class LibraryApi:
+    # Request handlers over one asyncpg pool. Listing names are resolved
+    # through the shared entity cache, which a LISTEN connection keeps current.
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self.pool = None
+        self.listener = None
+        self._connect = None
+        self._reconnecting = None
+        self._closing = False
+        self._stats = None
+        self._stats_at = 0.0
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.errors])
+        app.add_routes([
+            web.get('/health', self.health),
+            web.get('/stats', self.stats),
+            web.get('/books/{id:\\d+}', self.get_book),
+            web.get('/{kind:books|authors}', self.list_catalogue),
+            web.post('/login', self.login),
+            web.get('/members/{id:\\d+}/loans', self.member_loans),
+            web.post('/loans', self.checkout),
+            web.post('/loans/{id:\\d+}/return', self.return_loan),
+            web.get('/books/{id:\\d+}/holds', self.book_holds),
+            web.post('/holds', self.place_hold),
+        ])
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+    async def start(self, app):
+        self._connect = dict(host=DB_CONFIG['host'], port=DB_CONFIG['port'], database=DB_CONFIG['dbname'],
+                             user=DB_CONFIG['user'], password=DB_CONFIG['password'])
+        self.pool = await asyncpg.create_pool(min_size=API_CONFIG['pool_min'], max_size=API_CONFIG['pool_max'],
+                                              **self._connect)
+        await self._listen()
+
+    async def stop(self, app):
+        self._closing = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        if self.listener is not None:
+            await self.listener.close()
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def _listen(self):
+        listener = await asyncpg.connect(**self._connect)
+        listener.add_termination_listener(self._listener_lost)
+        await listener.add_listener(CHANGE_CONFIG['channel'], self._changed)
+        self.listener = listener
+
+    def _listener_lost(self, connection):
+        if self._closing or connection is not self.listener:
+            return
+        print("API listener Error: LISTEN connection lost, reconnecting")
+        self.listener = None
+        self._reconnecting = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closing:
+            try:
+                await self._listen()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                print("API listener Error:", e)
+                await asyncio.sleep(CHANGE_CONFIG['reconnect_after'])
+                continue
+            # changes made while it was down were missed, like ChangeListener's resync
+            get_entity_cache().invalidate()
+            self._stats = None
+            self._reconnecting = None
+            return
+
+    def _changed(self, connection, pid, channel, payload):
+        change = parse_change(payload)
+        if change is None:
+            return
+        table, row_id = change
+        if table in ENTITY_CACHE_QUERIES:
+            get_entity_cache().invalidate(table, [row_id])
+        self._stats = None
+
+    @web.middleware
+    async def errors(self, request, handler):
+        try:
+            return await handler(request)
+        except BadRequest as e:
+            return web.json_response({'error': str(e)}, status=400, dumps=_dumps)
+        except asyncpg.PostgresError as e:
+            print("API Error:", e)
+            return web.json_response({'error': 'database error'}, status=500, dumps=_dumps)
+        except (OSError, asyncpg.InterfaceError) as e:
+            # the server is down or restarting; the pool reconnects on its own
+            print("API Error:", e)
+            return web.json_response({'error': 'database unavailable'}, status=503, dumps=_dumps)
+
+    def require_key(self, request):
+        if self.api_key and not hmac.compare_digest(request.headers.get('X-API-Key', ''), self.api_key):
+            raise web.HTTPUnauthorized(text=_dumps({'error': 'missing or wrong X-API-Key'}),
+                                       content_type='application/json')
+
+    async def fetch(self, conn, tag, query, *args):
+        # conn.fetch with the timing recorded in the query log
+        start = time.perf_counter()
+        rows = await conn.fetch(to_asyncpg(query), *args)
+        get_query_log().record(query, time.perf_counter() - start, len(rows), tag=tag)
+        return rows
+
+    async def resolve(self, conn, entity, rows):
+        # async counterpart of resolve_listing: cache hits first, then one
+        # query per table for the misses
+        rows = [tuple(r) for r in rows]
+        cache = get_entity_cache()
+        for col, table in LISTING_NAME_COLUMNS.get(entity, ()):
+            found, missing, generation = cache.lookup(table, [r[col] for r in rows])
+            if missing:
+                fetched = [tuple(r) for r in await self.fetch(conn, 'api.resolve', ENTITY_CACHE_QUERIES[table],
+                                                              missing)]
+                cache.put_many(table, fetched, generation)
+                found.update((r[0], r) for r in fetched)
+            rows = [r[:col] + ((found[r[col]][1] if r[col] in found else None),) + r[col + 1:] for r in rows]
+        return rows
+
+    async def json_body(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise BadRequest('request body must be JSON')
+        if not isinstance(body, dict):
+            raise BadRequest('request body must be a JSON object')
+        return body
+
+    # ---------- handlers ----------
+    async def health(self, request):
+        return web.json_response({'ok': True})
+
+    async def list_catalogue(self, request):
+        # GET /books?q=&after=&limit= : keyset pages; pass next_after back as after
+        entity = CATALOGUE[request.match_info['kind']]
+        after = _int_param(request.query, 'after', 0)
+        limit = max(1, min(_int_param(request.query, 'limit', 50), MAX_PAGE))
+        select, id_col, search, params = listing(entity, request.query.get('q', '').strip())
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, f'api.list_{entity}', listing_page_query(select, id_col, search),
+                                    after, *params, limit)
+            rows = await self.resolve(conn, entity, rows)
+        return web.json_response({'items': [_as_dict(entity, r) for r in rows],
+                                  'next_after': rows[-1][0] if len(rows) == limit else None}, dumps=_dumps)
+
+    async def get_book(self, request):
+        select, id_col, _, _ = listing('book')
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, 'api.get_book', f"{select} WHERE {id_col} = %s", _path_id(request))
+            rows = await self.resolve(conn, 'book', rows)
+        if not rows:
+            raise web.HTTPNotFound(text=_dumps({'error': 'no such book'}), content_type='application/json')
+        return web.json_response(_as_dict('book', rows[0]), dumps=_dumps)
+
+    async def stats(self, request):
+        # same counters as the dashboard, cached for STATS_CONFIG['ttl'] and
+        # dropped on any change notification
+        if self._stats is None or time.monotonic() - self._stats_at >= STATS_CONFIG['ttl']:
+            async with self.pool.acquire() as conn:
+                rows = []
+                if STATS_CONFIG['summary_table']:
+                    rows = await self.fetch(conn, 'api.stats', STATS_SUMMARY_QUERY)
+                if not rows:
+                    rows = await self.fetch(conn, 'api.stats', STATS_QUERY)
+            self._stats = dict(zip(STATS_KEYS, rows[0]))
+            self._stats_at = time.monotonic()
+        return web.json_response(self._stats, dumps=_dumps)
+
+    async def login(self, request):
+        body = await self.json_body(request)
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, 'api.login', LOGIN_QUERY, _field(body, 'username', str),
+                                    hash_password(_field(body, 'password', str)))
+        if not rows:
+            raise web.HTTPUnauthorized(text=_dumps({'error': 'invalid credentials'}), content_type='application/json')
+        return web.json_response(dict(zip(('id', 'username', 'full_name', 'role'), rows[0])), dumps=_dumps)
+
+    async def member_loans(self, request):
+        # a member's open loans, soonest due first (kiosk "my loans")
+        self.require_key(request)
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, 'api.member_loans',
+                                    f"{LOAN_LISTING} WHERE l.member_id = %s AND l.return_date IS NULL "
+                                    "ORDER BY l.due_date", _path_id(request))
+            rows = await self.resolve(conn, 'loan', rows)
+        return web.json_response({'items': [_as_dict('loan', r) for r in rows]}, dumps=_dumps)
+
+    async def checkout(self, request):
+        # POST /loans {"book_id", "member_id", "days": 14}
+        self.require_key(request)
+        body = await self.json_body(request)
+        book_id, member_id = _field(body, 'book_id'), _field(body, 'member_id')
+        days = _int(body.get('days', 14), 'days', 1, MAX_LOAN_DAYS)
+        loan_date = date.today()
+        due_date = loan_date + timedelta(days=days)
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, 'api.checkout', CHECKOUT_QUERY, book_id, member_id, loan_date, due_date,
+                                    'On Loan')
+        if not rows:
+            return web.json_response({'error': 'no available copies for this book'}, status=409)
+        return web.json_response(_as_dict('loan', tuple(rows[0])), status=201, dumps=_dumps)
+
+    async def return_loan(self, request):
+        self.require_key(request)
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, 'api.return_loan', RETURN_QUERY, date.today(), _path_id(request),
+                                    HOLD_CONFIG['pickup_days'])
+        if not rows:
+            return web.json_response({'error': 'no such loan, or already returned'}, status=409)
+        loan = _as_dict('loan', tuple(rows[0]))
+        loan['held_for'] = rows[0][7]
+        return web.json_response(loan, dumps=_dumps)
+
+    async def book_holds(self, request):
+        # the hold queue with the date each waiting hold is expected to get a copy;
+        # it names the members, so it needs the key like member_loans
+        self.require_key(request)
+        book_id = _path_id(request)
+        async with self.pool.acquire() as conn:
+            holds = await self.fetch(conn, 'api.hold_queue', HOLD_QUEUE_QUERY, book_id)
+            due_dates = await self.fetch(conn, 'api.hold_queue', OPEN_DUE_DATES_QUERY, book_id)
+        expected = iter(forecast_availability([r[0] for r in due_dates],
+                                              sum(1 for h in holds if h[2] == 'Waiting')))
+        items = [dict(zip(('id', 'member', 'status', 'requested', 'pickup_by'), h)) for h in holds]
+        for item in items:
+            item['expected'] = item['pickup_by'] if item['status'] == 'Ready' else next(expected)
+        return web.json_response({'items': items}, dumps=_dumps)
+
+    async def place_hold(self, request):
+        # POST /holds {"book_id", "member_id"}; only for books with no copy on the shelf
+        self.require_key(request)
+        body = await self.json_body(request)
+        book_id, member_id = _field(body, 'book_id'), _field(body, 'member_id')
+        async with self.pool.acquire() as conn:
+            rows = await self.fetch(conn, 'api.place_hold', PLACE_HOLD_QUERY, json.dumps(HOLD_CONFIG['tiers']),
+                                    HOLD_CONFIG['default_tier'], book_id, member_id)
+        if not rows:
+            return web.json_response({'error': 'a copy is available, or the member already holds this book'},
+                                     status=409)
+        return web.json_response({'id': rows[0][0]}, status=201, dumps=_dumps)
+
+
+def _is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def run_api(host=None, port=None):
+    host = host or API_CONFIG['host']
+    # without a key, member data and writes are open to anyone who can connect
+    if not API_CONFIG['api_key'] and not _is_loopback(host):
+        raise RuntimeError(f"Set API_CONFIG['api_key'] before serving on {host}; without one the API "
+                           "only binds to a loopback address")
+    api = LibraryApi(API_CONFIG['api_key'])
+    web.run_app(api.make_app(), host=host, port=port or API_CONFIG['port'], reuse_port=True)
@@ -0,0 +1,155 @@
+# Full rebuild of the co-borrowing recommendations (see RECOMMENDATIONS in
+# library_service). member_book is pulled with one binary COPY, the sparse
+# item-item matrix is counted with NumPy in worker processes, each owning the
+# rows of the books with book_id % partitions == p, and the matrix plus each
+# book's top_k neighbours are written back with binary COPY. Needs numpy:
+#     python main.py refresh-recommendations --rebuild --workers 8
+import os
+import time
+import multiprocessing
+
+from library_service import RECO_CONFIG, RECO_INCIDENCE_SELECT, RECO_LOCK_ID, get_pool
+from library_analytics import copy_in_columns, copy_out_ints, np
+
+# partitions per worker, so a slow partition does not leave the others idle
+PARTITIONS_PER_WORKER = 4
+
+_shared = {}
+
+
+def _init_worker(member_starts, member_sizes, entry_member, books, borrowers, partitions):
+    # runs once per worker process; the arrays stay there for every task
+    _shared.update(member_starts=member_starts, member_sizes=member_sizes, entry_member=entry_member,
+                   books=books, borrowers=borrowers, partitions=partitions)
+
+
+def _count_pairs(entries):
+    # (row book, column book) for every other book of each entry's member
+    starts, sizes, books = _shared['member_starts'], _shared['member_sizes'], _shared['books']
+    members = _shared['entry_member'][entries]
+    repeat = sizes[members]
+    first = np.cumsum(repeat) - repeat
+    row = np.repeat(entries, repeat)
+    col = np.repeat(starts[members] - first, repeat) + np.arange(int(repeat.sum()))
+    keep = row != col
+    key = books[row[keep]].astype(np.int64) << 32 | books[col[keep]].astype(np.int64)
+    return np.unique(key, return_counts=True)
+
+
+def _partition(p):
+    # one partition of matrix rows -> (book, other, together) and its top_k
+    books = _shared['books']
+    entries = np.flatnonzero(books % _shared['partitions'] == p)
+    if not len(entries):
+        empty = np.empty(0, dtype=np.int32)
+        return (empty, empty, empty), (empty, empty, empty, empty, np.empty(0, dtype=np.float32))
+    # bound the pairs generated at once to pair_chunk
+    pairs = np.cumsum(_shared['member_sizes'][_shared['entry_member'][entries]])
+    cuts = np.searchsorted(pairs, np.arange(RECO_CONFIG['pair_chunk'], int(pairs[-1]), RECO_CONFIG['pair_chunk']))
+    keys, counts = [], []
+    for chunk in np.split(entries, cuts):
+        if len(chunk):
+            k, c = _count_pairs(chunk)
+            keys.append(k)
+            counts.append(c)
+    if len(keys) == 1:
+        key, together = keys[0], counts[0]
+    else:
+        key, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        together = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    book = (key >> 32).astype(np.int32)
+    other = (key & 0xFFFFFFFF).astype(np.int32)
+    together = together.astype(np.int32)
+
+    borrowers, shrink = _shared['borrowers'], RECO_CONFIG['shrink']
+    score = (together / np.sqrt((borrowers[book] + shrink) * (borrowers[other] + shrink).astype(np.float64))
+             ).astype(np.float32)
+    # same order as RECO_RERANK_STEPS: score desc, then neighbour id
+    order = np.lexsort((other, -score, book))
+    ranked = book[order]
+    group_start = np.flatnonzero(np.r_[True, ranked[1:] != ranked[:-1]])
+    rank = np.arange(len(ranked)) - np.repeat(group_start, np.diff(np.r_[group_start, len(ranked)])) + 1
+    top = order[rank <= RECO_CONFIG['top_k']]
+    top_rank = rank[rank <= RECO_CONFIG['top_k']].astype(np.int16)
+    return (book, other, together), (book[top], top_rank, other[top], together[top], score[top])
+
+
+def build_matrix(members, books, workers=None):
+    # members/books: member_book rows ordered by member. Returns
+    # (borrowers by book id, matrix columns, neighbour columns).
+    workers = workers or RECO_CONFIG['workers'] or os.cpu_count() or 1
+    partitions = workers * PARTITIONS_PER_WORKER
+    if len(members):
+        member_starts = np.flatnonzero(np.r_[True, members[1:] != members[:-1]])
+    else:
+        member_starts = np.empty(0, dtype=np.int64)
+    member_sizes = np.diff(np.r_[member_starts, len(members)])
+    entry_member = np.repeat(np.arange(len(member_starts)), member_sizes)
+    borrowers = np.bincount(books, minlength=1).astype(np.int64)
+    init_args = (member_starts, member_sizes, entry_member, books, borrowers, partitions)
+    if workers == 1:
+        _init_worker(*init_args)
+        results = [_partition(p) for p in range(partitions)]
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+            results = pool.map(_partition, range(partitions))
+    matrix = [np.concatenate([r[0][i] for r in results]) for i in range(3)]
+    neighbours = [np.concatenate([r[1][i] for r in results]) for i in range(5)]
+    return borrowers, matrix, neighbours
+
+
+def _in_transaction(conn, statements):
+    conn.autocommit = False
+    try:
+        with conn:
+            cur = conn.cursor()
+            # plain SQL, or a callable taking the cursor (for COPY)
+            for statement in statements:
+                if callable(statement):
+                    statement(cur)
+                else:
+                    cur.execute(statement)
+            cur.close()
+    finally:
+        conn.autocommit = True
+
+
+def rebuild_recommendations(workers=None):
+    # Holds the recommendation lock for the whole run, so refreshes wait it
+    # out; loans made meanwhile stay queued for the next refresh. Returns row
+    # counts per table.
+    counts = {}
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (RECO_LOCK_ID,))
+        try:
+            # the queue is emptied before member_book is recounted, so a loan
+            # landing between the two is either counted now or still queued
+            _in_transaction(conn, [
+                "DELETE FROM reco_queue",
+                "TRUNCATE member_book",
+                "INSERT INTO member_book (member_id, book_id)" + RECO_INCIDENCE_SELECT
+            ])
+            start = time.perf_counter()
+            incidence = copy_out_ints(cur, "SELECT member_id, book_id FROM member_book ORDER BY member_id, book_id",
+                                      ('member_id', 'book_id'))
+            borrowers, matrix, neighbours = build_matrix(incidence['member_id'], incidence['book_id'], workers)
+            counts['member_book'] = len(incidence['book_id'])
+            counts['seconds_computing'] = round(time.perf_counter() - start, 3)
+            book_ids = np.flatnonzero(borrowers).astype(np.int32)
+            counts['book_borrowers'] = len(book_ids)
+            counts['book_cooccurrence'] = len(matrix[0])
+            counts['book_neighbours'] = len(neighbours[0])
+            _in_transaction(conn, [
+                "TRUNCATE book_borrowers, book_cooccurrence, book_neighbours",
+                lambda c: copy_in_columns(c, 'book_borrowers', [
+                    ('book_id', book_ids), ('borrowers', borrowers[book_ids].astype(np.int32))]),
+                lambda c: copy_in_columns(c, 'book_cooccurrence', list(zip(
+                    ('book_id', 'other_id', 'together'), matrix))),
+                lambda c: copy_in_columns(c, 'book_neighbours', list(zip(
+                    ('book_id', 'rank', 'neighbour_id', 'together', 'score'), neighbours))),
+            ])
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (RECO_LOCK_ID,))
+            cur.close()
+    return counts
@@ -0,0 +1,2741 @@
+# Database and library operations shared by the desktop app (main.py), the
+# command line and the HTTP API (library_api.py). Nothing here imports Qt.
+import os
+import sys
+import csv
+import json
+import re
+import time
+import random
+import hashlib
+import heapq
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions, errors
+from psycopg2.extras import execute_values
+from psycopg2 import sql
+from datetime import date, timedelta
+
+
+# ---------- DATABASE CONFIGURATION ----------
+DB_CONFIG = {
+    'host': 'localhost',
+    'port': 5432,
+    'dbname': 'Limkokwing Smart Library System',
+    'user': 'postgres',
+    'password': 'julie22'
+}
+
+# connection pool sizing; idle connections older than health_check_after
+# seconds are pinged before being handed out again
+POOL_CONFIG = {
+    'minconn': 1,
+    'maxconn': 8,
+    'timeout': 30.0,
+    'health_check_after': 30.0
+}
+
+# rows fetched per keyset page when a table is scrolled
+PAGE_SIZE = 500
+
+# records validated and inserted per transaction by the bulk importer
+IMPORT_CHUNK_SIZE = 1000
+
+# rows pulled per round trip from the server-side cursor during export
+EXPORT_BATCH_SIZE = 5000
+
+# how often (seconds) the running app flags past-due loans as 'Overdue'
+OVERDUE_CONFIG = {
+    'enabled': True,
+    'interval': 300.0
+}
+
+# dashboard snapshot lifetime in seconds; with summary_table enabled the
+# counters are kept current by triggers and a refresh reads a single row
+STATS_CONFIG = {
+    'ttl': 30.0,
+    'summary_table': False
+}
+
+# shared id -> record cache for author / book / member names shown in other
+# tabs; least recently used records beyond max_entries are evicted and
+# records older than ttl seconds are re-read
+ENTITY_CACHE_CONFIG = {
+    'max_entries': 100000,
+    'ttl': 600.0
+}
+
+# every statement's time and row count is recorded per call site; statements
+# slower than slow_ms are printed as they finish
+QUERY_LOG_CONFIG = {
+    'enabled': True,
+    'slow_ms': 200.0
+}
+
+# `main.py serve`: HTTP/JSON API for kiosks and the web catalogue (needs the
+# optional aiohttp and asyncpg packages); when api_key is set, writes and
+# member data need it in an X-API-Key header, and without one the API only
+# binds to a loopback address
+API_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8080,
+    'pool_min': 2,
+    'pool_max': 20,
+    'api_key': None
+}
+
+# circulation reports; with refresh_on_open the Reports tab folds in new
+# loan changes before reading (cost grows with the changes, not the history)
+ANALYTICS_CONFIG = {
+    'refresh_on_open': True,
+    'top_n': 20,
+    'months': 12
+}
+
+# co-borrowing recommendations: top_k neighbours are kept per book and scored
+# together / sqrt((borrowers_a + shrink) * (borrowers_b + shrink)), so a pair
+# of rarely borrowed books needs more than one shared reader to rank high;
+# workers=None uses every core for rebuilds
+RECO_CONFIG = {
+    'top_k': 20,
+    'shrink': 5,
+    # seconds between background refreshes in the GUI (None disables them);
+    # a queue longer than background_max is left to refresh-recommendations
+    'refresh_interval': 60.0,
+    'background_max': 5000,
+    'workers': None,
+    'pair_chunk': 20000000
+}
+
+# holds on out-of-stock books: lower tier goes first, then earlier requests;
+# a copy set aside for a hold waits pickup_days before passing on, and
+# forecasts assume each holder keeps the book loan_days
+HOLD_CONFIG = {
+    'tiers': {'Premium': 0, 'Senior': 1, 'Student': 1, 'Standard': 2},
+    'default_tier': 2,
+    'pickup_days': 3,
+    'loan_days': 14
+}
+
+# where `main.py bench` appends its results, one JSON object per run
+BENCH_RESULTS_PATH = 'bench_results.jsonl'
+
+# row changes pushed by database triggers; notifications arriving within
+# flush_ms of each other are applied to the open tabs as one batch
+CHANGE_CONFIG = {
+    'enabled': True,
+    'channel': 'library_changes',
+    'flush_ms': 200,
+    'reconnect_after': 5.0
+}
+
+
+# ---------- HELPERS ----------
+def get_connection():
+    if QUERY_LOG_CONFIG['enabled']:
+        conn = psycopg2.connect(**DB_CONFIG, cursor_factory=InstrumentedCursor)
+    else:
+        conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    return conn
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Thread-safe pool of autocommit connections shared by every tab.
+    # Checkout blocks (up to `timeout` seconds) when maxconn connections are busy.
+    def __init__(self, minconn=1, maxconn=8, timeout=30.0, health_check_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f'invalid pool size: minconn={minconn} maxconn={maxconn}')
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._idle = []  # list of (conn, last_used) pairs, most recent last
+        self._in_use = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0
+        }
+        for _ in range(minconn):
+            self._idle.append((get_connection(), time.monotonic()))
+            self._stats['created'] += 1
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        # connection sat idle for a while: the server may have dropped it
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('connection pool is closed')
+                if self._idle:
+                    # hold the slot while the health check pings outside the lock
+                    conn, last_used = self._idle.pop()
+                    self._in_use.add(conn)
+                    self._cond.release()
+                    try:
+                        healthy = self._healthy(conn, last_used)
+                    finally:
+                        self._cond.acquire()
+                        self._in_use.discard(conn)
+                    if not healthy:
+                        self._discard(conn)
+                        self._cond.notify()
+                        continue
+                    break
+                if len(self._in_use) < self.maxconn:
+                    # reserve the slot before connecting outside the lock
+                    placeholder = object()
+                    self._in_use.add(placeholder)
+                    self._cond.release()
+                    try:
+                        conn = get_connection()
+                    finally:
+                        self._cond.acquire()
+                        self._in_use.discard(placeholder)
+                    self._stats['created'] += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'no free connection after {self.timeout:.1f}s (maxconn={self.maxconn})')
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self._in_use.add(conn)
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            self._in_use.discard(conn)
+            if not discard and not conn.closed:
+                status = conn.get_transaction_status()
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    # a failed or abandoned transaction must not leak to the next user
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        discard = True
+            if discard or conn.closed or self._closed or len(self._idle) >= self.maxconn:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data['idle'] = len(self._idle)
+            data['in_use'] = len(self._in_use)
+            data['wait_time_avg'] = data['wait_time_total'] / data['checkouts'] if data['checkouts'] else 0.0
+            return data
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = ConnectionPool(**POOL_CONFIG)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def run_query(query, params=None, fetch=False):
+    # blocking; from the GUI go through EntityTab.run_async or the executor
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(query, params or ())
+            data = None
+            if fetch:
+                data = cur.fetchall()
+        finally:
+            cur.close()
+    return data
+
+
+@contextmanager
+def transaction():
+    # pooled connection with autocommit off; commits on success, rolls back on error
+    with get_pool().connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn:
+                yield conn
+        finally:
+            if not conn.closed:
+                conn.autocommit = True
+
+
+def hash_password(plain: str) -> str:
+    return hashlib.sha256(plain.encode('utf-8')).hexdigest()
+
+
+LOGIN_QUERY = "SELECT id, username, full_name, role FROM users WHERE username=%s AND password_hash=%s"
+
+
+def lookup_user(username, hashed):
+    # (id, username, full_name, role), or None for a wrong username / password
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute(LOGIN_QUERY, (username, hashed))
+        row = cur.fetchone()
+        cur.close()
+    return row
+
+
+def like_pattern(text, prefix=False):
+    # escape LIKE wildcards typed by the user
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%' if prefix else '%' + escaped + '%'
+
+
+# Indexes behind the search bars: text_pattern_ops btrees serve prefix LIKE
+# lookups, trigram GIN indexes serve substring ILIKE lookups. The trigram
+# ones need the pg_trgm extension, so they are a migration of their own.
+SEARCH_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS book_isbn_prefix_idx ON book (isbn text_pattern_ops);",
+    "CREATE INDEX IF NOT EXISTS member_email_prefix_idx ON member (lower(email) text_pattern_ops);",
+    "CREATE INDEX IF NOT EXISTS member_phone_prefix_idx ON member (phone text_pattern_ops);",
+]
+
+TRIGRAM_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+    "CREATE INDEX IF NOT EXISTS book_title_trgm_idx ON book USING gin (title gin_trgm_ops);",
+    "CREATE INDEX IF NOT EXISTS author_name_trgm_idx ON author USING gin (name gin_trgm_ops);",
+    "CREATE INDEX IF NOT EXISTS member_name_trgm_idx ON member USING gin (name gin_trgm_ops);",
+]
+
+
+# tables created by schema migration 1
+BASE_SCHEMA_DDL = [
+    # users table for authentication
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        full_name TEXT,
+        role TEXT DEFAULT 'staff'
+    );
+    """,
+    # authors (expanded)
+    """
+    CREATE TABLE IF NOT EXISTS author (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        bio TEXT,
+        nationality TEXT,
+        birth_year INTEGER
+    );
+    """,
+    # members (expanded)
+    """
+    CREATE TABLE IF NOT EXISTS member (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE,
+        phone TEXT,
+        membership_type TEXT,
+        join_date DATE
+    );
+    """,
+    # bookclubs (expanded)
+    """
+    CREATE TABLE IF NOT EXISTS bookclub (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        meeting_day TEXT
+    );
+    """,
+    # books (expanded)
+    """
+    CREATE TABLE IF NOT EXISTS book (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        author_id INTEGER REFERENCES author(id) ON DELETE SET NULL,
+        isbn TEXT UNIQUE,
+        publisher TEXT,
+        published_year INTEGER,
+        genre TEXT,
+        copies_available INTEGER DEFAULT 1
+    );
+    """,
+    # loans table
+    """
+    CREATE TABLE IF NOT EXISTS loan (
+        id SERIAL PRIMARY KEY,
+        book_id INTEGER REFERENCES book(id) ON DELETE CASCADE,
+        member_id INTEGER REFERENCES member(id) ON DELETE CASCADE,
+        loan_date DATE,
+        due_date DATE,
+        return_date DATE,
+        status TEXT
+    );
+    """
+]
+
+# create default admin user if not exists (username: man, password: man)
+DEFAULT_ADMIN_SQL = (
+    "INSERT INTO users (username, password_hash, full_name, role) VALUES (%s, %s, %s, %s) ON CONFLICT (username) DO NOTHING;",
+    ('man', hash_password('man'), 'Administrator', 'admin'))
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def create_tables():
+    # Creates all required tables and indexes by applying pending schema
+    # migrations. Checked once per process; later calls return immediately.
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return []
+        applied = migrate()
+        _schema_ready = True
+        return applied
+
+
+# ---------- QUERY INSTRUMENTATION ----------
+_query_context = threading.local()
+
+# call sites are looked for in the app's own modules only
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_app_files = {}
+
+
+def _is_app_file(filename):
+    known = _app_files.get(filename)
+    if known is None:
+        known = _app_files[filename] = os.path.dirname(os.path.abspath(filename)) == _APP_DIR
+    return known
+
+
+# frames of these are database plumbing, never the call site
+_PLUMBING = ('run_query', 'transaction', 'call_site', 'current_query_tag', 'query_tag',
+             'ConnectionPool.', 'QueryExecutor.', '_QueryTask.', 'EntityTableModel.',
+             'InstrumentedCursor.', 'QueryLog.')
+
+
+def call_site():
+    # "Class.method" (or function) of the innermost caller in the app that is
+    # not plumbing; for a tab that is the subclass method, not the
+    # EntityTab helper it went through
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if _is_app_file(code.co_filename):
+            name = getattr(code, 'co_qualname', code.co_name)
+            if not name.startswith(_PLUMBING):
+                owner = frame.f_locals.get('self')
+                if owner is None or name.startswith(type(owner).__name__ + '.'):
+                    return name
+        frame = frame.f_back
+    return None
+
+
+def current_query_tag():
+    return getattr(_query_context, 'tag', None) or call_site() or '-'
+
+
+@contextmanager
+def query_tag(tag):
+    # statements run inside are recorded under tag; the executor uses this to
+    # carry the submitting call site over to the worker thread
+    previous = getattr(_query_context, 'tag', None)
+    _query_context.tag = tag
+    try:
+        yield
+    finally:
+        _query_context.tag = previous
+
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_VALUES_RE = re.compile(r"(\([?,\s]*\))(?:\s*,\s*\([?,\s]*\))+")
+
+
+def normalize_statement(query):
+    # one entry per statement shape: literals become ?, execute_values row
+    # lists collapse to their first row, whitespace is squeezed
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _VALUES_RE.sub(r'\1, ...', _LITERAL_RE.sub('?', query))
+    return ' '.join(query.split())
+
+
+class QueryLog:
+    # Totals per (call site, statement) for every execute() on an
+    # instrumented cursor: calls, total / max seconds and rows.
+    def __init__(self, slow_ms=200.0):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, query, seconds, rows, tag=None):
+        tag = tag or current_query_tag()
+        statement = normalize_statement(query)
+        rows = max(rows, 0)
+        with self._lock:
+            entry = self._stats.setdefault((tag, statement), [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += rows
+        if seconds * 1000 >= self.slow_ms:
+            print(f"Slow query ({seconds * 1000:.0f} ms, {rows} rows) [{tag}]: {statement[:300]}")
+
+    def top(self, limit=20):
+        # (tag, calls, total_ms, mean_ms, max_ms, rows, statement), by total time
+        with self._lock:
+            items = list(self._stats.items())
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return [(tag, calls, total * 1000, total * 1000 / calls, worst * 1000, rows, statement)
+                for (tag, statement), (calls, total, worst, rows) in items[:limit]]
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def export(self, path, limit=None):
+        rows = self.top(limit or len(self._stats))
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['call_site', 'calls', 'total_ms', 'mean_ms', 'max_ms', 'rows', 'statement'])
+            writer.writerows(rows)
+        return len(rows)
+
+
+_query_log = None
+
+
+def get_query_log():
+    global _query_log
+    if _query_log is None:
+        _query_log = QueryLog(QUERY_LOG_CONFIG['slow_ms'])
+    return _query_log
+
+
+class InstrumentedCursor(extensions.cursor):
+    # cursor_factory for every app connection; times execute() into the query log
+    def execute(self, query, vars=None):
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            get_query_log().record(query, time.perf_counter() - start, self.rowcount)
+
+
+# ---------- LOAN SERVICE ----------
+# Checkout and return are single statements, so each runs as one atomic
+# transaction in one round trip. The conditional UPDATE row-locks the book;
+# a concurrent checkout of the same book waits for it and then re-checks
+# copies_available > 0, so the last copy can only be lent once.
+# a member with a Ready hold takes the copy set aside for them; anyone else
+# needs one on the shelf. A loan also closes the member's waiting hold.
+CHECKOUT_QUERY = """
+    WITH args AS (
+        SELECT %s::int AS book_id, %s::int AS member_id, %s::date AS loan_date, %s::date AS due_date,
+               %s::text AS status
+    ), claimed AS (
+        UPDATE hold h SET status = 'Fulfilled'
+        FROM args a
+        WHERE h.id = (SELECT id FROM hold WHERE book_id = a.book_id AND member_id = a.member_id
+                      AND status = 'Ready' LIMIT 1)
+        RETURNING h.book_id
+    ), taken AS (
+        UPDATE book b SET copies_available = b.copies_available - 1
+        FROM args a
+        WHERE b.id = a.book_id AND b.copies_available > 0 AND NOT EXISTS (SELECT 1 FROM claimed)
+        RETURNING b.id, b.title
+    ), source AS (
+        SELECT id, title FROM taken
+        UNION ALL
+        SELECT b.id, b.title FROM claimed c JOIN book b ON b.id = c.book_id
+    ), loaned AS (
+        INSERT INTO loan (book_id, member_id, loan_date, due_date, status)
+        SELECT s.id, a.member_id, a.loan_date, a.due_date, a.status FROM source s CROSS JOIN args a
+        RETURNING id, book_id, member_id, loan_date, due_date, return_date, status
+    ), satisfied AS (
+        UPDATE hold h SET status = 'Fulfilled'
+        FROM args a
+        WHERE h.book_id = a.book_id AND h.member_id = a.member_id AND h.status = 'Waiting'
+          AND EXISTS (SELECT 1 FROM loaned)
+    )
+    SELECT l.id, s.title, m.name, l.loan_date, l.due_date, l.return_date, l.status
+    FROM loaned l JOIN source s ON s.id = l.book_id
+    LEFT JOIN member m ON m.id = l.member_id
+"""
+
+# the returned copy goes to the first waiting hold, or back on the shelf;
+# the last column names the member it is now held for
+RETURN_QUERY = """
+    WITH returned AS (
+        UPDATE loan SET return_date = %s, status = 'Returned'
+        WHERE id = %s AND return_date IS NULL
+        RETURNING id, book_id, member_id, loan_date, due_date, return_date, status
+    ), allocated AS (
+        SELECT library_allocate_copy(book_id, id, %s::int) AS hold_id FROM returned
+    )
+    SELECT r.id, b.title, m.name, r.loan_date, r.due_date, r.return_date, r.status, hm.name
+    FROM returned r CROSS JOIN allocated a
+    LEFT JOIN book b ON b.id = r.book_id
+    LEFT JOIN member m ON m.id = r.member_id
+    LEFT JOIN hold h ON h.id = a.hold_id
+    LEFT JOIN member hm ON hm.id = h.member_id
+"""
+
+
+# both return the loan as the Loans tab lists it:
+# (id, title, member name, loan_date, due_date, return_date, status)
+def checkout_book(book_id, member_id, loan_date, due_date, status='On Loan'):
+    # returns the new loan row, or None when no copy is available
+    rows = run_query(CHECKOUT_QUERY, (book_id, member_id, loan_date, due_date, status), fetch=True)
+    return rows[0] if rows else None
+
+
+def return_book(loan_id, return_date):
+    # (loan row, name of the member the copy is now held for or None);
+    # None when the loan does not exist or was already returned
+    rows = run_query(RETURN_QUERY, (return_date, loan_id, HOLD_CONFIG['pickup_days']), fetch=True)
+    return (rows[0][:7], rows[0][7]) if rows else None
+
+
+def authenticate(username, password):
+    # {'id', 'username', 'full_name', 'role'}, or None for a wrong username / password
+    row = lookup_user(username, hash_password(password))
+    if row is None:
+        return None
+    return {'id': row[0], 'username': row[1], 'full_name': row[2], 'role': row[3]}
+
+
+# ---------- BULK IMPORT ----------
+def _text(record, key):
+    val = record.get(key)
+    val = str(val).strip() if val is not None else ''
+    return val or None
+
+
+def _int(record, key, default=None):
+    val = _text(record, key)
+    if val is None:
+        return default
+    try:
+        num = int(val)
+    except ValueError:
+        raise ValueError(f'{key} must be a whole number, got {val!r}')
+    # every imported integer column is an int4
+    if not -2**31 <= num < 2**31:
+        raise ValueError(f'{key} is out of range, got {val!r}')
+    return num
+
+
+def _date(record, key):
+    val = _text(record, key)
+    if val is None:
+        return None
+    try:
+        return date.fromisoformat(val)
+    except ValueError:
+        raise ValueError(f'{key} must be a YYYY-MM-DD date, got {val!r}')
+
+
+def _validate_author(record):
+    name = _text(record, 'name')
+    if not name:
+        raise ValueError('name is required')
+    return {'name': name, 'bio': _text(record, 'bio'), 'nationality': _text(record, 'nationality'),
+            'birth_year': _int(record, 'birth_year')}
+
+
+def _validate_member(record):
+    name = _text(record, 'name')
+    if not name:
+        raise ValueError('name is required')
+    return {'name': name, 'email': _text(record, 'email'), 'phone': _text(record, 'phone'),
+            'membership_type': _text(record, 'membership_type'), 'join_date': _date(record, 'join_date')}
+
+
+def _validate_book(record):
+    title = _text(record, 'title')
+    if not title:
+        raise ValueError('title is required')
+    copies = _int(record, 'copies_available', 1)
+    if copies < 0:
+        raise ValueError('copies_available must not be negative')
+    return {'title': title, 'author': _text(record, 'author'), 'author_id': _int(record, 'author_id'),
+            'isbn': _text(record, 'isbn'), 'publisher': _text(record, 'publisher'),
+            'published_year': _int(record, 'published_year'), 'genre': _text(record, 'genre'),
+            'copies_available': copies}
+
+
+# entity -> (validator, inserted columns, unique column used to spot duplicates)
+IMPORT_SPECS = {
+    'author': (_validate_author, ['name', 'bio', 'nationality', 'birth_year'], None),
+    'member': (_validate_member, ['name', 'email', 'phone', 'membership_type', 'join_date'], 'email'),
+    'book': (_validate_book, ['title', 'author_id', 'isbn', 'publisher', 'published_year', 'genre',
+                              'copies_available'], 'isbn'),
+}
+
+
+def iter_import_records(path):
+    # yields (record, error) pairs without reading the whole file; .csv files
+    # need a header row, anything else is read as JSON Lines
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for record in csv.DictReader(f):
+                yield record, None
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield {'raw': line}, f'invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield {'raw': line}, 'expected a JSON object'
+                continue
+            yield record, None
+
+
+def _resolve_authors(cur, names, cache):
+    # one SELECT for the chunk's unknown names, one INSERT for the missing ones
+    missing = [n for n in names if n not in cache]
+    if not missing:
+        return
+    cur.execute("SELECT name, MIN(id) FROM author WHERE name = ANY(%s) GROUP BY name", (missing,))
+    cache.update(cur.fetchall())
+    to_create = [(n,) for n in missing if n not in cache]
+    if to_create:
+        created = execute_values(cur, "INSERT INTO author (name) VALUES %s RETURNING name, id",
+                                 to_create, fetch=True)
+        cache.update(created)
+
+
+def import_file(entity, path, chunk_size=IMPORT_CHUNK_SIZE, progress=None, rejects_path=None):
+    # Streams records from path into entity's table in chunks of chunk_size,
+    # one transaction per chunk. Invalid or duplicate records, books naming an
+    # unknown author_id and rows the database refuses are written as JSON Lines
+    # to rejects_path (default '<path>.rejected.jsonl').
+    # progress(stats) is called after every chunk. Returns the final stats.
+    validate, columns, unique_col = IMPORT_SPECS[entity]
+    rejects_path = rejects_path or path + '.rejected.jsonl'
+    stats = {'read': 0, 'imported': 0, 'rejected': 0}
+    author_ids = {}
+    insert_sql = f"INSERT INTO {entity} ({', '.join(columns)}) VALUES %s ON CONFLICT DO NOTHING"
+    if unique_col:
+        insert_sql += f" RETURNING {unique_col}"
+
+    with open(rejects_path, 'w', encoding='utf-8') as rejects:
+        def reject(number, record, reason):
+            stats['rejected'] += 1
+            rejects.write(json.dumps({'record': number, 'error': reason, 'data': record}, default=str) + '\n')
+
+        def insert(cur, rows):
+            # -> unique_col values that were inserted (empty without a unique column)
+            values = [tuple(row[c] for c in columns) for _, _, row in rows]
+            if unique_col:
+                return {r[0] for r in execute_values(cur, insert_sql, values, page_size=len(values), fetch=True)}
+            execute_values(cur, insert_sql, values, page_size=len(values))
+            return set()
+
+        def flush(chunk):
+            if not chunk:
+                return
+            failed = {}
+            with transaction() as conn:
+                cur = conn.cursor()
+                if entity == 'book':
+                    ids = list({row['author_id'] for _, _, row in chunk if row['author_id'] is not None})
+                    if ids:
+                        cur.execute("SELECT id FROM author WHERE id = ANY(%s)", (ids,))
+                        known = {r[0] for r in cur.fetchall()}
+                        for number, _, row in chunk:
+                            if row['author_id'] is not None and row['author_id'] not in known:
+                                failed[number] = f"author_id {row['author_id']} does not exist"
+                    _resolve_authors(cur, {row['author'] for _, _, row in chunk
+                                           if row['author'] and row['author_id'] is None}, author_ids)
+                    for _, _, row in chunk:
+                        if row['author'] and row['author_id'] is None:
+                            row['author_id'] = author_ids[row['author']]
+                rows = [item for item in chunk if item[0] not in failed]
+                cur.execute("SAVEPOINT import_chunk")
+                try:
+                    kept = insert(cur, rows) if rows else set()
+                except (psycopg2.Error, ValueError):
+                    # one bad row fails the whole INSERT (or its quoting, e.g. a NUL
+                    # character): redo the chunk row by row
+                    cur.execute("ROLLBACK TO SAVEPOINT import_chunk")
+                    kept = set()
+                    for item in rows:
+                        cur.execute("SAVEPOINT import_row")
+                        try:
+                            kept |= insert(cur, [item])
+                        except (psycopg2.Error, ValueError) as e:
+                            cur.execute("ROLLBACK TO SAVEPOINT import_row")
+                            failed[item[0]] = (getattr(e, 'pgerror', None) or str(e)).strip()
+                        else:
+                            cur.execute("RELEASE SAVEPOINT import_row")
+                cur.close()
+            for number, record, row in chunk:
+                key = row.get(unique_col) if unique_col else None
+                if number in failed:
+                    reject(number, record, failed[number])
+                elif key is not None and key not in kept:
+                    reject(number, record, f'{unique_col} already exists')
+                else:
+                    stats['imported'] += 1
+            if len(author_ids) > 100000:
+                author_ids.clear()
+            if progress:
+                progress(dict(stats))
+
+        chunk = []
+        seen = set()
+        for record, error in iter_import_records(path):
+            stats['read'] += 1
+            number = stats['read']
+            if error is None:
+                try:
+                    row = validate(record)
+                except ValueError as e:
+                    error = str(e)
+            if error is None and unique_col and row[unique_col] is not None:
+                # duplicates inside one INSERT would be indistinguishable afterwards
+                if row[unique_col] in seen:
+                    error = f'duplicate {unique_col} in file'
+                seen.add(row[unique_col])
+            if error is not None:
+                reject(number, record, error)
+                continue
+            chunk.append((number, record, row))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+                seen = set()
+        flush(chunk)
+    return stats
+
+
+# ---------- EXPORT ----------
+# entity -> (query, [(column, arrow type)]); 'loan' is the joined view shown in LoanTab
+EXPORT_SPECS = {
+    'author': ("SELECT id, name, nationality, birth_year, bio FROM author ORDER BY id",
+               [('id', 'int64'), ('name', 'string'), ('nationality', 'string'), ('birth_year', 'int64'),
+                ('bio', 'string')]),
+    'book': ("""
+        SELECT b.id, b.title, a.name, b.isbn, b.publisher, b.published_year, b.genre, b.copies_available
+        FROM book b LEFT JOIN author a ON b.author_id = a.id
+        ORDER BY b.id
+    """, [('id', 'int64'), ('title', 'string'), ('author', 'string'), ('isbn', 'string'),
+          ('publisher', 'string'), ('published_year', 'int64'), ('genre', 'string'),
+          ('copies_available', 'int64')]),
+    'member': ("SELECT id, name, email, phone, membership_type, join_date FROM member ORDER BY id",
+               [('id', 'int64'), ('name', 'string'), ('email', 'string'), ('phone', 'string'),
+                ('membership_type', 'string'), ('join_date', 'date32')]),
+    'bookclub': ("SELECT id, name, meeting_day, description FROM bookclub ORDER BY id",
+                 [('id', 'int64'), ('name', 'string'), ('meeting_day', 'string'), ('description', 'string')]),
+    'loan': ("""
+        SELECT l.id, b.title, m.name, l.loan_date, l.due_date, l.return_date, l.status
+        FROM loan l
+        LEFT JOIN book b ON l.book_id = b.id
+        LEFT JOIN member m ON l.member_id = m.id
+        ORDER BY l.id
+    """, [('id', 'int64'), ('book', 'string'), ('member', 'string'), ('loan_date', 'date32'),
+          ('due_date', 'date32'), ('return_date', 'date32'), ('status', 'string')]),
+}
+
+EXPORT_FORMATS = ('csv', 'parquet')
+
+
+class _CsvBatchWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetBatchWriter:
+    # one row group per batch; pyarrow is only needed for this format
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet export needs the pyarrow package (pip install pyarrow)')
+        self.pa = pyarrow
+        self.names = [name for name, _ in columns]
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        arrays = [self.pa.array(col, type=field.type) for col, field in zip(zip(*rows), self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_table(entity, path, fmt=None, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    # Streams the entity's rows from a named (server-side) cursor to CSV or
+    # Parquet, batch_size rows at a time; the full result never sits in memory.
+    # fmt defaults to the file extension. progress(rows_written) follows each batch.
+    query, columns = EXPORT_SPECS[entity]
+    fmt = (fmt or os.path.splitext(path)[1].lstrip('.') or 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'unsupported export format {fmt!r}; use one of {", ".join(EXPORT_FORMATS)}')
+    writer = (_ParquetBatchWriter if fmt == 'parquet' else _CsvBatchWriter)(path, columns)
+    written = 0
+    try:
+        # named cursors only live inside a transaction
+        with transaction() as conn:
+            cur = conn.cursor(name=f'export_{entity}')
+            cur.itersize = batch_size
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                writer.write(rows)
+                written += len(rows)
+                if progress:
+                    progress(written)
+            cur.close()
+    finally:
+        writer.close()
+    return written
+
+
+# ---------- OVERDUE SWEEP ----------
+# One set-based UPDATE per run. The partial index on open loans keeps the
+# scan proportional to unreturned loans, not to the whole loan history.
+OVERDUE_SWEEP_QUERY = """
+    UPDATE loan SET status = 'Overdue'
+    WHERE return_date IS NULL
+      AND due_date < %s
+      AND COALESCE(status, 'On Loan') = 'On Loan'
+"""
+
+
+def sweep_overdue(today=None):
+    # returns the number of loans newly marked overdue
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute(OVERDUE_SWEEP_QUERY, (today or date.today(),))
+        count = cur.rowcount
+        cur.close()
+    return count
+
+
+# ---------- DASHBOARD STATS ----------
+STATS_KEYS = ('books', 'authors', 'members', 'active_loans', 'overdue_loans', 'out_of_stock')
+
+# every dashboard metric in one round trip
+STATS_QUERY = """
+    SELECT b.books, a.authors, m.members, l.active_loans, l.overdue_loans, b.out_of_stock
+    FROM (SELECT COUNT(*) AS books,
+                 COUNT(*) FILTER (WHERE copies_available = 0) AS out_of_stock
+          FROM book) b,
+         (SELECT COUNT(*) AS authors FROM author) a,
+         (SELECT COUNT(*) AS members FROM member) m,
+         (SELECT COUNT(*) FILTER (WHERE status = 'On Loan') AS active_loans,
+                 COUNT(*) FILTER (WHERE status = 'Overdue') AS overdue_loans
+          FROM loan) l
+"""
+
+STATS_SUMMARY_QUERY = """
+    SELECT books, authors, members, active_loans, overdue_loans, out_of_stock
+    FROM library_stats WHERE id = 1
+"""
+
+# Single-row counter table maintained by row triggers. Every write to the
+# counted tables also updates this row, so it is opt-in (STATS_CONFIG).
+# TRUNCATE is not tracked; re-seed by deleting the row and re-inserting it
+# with the seed statement below.
+STATS_SUMMARY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS library_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        books BIGINT NOT NULL DEFAULT 0,
+        authors BIGINT NOT NULL DEFAULT 0,
+        members BIGINT NOT NULL DEFAULT 0,
+        active_loans BIGINT NOT NULL DEFAULT 0,
+        overdue_loans BIGINT NOT NULL DEFAULT 0,
+        out_of_stock BIGINT NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION library_stats_count() RETURNS trigger AS $$
+    DECLARE
+        delta INTEGER := CASE TG_OP WHEN 'INSERT' THEN 1 WHEN 'DELETE' THEN -1 ELSE 0 END;
+    BEGIN
+        IF TG_TABLE_NAME = 'book' THEN
+            UPDATE library_stats SET
+                books = books + delta,
+                out_of_stock = out_of_stock
+                    + (CASE WHEN TG_OP <> 'DELETE' AND NEW.copies_available = 0 THEN 1 ELSE 0 END)
+                    - (CASE WHEN TG_OP <> 'INSERT' AND OLD.copies_available = 0 THEN 1 ELSE 0 END)
+            WHERE id = 1;
+        ELSIF TG_TABLE_NAME = 'author' THEN
+            UPDATE library_stats SET authors = authors + delta WHERE id = 1;
+        ELSIF TG_TABLE_NAME = 'member' THEN
+            UPDATE library_stats SET members = members + delta WHERE id = 1;
+        ELSIF TG_TABLE_NAME = 'loan' THEN
+            UPDATE library_stats SET
+                active_loans = active_loans
+                    + (CASE WHEN TG_OP <> 'DELETE' AND NEW.status = 'On Loan' THEN 1 ELSE 0 END)
+                    - (CASE WHEN TG_OP <> 'INSERT' AND OLD.status = 'On Loan' THEN 1 ELSE 0 END),
+                overdue_loans = overdue_loans
+                    + (CASE WHEN TG_OP <> 'DELETE' AND NEW.status = 'Overdue' THEN 1 ELSE 0 END)
+                    - (CASE WHEN TG_OP <> 'INSERT' AND OLD.status = 'Overdue' THEN 1 ELSE 0 END)
+            WHERE id = 1;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    # seed with the current counts the first time only
+    "INSERT INTO library_stats (id, books, authors, members, active_loans, overdue_loans, out_of_stock) "
+    "SELECT 1, * FROM (" + STATS_QUERY + ") s ON CONFLICT (id) DO NOTHING;",
+] + [
+    f"""
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'library_stats_{table}') THEN
+            CREATE TRIGGER library_stats_{table}
+            AFTER {events} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE library_stats_count();
+        END IF;
+    END $$;
+    """
+    for table, events in (
+        ('book', 'INSERT OR DELETE OR UPDATE OF copies_available'),
+        ('author', 'INSERT OR DELETE'),
+        ('member', 'INSERT OR DELETE'),
+        ('loan', 'INSERT OR DELETE OR UPDATE OF status'),
+    )
+]
+
+
+class StatsCache:
+    # Dashboard snapshot shared by every window. A snapshot younger than `ttl`
+    # seconds is served from memory; writes call invalidate() so the next
+    # refresh goes back to the database.
+    def __init__(self, ttl=30.0, summary_table=False):
+        self.ttl = ttl
+        self.summary_table = summary_table
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._taken_at = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._taken_at < self.ttl:
+                return dict(self._snapshot)
+        results = self.fetch()
+        with self._lock:
+            self._snapshot = results
+            self._taken_at = time.monotonic()
+        return dict(results)
+
+    def fetch(self):
+        with get_pool().connection() as conn:
+            cur = conn.cursor()
+            row = None
+            if self.summary_table:
+                cur.execute(STATS_SUMMARY_QUERY)
+                row = cur.fetchone()
+            if row is None:
+                cur.execute(STATS_QUERY)
+                row = cur.fetchone()
+            cur.close()
+        return dict(zip(STATS_KEYS, row))
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+_stats_cache = None
+
+
+def get_stats_cache():
+    global _stats_cache
+    if _stats_cache is None:
+        _stats_cache = StatsCache(**STATS_CONFIG)
+    return _stats_cache
+
+
+# ---------- ENTITY CACHE ----------
+# one batched read per table for the ids missing from the cache
+ENTITY_CACHE_QUERIES = {
+    'author': "SELECT id, name FROM author WHERE id = ANY(%s)",
+    'book': "SELECT id, title FROM book WHERE id = ANY(%s)",
+    'member': "SELECT id, name FROM member WHERE id = ANY(%s)",
+}
+
+
+class EntityCache:
+    # Read-through cache of (id, name) records keyed by (table, id), shared by
+    # every tab and worker thread. Misses are read in a single query per call.
+    # Writes and change notifications call invalidate(); a read that was in
+    # flight across an invalidation is not stored.
+    def __init__(self, max_entries=100000, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._generation = {table: 0 for table in ENTITY_CACHE_QUERIES}
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get_many(self, table, ids):
+        # {id: record} for the given ids; unknown ids are left out
+        found, missing, generation = self.lookup(table, ids)
+        if missing:
+            rows = run_query(ENTITY_CACHE_QUERIES[table], (missing,), fetch=True) or []
+            self.put_many(table, rows, generation)
+            found.update((row[0], row) for row in rows)
+        return found
+
+    def lookup(self, table, ids):
+        # (found, missing ids, generation) without reading the database; the
+        # caller reads the misses itself and passes generation to put_many
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation[table]
+            for item_id in set(ids):
+                if item_id is None:
+                    continue
+                entry = self._records.get((table, item_id))
+                if entry is not None and now - entry[0] < self.ttl:
+                    self._records.move_to_end((table, item_id))
+                    found[item_id] = entry[1]
+                    self.stats['hits'] += 1
+                    continue
+                if entry is not None:
+                    self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                missing.append(item_id)
+        return found, missing, generation
+
+    def get(self, table, item_id):
+        return self.get_many(table, [item_id]).get(item_id)
+
+    def names(self, table, ids):
+        # {id: name or title}, the common case for display columns
+        return {item_id: row[1] for item_id, row in self.get_many(table, ids).items()}
+
+    def put_many(self, table, rows, generation=None):
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and generation != self._generation[table]:
+                return
+            for row in rows:
+                self._records[(table, row[0])] = (now, tuple(row))
+                self._records.move_to_end((table, row[0]))
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, table=None, ids=None):
+        # drop the given ids of a table, a whole table, or everything
+        with self._lock:
+            self.stats['invalidations'] += 1
+            for name in ([table] if table else list(self._generation)):
+                if name in self._generation:
+                    self._generation[name] += 1
+            if table is None:
+                self._records.clear()
+            elif ids is None:
+                for key in [k for k in self._records if k[0] == table]:
+                    del self._records[key]
+            else:
+                for item_id in ids:
+                    self._records.pop((table, item_id), None)
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats, size=len(self._records))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+_entity_cache = None
+
+
+def get_entity_cache():
+    global _entity_cache
+    if _entity_cache is None:
+        _entity_cache = EntityCache(**ENTITY_CACHE_CONFIG)
+    return _entity_cache
+
+
+def resolve_column(rows, col, table):
+    # swap the ids in column col for names read through the entity cache
+    names = get_entity_cache().names(table, [row[col] for row in rows])
+    return [row[:col] + (names.get(row[col]),) + row[col + 1:] for row in rows]
+
+
+# listings shared by the tabs, the benchmark and the API; id columns that
+# show another entity's name are resolved with resolve_column
+BOOK_LISTING = """
+    SELECT b.id, b.title, b.author_id, b.isbn, b.publisher, b.published_year, b.genre, b.copies_available
+    FROM book b
+"""
+
+LOAN_LISTING = """
+    SELECT l.id, l.book_id, l.member_id, l.loan_date, l.due_date, l.return_date, l.status
+    FROM loan l
+"""
+
+
+# ---------- ENTITY OPERATIONS ----------
+# written columns, the column that may not be empty, and the row handed back
+# in the column order of the entity's listing
+ENTITY_SPECS = {
+    'author': {'columns': ('name', 'bio', 'nationality', 'birth_year'), 'required': 'name',
+               'returning': ('id', 'name', 'nationality', 'birth_year', 'bio')},
+    'book': {'columns': ('title', 'author_id', 'isbn', 'publisher', 'published_year', 'genre', 'copies_available'),
+             'required': 'title',
+             'returning': ('id', 'title', 'author_id', 'isbn', 'publisher', 'published_year', 'genre',
+                           'copies_available')},
+    'member': {'columns': ('name', 'email', 'phone', 'membership_type', 'join_date'), 'required': 'name',
+               'returning': ('id', 'name', 'email', 'phone', 'membership_type', 'join_date')},
+    'bookclub': {'columns': ('name', 'description', 'meeting_day'), 'required': 'name',
+                 'returning': ('id', 'name', 'meeting_day', 'description')},
+}
+
+# (select, id column, search condition, pattern kind per search parameter);
+# 'contains' is a substring pattern and 'prefix' a starts-with pattern
+LISTINGS = {
+    'author': ("SELECT id, name, nationality, birth_year, bio FROM author", 'id',
+               "AND name ILIKE %s", ('contains',)),
+    # title or author substring, or ISBN prefix
+    'book': (BOOK_LISTING, 'b.id',
+             "AND (b.title ILIKE %s OR b.author_id IN (SELECT id FROM author WHERE name ILIKE %s) "
+             "OR b.isbn LIKE %s)", ('contains', 'contains', 'prefix')),
+    # name substring, or email / phone prefix
+    'member': ("SELECT id, name, email, phone, membership_type, join_date FROM member", 'id',
+               "AND (name ILIKE %s OR lower(email) LIKE lower(%s) OR phone LIKE %s)",
+               ('contains', 'prefix', 'prefix')),
+    'bookclub': ("SELECT id, name, meeting_day, description FROM bookclub", 'id', '', ()),
+    'loan': (LOAN_LISTING, 'l.id', '', ()),
+}
+
+# (column, table) of the listing columns holding ids that are shown as names
+LISTING_NAME_COLUMNS = {'book': ((2, 'author'),), 'loan': ((1, 'book'), (2, 'member'))}
+
+# field names for listing rows once resolved
+LISTING_FIELDS = {
+    'author': ('id', 'name', 'nationality', 'birth_year', 'bio'),
+    'book': ('id', 'title', 'author', 'isbn', 'publisher', 'published_year', 'genre', 'copies_available'),
+    'member': ('id', 'name', 'email', 'phone', 'membership_type', 'join_date'),
+    'bookclub': ('id', 'name', 'meeting_day', 'description'),
+    'loan': ('id', 'book', 'member', 'loan_date', 'due_date', 'return_date', 'status'),
+}
+
+
+def listing(entity, search_text=''):
+    # (select, id column, search condition, search params) of an entity's listing
+    select, id_col, search, kinds = LISTINGS[entity]
+    if not search_text or not search:
+        return select, id_col, '', ()
+    return select, id_col, search, tuple(like_pattern(search_text, prefix=kind == 'prefix') for kind in kinds)
+
+
+def listing_page_query(select, id_col, search=''):
+    # keyset page; takes (last_id, *search params, limit)
+    return f"{select} WHERE {id_col} > %s {search} ORDER BY {id_col} LIMIT %s"
+
+
+def resolve_listing(entity, rows):
+    for col, table in LISTING_NAME_COLUMNS.get(entity, ()):
+        rows = resolve_column(rows, col, table)
+    return rows
+
+
+def list_page(entity, after_id=0, limit=PAGE_SIZE, search_text=''):
+    # one page of the listing after after_id, names resolved
+    select, id_col, search, params = listing(entity, search_text)
+    rows = run_query(listing_page_query(select, id_col, search), (after_id, *params, limit), fetch=True)
+    return resolve_listing(entity, rows or [])
+
+
+def save_entity(entity, fields, entity_id=None):
+    # inserts (entity_id None) or updates one row from a {column: value} dict
+    # and returns it as the listing shows it (ids unresolved), or None when
+    # entity_id does not exist
+    spec = ENTITY_SPECS[entity]
+    if not fields.get(spec['required']):
+        raise ValueError(f"{entity} {spec['required']} is required")
+    columns = [c for c in spec['columns'] if c in fields]
+    values = [fields[c] for c in columns]
+    returning = sql.SQL(', ').join(map(sql.Identifier, spec['returning']))
+    if entity_id is None:
+        query = sql.SQL("INSERT INTO {} ({}) VALUES ({}) RETURNING {}").format(
+            sql.Identifier(entity), sql.SQL(', ').join(map(sql.Identifier, columns)),
+            sql.SQL(', ').join([sql.Placeholder()] * len(columns)), returning)
+    else:
+        query = sql.SQL("UPDATE {} SET {} WHERE id = %s RETURNING {}").format(
+            sql.Identifier(entity),
+            sql.SQL(', ').join(sql.SQL("{} = %s").format(sql.Identifier(c)) for c in columns), returning)
+        values.append(entity_id)
+    rows = run_query(query, values, fetch=True)
+    return rows[0] if rows else None
+
+
+def delete_entity(entity, entity_id):
+    # True when the row existed
+    if entity not in LISTINGS:
+        raise ValueError(f"unknown entity: {entity}")
+    query = sql.SQL("DELETE FROM {} WHERE id = %s RETURNING id").format(sql.Identifier(entity))
+    return bool(run_query(query, (entity_id,), fetch=True))
+
+
+# ---------- CHANGE NOTIFICATIONS ----------
+CHANGE_TABLES = ('author', 'book', 'member', 'bookclub', 'loan')
+
+# every committed row change sends {"table", "op", "id"} on the change channel
+CHANGE_NOTIFY_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION library_notify_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{CHANGE_CONFIG['channel']}', json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+] + [
+    f"""
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'library_notify_{table}') THEN
+            CREATE TRIGGER library_notify_{table}
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE library_notify_change();
+        END IF;
+    END $$;
+    """
+    for table in CHANGE_TABLES
+]
+
+
+def parse_change(payload):
+    # (table, id) from a notification payload, or None if it is not one of ours
+    try:
+        change = json.loads(payload)
+        table, row_id = change['table'], int(change['id'])
+    except (ValueError, TypeError, KeyError):
+        return None
+    return (table, row_id) if table in CHANGE_TABLES else None
+
+
+# ---------- CIRCULATION ANALYTICS ----------
+# Rollups kept beside the loan table. A row trigger journals every change to
+# a loan's book, member, dates or existence as a -1 (old) / +1 (new)
+# contribution; refresh_analytics() folds the journal into the rollups and
+# deletes what it consumed. Rows are consumed with DELETE ... RETURNING rather
+# than "seq > last watermark", so a journal row committed late by a slower
+# transaction is picked up by the next refresh instead of being skipped.
+# Loans removed by ON DELETE CASCADE (a deleted book or member) stay counted:
+# the rollups are circulation history.
+ANALYTICS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS loan_journal (
+        seq BIGSERIAL PRIMARY KEY,
+        book_id INTEGER,
+        member_id INTEGER,
+        genre TEXT,
+        loan_date DATE,
+        days INTEGER,
+        sign SMALLINT NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS loan_rollup_book (
+        book_id INTEGER PRIMARY KEY,
+        loans BIGINT NOT NULL DEFAULT 0,
+        returned BIGINT NOT NULL DEFAULT 0,
+        total_days BIGINT NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS loan_rollup_member (
+        member_id INTEGER PRIMARY KEY,
+        loans BIGINT NOT NULL DEFAULT 0,
+        returned BIGINT NOT NULL DEFAULT 0,
+        total_days BIGINT NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS loan_rollup_genre_month (
+        genre TEXT NOT NULL,
+        month DATE NOT NULL,
+        loans BIGINT NOT NULL DEFAULT 0,
+        returned BIGINT NOT NULL DEFAULT 0,
+        total_days BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (genre, month)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analytics_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_seq BIGINT NOT NULL DEFAULT 0,
+        last_batch BIGINT NOT NULL DEFAULT 0,
+        refreshed_at TIMESTAMPTZ
+    );
+    """,
+    "INSERT INTO analytics_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;",
+    "CREATE INDEX IF NOT EXISTS loan_rollup_book_loans_idx ON loan_rollup_book (loans DESC);",
+    "CREATE INDEX IF NOT EXISTS loan_rollup_member_loans_idx ON loan_rollup_member (loans DESC);",
+    "CREATE INDEX IF NOT EXISTS loan_rollup_genre_month_month_idx ON loan_rollup_genre_month (month);",
+    """
+    CREATE OR REPLACE FUNCTION loan_journal_record() RETURNS trigger AS $$
+    BEGIN
+        -- depth > 1: removed by a cascade from book / member, keep it counted
+        IF TG_OP = 'DELETE' AND pg_trigger_depth() > 1 THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO loan_journal (book_id, member_id, genre, loan_date, days, sign)
+            SELECT OLD.book_id, OLD.member_id, (SELECT genre FROM book WHERE id = OLD.book_id),
+                   OLD.loan_date, OLD.return_date - OLD.loan_date, -1;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO loan_journal (book_id, member_id, genre, loan_date, days, sign)
+            SELECT NEW.book_id, NEW.member_id, (SELECT genre FROM book WHERE id = NEW.book_id),
+                   NEW.loan_date, NEW.return_date - NEW.loan_date, 1;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'loan_journal_loan') THEN
+            CREATE TRIGGER loan_journal_loan
+            AFTER INSERT OR DELETE OR UPDATE OF book_id, member_id, loan_date, return_date ON loan
+            FOR EACH ROW EXECUTE PROCEDURE loan_journal_record();
+        END IF;
+    END $$;
+    """,
+]
+
+# A book's genre change is journaled too: a -1 under the old genre and a +1
+# under the new one for each of its loans (book and member ids left NULL, so
+# only the genre rollup moves). The loan trigger reads the genre FOR SHARE,
+# so a loan written while a genre change is in flight waits for it and then
+# journals under the committed genre.
+GENRE_JOURNAL_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION loan_journal_record() RETURNS trigger AS $$
+    BEGIN
+        -- depth > 1: removed by a cascade from book / member, keep it counted
+        IF TG_OP = 'DELETE' AND pg_trigger_depth() > 1 THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO loan_journal (book_id, member_id, genre, loan_date, days, sign)
+            SELECT OLD.book_id, OLD.member_id, (SELECT genre FROM book WHERE id = OLD.book_id FOR SHARE),
+                   OLD.loan_date, OLD.return_date - OLD.loan_date, -1;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO loan_journal (book_id, member_id, genre, loan_date, days, sign)
+            SELECT NEW.book_id, NEW.member_id, (SELECT genre FROM book WHERE id = NEW.book_id FOR SHARE),
+                   NEW.loan_date, NEW.return_date - NEW.loan_date, 1;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION loan_journal_genre() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO loan_journal (book_id, member_id, genre, loan_date, days, sign)
+        SELECT NULL, NULL, g.genre, l.loan_date, l.return_date - l.loan_date, g.sign
+        FROM loan l, (VALUES (OLD.genre, -1), (NEW.genre, 1)) AS g (genre, sign)
+        WHERE l.book_id = NEW.id AND l.loan_date IS NOT NULL;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'loan_journal_book_genre') THEN
+            CREATE TRIGGER loan_journal_book_genre
+            AFTER UPDATE OF genre ON book
+            FOR EACH ROW WHEN (OLD.genre IS DISTINCT FROM NEW.genre)
+            EXECUTE PROCEDURE loan_journal_genre();
+        END IF;
+    END $$;
+    """,
+]
+
+# full recount from the loan table; the migration runs it once, and
+# rebuild_analytics() after loads that bypass the trigger
+ANALYTICS_SEED = [
+    "TRUNCATE loan_journal, loan_rollup_book, loan_rollup_member, loan_rollup_genre_month;",
+    """
+    INSERT INTO loan_rollup_book (book_id, loans, returned, total_days)
+    SELECT book_id, count(*), count(return_date), COALESCE(sum(return_date - loan_date), 0)
+    FROM loan WHERE book_id IS NOT NULL GROUP BY book_id;
+    """,
+    """
+    INSERT INTO loan_rollup_member (member_id, loans, returned, total_days)
+    SELECT member_id, count(*), count(return_date), COALESCE(sum(return_date - loan_date), 0)
+    FROM loan WHERE member_id IS NOT NULL GROUP BY member_id;
+    """,
+    """
+    INSERT INTO loan_rollup_genre_month (genre, month, loans, returned, total_days)
+    SELECT COALESCE(b.genre, 'Unknown'), date_trunc('month', l.loan_date)::date,
+           count(*), count(l.return_date), COALESCE(sum(l.return_date - l.loan_date), 0)
+    FROM loan l LEFT JOIN book b ON b.id = l.book_id
+    WHERE l.loan_date IS NOT NULL GROUP BY 1, 2;
+    """,
+    "UPDATE analytics_state SET last_seq = 0, last_batch = 0, refreshed_at = now() WHERE id = 1;",
+]
+
+# one statement: consume the journal, apply the summed deltas to each rollup
+# and record the watermark
+ANALYTICS_REFRESH_QUERY = """
+    WITH batch AS (
+        DELETE FROM loan_journal RETURNING *
+    ), by_book AS (
+        INSERT INTO loan_rollup_book AS r (book_id, loans, returned, total_days)
+        SELECT book_id, sum(sign), COALESCE(sum(sign) FILTER (WHERE days IS NOT NULL), 0),
+               COALESCE(sum(sign * days), 0)
+        FROM batch WHERE book_id IS NOT NULL GROUP BY book_id
+        ON CONFLICT (book_id) DO UPDATE SET loans = r.loans + EXCLUDED.loans,
+            returned = r.returned + EXCLUDED.returned, total_days = r.total_days + EXCLUDED.total_days
+    ), by_member AS (
+        INSERT INTO loan_rollup_member AS r (member_id, loans, returned, total_days)
+        SELECT member_id, sum(sign), COALESCE(sum(sign) FILTER (WHERE days IS NOT NULL), 0),
+               COALESCE(sum(sign * days), 0)
+        FROM batch WHERE member_id IS NOT NULL GROUP BY member_id
+        ON CONFLICT (member_id) DO UPDATE SET loans = r.loans + EXCLUDED.loans,
+            returned = r.returned + EXCLUDED.returned, total_days = r.total_days + EXCLUDED.total_days
+    ), by_genre AS (
+        INSERT INTO loan_rollup_genre_month AS r (genre, month, loans, returned, total_days)
+        SELECT COALESCE(genre, 'Unknown'), date_trunc('month', loan_date)::date, sum(sign),
+               COALESCE(sum(sign) FILTER (WHERE days IS NOT NULL), 0), COALESCE(sum(sign * days), 0)
+        FROM batch WHERE loan_date IS NOT NULL GROUP BY 1, 2
+        ON CONFLICT (genre, month) DO UPDATE SET loans = r.loans + EXCLUDED.loans,
+            returned = r.returned + EXCLUDED.returned, total_days = r.total_days + EXCLUDED.total_days
+    )
+    UPDATE analytics_state SET
+        last_seq = GREATEST(last_seq, COALESCE((SELECT max(seq) FROM batch), 0)),
+        last_batch = (SELECT count(*) FROM batch),
+        refreshed_at = now()
+    WHERE id = 1
+    RETURNING last_batch
+"""
+
+# pg_try_advisory_xact_lock key; a refresh already running makes others return at once
+ANALYTICS_LOCK_ID = 7340022
+
+# report name -> (query, columns); every query reads rollups only
+ANALYTICS_REPORTS = {
+    'top_books': ("""
+        SELECT b.title, r.loans, round(r.total_days::numeric / NULLIF(r.returned, 0), 1)
+        FROM loan_rollup_book r JOIN book b ON b.id = r.book_id
+        ORDER BY r.loans DESC LIMIT %(top_n)s
+    """, ('Book', 'Loans', 'Avg days')),
+    'busiest_members': ("""
+        SELECT m.name, r.loans, round(r.total_days::numeric / NULLIF(r.returned, 0), 1)
+        FROM loan_rollup_member r JOIN member m ON m.id = r.member_id
+        ORDER BY r.loans DESC LIMIT %(top_n)s
+    """, ('Member', 'Loans', 'Avg days')),
+    'genre_months': ("""
+        SELECT to_char(month, 'YYYY-MM'), genre, loans, round(total_days::numeric / NULLIF(returned, 0), 1)
+        FROM loan_rollup_genre_month
+        WHERE month >= (date_trunc('month', current_date) - make_interval(months => %(months)s - 1))::date
+        ORDER BY month DESC, loans DESC
+    """, ('Month', 'Genre', 'Loans', 'Avg days')),
+    'loan_duration': ("""
+        SELECT sum(loans), sum(returned), round(sum(total_days)::numeric / NULLIF(sum(returned), 0), 1)
+        FROM loan_rollup_genre_month
+    """, ('Loans', 'Returned', 'Avg days')),
+}
+
+
+def refresh_analytics():
+    # folds journaled loan changes into the rollups; returns the number of
+    # journal rows consumed, or None when another refresh holds the lock
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (ANALYTICS_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            cur.close()
+            return None
+        cur.execute(ANALYTICS_REFRESH_QUERY)
+        consumed = cur.fetchone()[0]
+        cur.close()
+    return consumed
+
+
+def rebuild_analytics():
+    # recounts every rollup from the loan table
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (ANALYTICS_LOCK_ID,))
+        # keep loan writes out until the recount commits
+        cur.execute("LOCK TABLE loan IN SHARE MODE")
+        for statement in ANALYTICS_SEED:
+            cur.execute(statement)
+        cur.close()
+
+
+def analytics_report(top_n=None, months=None):
+    # {report name: rows}, read in one round trip per report from the rollups
+    params = {'top_n': top_n or ANALYTICS_CONFIG['top_n'], 'months': months or ANALYTICS_CONFIG['months']}
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        reports = {}
+        for name, (query, _) in ANALYTICS_REPORTS.items():
+            cur.execute(query, params)
+            reports[name] = cur.fetchall()
+        cur.close()
+    return reports
+
+
+# ---------- RECOMMENDATIONS ----------
+# "Members who borrowed this also borrowed". member_book is the distinct
+# member x book incidence, book_cooccurrence the sparse item-item matrix
+# (both directions stored) and book_neighbours its top_k per book. New loans
+# are queued by a trigger; refresh_recommendations() adds only the pairs the
+# queued loans create and re-ranks the books they touched.
+# library_recommend.rebuild_recommendations() recomputes everything with NumPy.
+RECO_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS reco_queue (
+        seq BIGSERIAL PRIMARY KEY,
+        member_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS member_book (
+        member_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        PRIMARY KEY (member_id, book_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS book_borrowers (
+        book_id INTEGER PRIMARY KEY,
+        borrowers INTEGER NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS book_cooccurrence (
+        book_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        together INTEGER NOT NULL,
+        PRIMARY KEY (book_id, other_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS book_neighbours (
+        book_id INTEGER NOT NULL,
+        rank SMALLINT NOT NULL,
+        neighbour_id INTEGER NOT NULL,
+        together INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (book_id, rank)
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION reco_queue_loan() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.member_id IS NOT NULL AND NEW.book_id IS NOT NULL THEN
+            INSERT INTO reco_queue (member_id, book_id) VALUES (NEW.member_id, NEW.book_id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'reco_queue_loan') THEN
+            CREATE TRIGGER reco_queue_loan
+            AFTER INSERT OR UPDATE OF book_id, member_id ON loan
+            FOR EACH ROW EXECUTE PROCEDURE reco_queue_loan();
+        END IF;
+    END $$;
+    """,
+]
+
+# distinct borrower/book pairs of the loan table
+RECO_INCIDENCE_SELECT = """
+    SELECT DISTINCT member_id, book_id FROM loan WHERE member_id IS NOT NULL AND book_id IS NOT NULL
+"""
+
+# run in order inside one transaction by refresh_recommendations()
+RECO_REFRESH_STEPS = [
+    "CREATE TEMP TABLE reco_fresh (member_id INTEGER, book_id INTEGER) ON COMMIT DROP",
+    # consume the queue; only pairs new to member_book go on
+    """
+    WITH batch AS (
+        DELETE FROM reco_queue RETURNING member_id, book_id
+    ), fresh AS (
+        INSERT INTO member_book (member_id, book_id)
+        SELECT DISTINCT member_id, book_id FROM batch
+        ON CONFLICT DO NOTHING
+        RETURNING member_id, book_id
+    )
+    INSERT INTO reco_fresh SELECT member_id, book_id FROM fresh
+    """,
+    """
+    INSERT INTO book_borrowers AS r (book_id, borrowers)
+    SELECT book_id, count(*) FROM reco_fresh GROUP BY book_id
+    ON CONFLICT (book_id) DO UPDATE SET borrowers = r.borrowers + EXCLUDED.borrowers
+    """,
+    # a member's new books pair with all of their books (new x new included);
+    # the second branch adds the old -> new direction
+    """
+    INSERT INTO book_cooccurrence AS c (book_id, other_id, together)
+    SELECT a, b, count(*) FROM (
+        SELECT f.book_id AS a, mb.book_id AS b
+        FROM reco_fresh f JOIN member_book mb ON mb.member_id = f.member_id AND mb.book_id <> f.book_id
+        UNION ALL
+        SELECT mb.book_id, f.book_id
+        FROM reco_fresh f JOIN member_book mb ON mb.member_id = f.member_id AND mb.book_id <> f.book_id
+        WHERE NOT EXISTS (SELECT 1 FROM reco_fresh n WHERE n.member_id = f.member_id AND n.book_id = mb.book_id)
+    ) pairs
+    GROUP BY a, b
+    ON CONFLICT (book_id, other_id) DO UPDATE SET together = c.together + EXCLUDED.together
+    """,
+]
+
+# books whose matrix row changed in this refresh
+RECO_TOUCHED_QUERY = """
+    SELECT DISTINCT mb.book_id FROM reco_fresh f JOIN member_book mb ON mb.member_id = f.member_id
+"""
+
+RECO_RERANK_STEPS = [
+    "DELETE FROM book_neighbours WHERE book_id = ANY(%(books)s)",
+    """
+    INSERT INTO book_neighbours (book_id, rank, neighbour_id, together, score)
+    SELECT book_id, rank, other_id, together, score FROM (
+        SELECT book_id, other_id, together, score,
+               row_number() OVER (PARTITION BY book_id ORDER BY score DESC, other_id) AS rank
+        FROM (
+            SELECT c.book_id, c.other_id, c.together,
+                   (c.together / sqrt((pa.borrowers + %(shrink)s)::float8 * (pb.borrowers + %(shrink)s)))::real AS score
+            FROM book_cooccurrence c
+            JOIN book_borrowers pa ON pa.book_id = c.book_id
+            JOIN book_borrowers pb ON pb.book_id = c.other_id
+            WHERE c.book_id = ANY(%(books)s)
+        ) scored
+    ) ranked
+    WHERE rank <= %(top_k)s
+    """,
+]
+
+SIMILAR_BOOKS_QUERY = """
+    SELECT n.neighbour_id, b.title, n.together
+    FROM book_neighbours n JOIN book b ON b.id = n.neighbour_id
+    WHERE n.book_id = %s
+    ORDER BY n.rank LIMIT %s
+"""
+
+# neighbours of everything the member borrowed, minus what they already had
+MEMBER_SUGGESTIONS_QUERY = """
+    SELECT n.neighbour_id, b.title, round(sum(n.score)::numeric, 3) AS score
+    FROM member_book mb
+    JOIN book_neighbours n ON n.book_id = mb.book_id
+    JOIN book b ON b.id = n.neighbour_id
+    WHERE mb.member_id = %(member)s
+      AND NOT EXISTS (SELECT 1 FROM member_book x WHERE x.member_id = %(member)s AND x.book_id = n.neighbour_id)
+    GROUP BY n.neighbour_id, b.title
+    ORDER BY score DESC, n.neighbour_id
+    LIMIT %(limit)s
+"""
+
+# shared by refresh_recommendations (try, per transaction) and the rebuild
+# (held for the whole run)
+RECO_LOCK_ID = 7340023
+
+
+def refresh_recommendations():
+    # folds queued loans into the matrix and re-ranks the touched books;
+    # returns the number of books re-ranked, or None when another refresh or
+    # a rebuild holds the lock
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (RECO_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            cur.close()
+            return None
+        for statement in RECO_REFRESH_STEPS:
+            cur.execute(statement)
+        cur.execute(RECO_TOUCHED_QUERY)
+        books = [r[0] for r in cur.fetchall()]
+        if books:
+            params = {'books': books, 'top_k': RECO_CONFIG['top_k'], 'shrink': RECO_CONFIG['shrink']}
+            for statement in RECO_RERANK_STEPS:
+                cur.execute(statement, params)
+        cur.close()
+    return len(books)
+
+
+def seed_recommendations():
+    # full build with library_recommend after the tables are created or
+    # bulk-loaded; the incremental refresh is only meant for the loans since
+    # the last build
+    try:
+        from library_recommend import rebuild_recommendations
+        return rebuild_recommendations()
+    except Exception as e:
+        # numpy missing or the build failed: the tables stay as they were
+        print("Recommendation rebuild Error:", e)
+        print("Run 'python main.py refresh-recommendations --rebuild' to build them")
+        return None
+
+
+def recommendations_notice():
+    # the tables start empty: the NumPy build is too slow for application start
+    print("Recommendation tables created; run 'python main.py refresh-recommendations --rebuild' to fill them")
+
+
+RECO_QUEUE_PEEK_QUERY = "SELECT count(*) FROM (SELECT 1 FROM reco_queue LIMIT %s) q"
+
+
+def drain_recommendation_queue():
+    # background refresh for a running app; returns the books re-ranked, or
+    # None when another session holds the lock or the queue is too long
+    limit = RECO_CONFIG['background_max']
+    if run_query(RECO_QUEUE_PEEK_QUERY, (limit + 1,), fetch=True)[0][0] > limit:
+        return None
+    return refresh_recommendations()
+
+
+def similar_books(book_id, limit=10):
+    # [(book id, title, times borrowed together)]
+    return run_query(SIMILAR_BOOKS_QUERY, (book_id, limit), fetch=True)
+
+
+def member_suggestions(member_id, limit=10):
+    # [(book id, title, score)]
+    return run_query(MEMBER_SUGGESTIONS_QUERY, {'member': member_id, 'limit': limit}, fetch=True)
+
+
+# ---------- HOLDS ----------
+# One queue per book. The partial index on waiting holds, ordered by
+# (priority, requested_at, id), is the priority queue: the next hold is the
+# first entry of the book's range. Returns, expiries and cancellations of a
+# Ready hold all pass the copy on through library_allocate_copy() inside the
+# statement that freed it.
+HOLD_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS hold (
+        id SERIAL PRIMARY KEY,
+        book_id INTEGER NOT NULL REFERENCES book(id) ON DELETE CASCADE,
+        member_id INTEGER NOT NULL REFERENCES member(id) ON DELETE CASCADE,
+        priority SMALLINT NOT NULL,
+        requested_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        status TEXT NOT NULL DEFAULT 'Waiting',
+        ready_at TIMESTAMPTZ,
+        expires_at TIMESTAMPTZ,
+        from_loan_id INTEGER
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS hold_queue_idx ON hold (book_id, priority, requested_at, id) WHERE status = 'Waiting';",
+    "CREATE UNIQUE INDEX IF NOT EXISTS hold_active_idx ON hold (book_id, member_id) WHERE status IN ('Waiting', 'Ready');",
+    "CREATE INDEX IF NOT EXISTS hold_ready_expiry_idx ON hold (expires_at) WHERE status = 'Ready';",
+    # outstanding due dates per book, for availability forecasts
+    "CREATE INDEX IF NOT EXISTS loan_open_book_due_idx ON loan (book_id, due_date) WHERE return_date IS NULL;",
+    """
+    CREATE OR REPLACE FUNCTION library_allocate_copy(p_book_id INTEGER, p_loan_id INTEGER, p_pickup_days INTEGER)
+    RETURNS INTEGER AS $$
+    DECLARE
+        v_hold INTEGER;
+    BEGIN
+        UPDATE hold SET status = 'Ready', ready_at = now(), expires_at = now() + make_interval(days => p_pickup_days),
+                        from_loan_id = p_loan_id
+        WHERE id = (SELECT id FROM hold WHERE book_id = p_book_id AND status = 'Waiting'
+                    ORDER BY priority, requested_at, id LIMIT 1 FOR UPDATE SKIP LOCKED)
+        RETURNING id INTO v_hold;
+        IF v_hold IS NULL THEN
+            UPDATE book SET copies_available = copies_available + 1 WHERE id = p_book_id;
+        END IF;
+        RETURN v_hold;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+]
+
+# only while no copy is on the shelf; a member holds a book at most once
+PLACE_HOLD_QUERY = """
+    INSERT INTO hold (book_id, member_id, priority)
+    SELECT b.id, m.id, COALESCE((%s::jsonb ->> m.membership_type)::int, %s)
+    FROM book b, member m
+    WHERE b.id = %s AND m.id = %s AND b.copies_available = 0
+    ON CONFLICT DO NOTHING
+    RETURNING id
+"""
+
+CANCEL_HOLD_QUERY = """
+    WITH cancelled AS (
+        UPDATE hold h SET status = 'Cancelled'
+        FROM (SELECT id, status FROM hold WHERE id = %s FOR UPDATE) old
+        WHERE h.id = old.id AND old.status IN ('Waiting', 'Ready')
+        RETURNING h.book_id, h.from_loan_id, old.status AS was
+    )
+    SELECT CASE WHEN was = 'Ready' THEN library_allocate_copy(book_id, from_loan_id, %s) END FROM cancelled
+"""
+
+EXPIRE_HOLDS_QUERY = """
+    WITH expired AS (
+        UPDATE hold SET status = 'Expired'
+        WHERE status = 'Ready' AND expires_at < now()
+        RETURNING book_id, from_loan_id
+    )
+    SELECT library_allocate_copy(book_id, from_loan_id, %s) FROM expired
+"""
+
+# active holds of a book in queue order (Ready first)
+HOLD_QUEUE_QUERY = """
+    SELECT h.id, m.name, h.status, h.requested_at::date, h.expires_at::date
+    FROM hold h JOIN member m ON m.id = h.member_id
+    WHERE h.book_id = %s AND h.status IN ('Waiting', 'Ready')
+    ORDER BY h.status = 'Waiting', h.priority, h.requested_at, h.id
+"""
+
+OPEN_DUE_DATES_QUERY = """
+    SELECT due_date FROM loan WHERE book_id = %s AND return_date IS NULL AND due_date IS NOT NULL
+    ORDER BY due_date
+"""
+
+
+def forecast_availability(due_dates, waiting, today=None, loan_days=None):
+    # Expected date each of `waiting` holds (in queue order) gets a copy.
+    # A min-heap of the dates copies come back: each hold takes the earliest,
+    # and that copy returns again loan_days later. Overdue copies are assumed
+    # back today. None when no copy is out on loan.
+    today = today or date.today()
+    loan_days = HOLD_CONFIG['loan_days'] if loan_days is None else loan_days
+    heap = [max(d, today) for d in due_dates]
+    heapq.heapify(heap)
+    expected = []
+    for _ in range(waiting):
+        if not heap:
+            expected.append(None)
+            continue
+        available = heapq.heappop(heap)
+        expected.append(available)
+        heapq.heappush(heap, available + timedelta(days=loan_days))
+    return expected
+
+
+def place_hold(book_id, member_id):
+    # (hold id, queue position, expected date); None when a copy is on the
+    # shelf or the member already holds the book
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(PLACE_HOLD_QUERY, (json.dumps(HOLD_CONFIG['tiers']), HOLD_CONFIG['default_tier'],
+                                       book_id, member_id))
+        row = cur.fetchone()
+        cur.close()
+    if row is None:
+        return None
+    queue = hold_queue(book_id)
+    position = next(i for i, r in enumerate(queue) if r[0] == row[0])
+    return row[0], position + 1, queue[position][5]
+
+
+def hold_queue(book_id):
+    # [(hold id, member, status, requested, pickup by, expected date)]; Ready
+    # holds already have their copy, waiting ones get the forecast
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute(HOLD_QUEUE_QUERY, (book_id,))
+        holds = cur.fetchall()
+        cur.execute(OPEN_DUE_DATES_QUERY, (book_id,))
+        due_dates = [r[0] for r in cur.fetchall()]
+        cur.close()
+    waiting = [h for h in holds if h[2] == 'Waiting']
+    expected = iter(forecast_availability(due_dates, len(waiting)))
+    return [h + ((h[4] if h[2] == 'Ready' else next(expected)),) for h in holds]
+
+
+def cancel_hold(hold_id):
+    # True when an active hold was cancelled; a Ready hold's copy moves on
+    rows = run_query(CANCEL_HOLD_QUERY, (hold_id, HOLD_CONFIG['pickup_days']), fetch=True)
+    return bool(rows)
+
+
+def expire_holds():
+    # Ready holds past their pickup date pass their copy on; returns how many
+    return len(run_query(EXPIRE_HOLDS_QUERY, (HOLD_CONFIG['pickup_days'],), fetch=True))
+
+
+# ---------- BOOKCLUBS ----------
+# Club membership and reading lists. Each junction table's primary key
+# serves lookups from the club side; the second index serves the member or
+# book side (and the ON DELETE CASCADE from member / book). Batch changes
+# take id arrays and run as one statement; each per-club view is one query.
+BOOKCLUB_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS club_member (
+        club_id INTEGER NOT NULL REFERENCES bookclub(id) ON DELETE CASCADE,
+        member_id INTEGER NOT NULL REFERENCES member(id) ON DELETE CASCADE,
+        joined_on DATE NOT NULL DEFAULT current_date,
+        PRIMARY KEY (club_id, member_id)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS club_member_member_idx ON club_member (member_id);",
+    """
+    CREATE TABLE IF NOT EXISTS club_book (
+        club_id INTEGER NOT NULL REFERENCES bookclub(id) ON DELETE CASCADE,
+        book_id INTEGER NOT NULL REFERENCES book(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        read_on DATE,
+        PRIMARY KEY (club_id, book_id)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS club_book_book_idx ON club_book (book_id);",
+    # the club's next book: first unread by position
+    "CREATE INDEX IF NOT EXISTS club_book_unread_idx ON club_book (club_id, position) WHERE read_on IS NULL;",
+]
+
+ENROL_MEMBERS_QUERY = """
+    INSERT INTO club_member (club_id, member_id)
+    SELECT %s, m.id FROM member m WHERE m.id = ANY(%s)
+    ON CONFLICT DO NOTHING
+"""
+
+ENROL_EMAILS_QUERY = """
+    INSERT INTO club_member (club_id, member_id)
+    SELECT %s, m.id FROM member m WHERE lower(m.email) = ANY(%s)
+    ON CONFLICT DO NOTHING
+"""
+
+REMOVE_MEMBERS_QUERY = "DELETE FROM club_member WHERE club_id = %s AND member_id = ANY(%s)"
+
+# appended after the current last position, in the order given
+ADD_READING_QUERY = """
+    INSERT INTO club_book (club_id, book_id, position)
+    SELECT %(club)s, b.id, last.position + new.ord
+    FROM unnest(%(books)s::int[]) WITH ORDINALITY AS new(book_id, ord)
+    JOIN book b ON b.id = new.book_id
+    CROSS JOIN (SELECT COALESCE(max(position), 0) AS position FROM club_book WHERE club_id = %(club)s) last
+    ON CONFLICT DO NOTHING
+"""
+
+NEXT_CLUB_BOOK_QUERY = """
+    SELECT book_id FROM club_book WHERE club_id = %s AND read_on IS NULL ORDER BY position LIMIT 1
+"""
+
+MARK_READ_QUERY = "UPDATE club_book SET read_on = %s WHERE club_id = %s AND book_id = %s AND read_on IS NULL"
+
+# One hold on the club's next book for every enrolled member without an open
+# loan or active hold on it. As many as there are copies on the shelf, by
+# tier, start Ready and take their copy; the rest wait in the book's queue.
+# The book row is locked beforehand by reserve_club_book().
+RESERVE_CLUB_BOOK_QUERY = """
+    WITH candidates AS (
+        SELECT cm.member_id, COALESCE((%(tiers)s::jsonb ->> m.membership_type)::int, %(default_tier)s) AS priority
+        FROM club_member cm JOIN member m ON m.id = cm.member_id
+        WHERE cm.club_id = %(club)s
+          AND NOT EXISTS (SELECT 1 FROM loan l
+                          WHERE l.book_id = %(book)s AND l.member_id = cm.member_id AND l.return_date IS NULL)
+          AND NOT EXISTS (SELECT 1 FROM hold h
+                          WHERE h.book_id = %(book)s AND h.member_id = cm.member_id
+                            AND h.status IN ('Waiting', 'Ready'))
+    ), ranked AS (
+        SELECT c.member_id, c.priority,
+               row_number() OVER (ORDER BY c.priority, c.member_id) <= b.copies_available AS ready
+        FROM candidates c CROSS JOIN book b
+        WHERE b.id = %(book)s
+    ), placed AS (
+        INSERT INTO hold (book_id, member_id, priority, status, ready_at, expires_at)
+        SELECT %(book)s, member_id, priority,
+               CASE WHEN ready THEN 'Ready' ELSE 'Waiting' END,
+               CASE WHEN ready THEN now() END,
+               CASE WHEN ready THEN now() + make_interval(days => %(pickup_days)s) END
+        FROM ranked
+        ON CONFLICT DO NOTHING
+        RETURNING status
+    ), taken AS (
+        UPDATE book SET copies_available = copies_available - (SELECT count(*) FROM placed WHERE status = 'Ready')
+        WHERE id = %(book)s
+    )
+    SELECT count(*), count(*) FILTER (WHERE status = 'Ready') FROM placed
+"""
+
+# members with where they stand on the club's next book
+CLUB_MEMBERS_QUERY = """
+    WITH next AS (
+        SELECT book_id FROM club_book WHERE club_id = %(club)s AND read_on IS NULL ORDER BY position LIMIT 1
+    )
+    SELECT m.id, m.name, m.membership_type, cm.joined_on,
+           CASE WHEN EXISTS (SELECT 1 FROM loan l
+                             WHERE l.book_id = next.book_id AND l.member_id = m.id AND l.return_date IS NULL)
+                THEN 'On Loan' ELSE h.status END
+    FROM club_member cm
+    JOIN member m ON m.id = cm.member_id
+    LEFT JOIN next ON true
+    LEFT JOIN hold h ON h.book_id = next.book_id AND h.member_id = m.id AND h.status IN ('Waiting', 'Ready')
+    WHERE cm.club_id = %(club)s
+    ORDER BY m.name
+"""
+
+# reading list in order, with the active holds club members have on each book
+CLUB_READING_QUERY = """
+    SELECT b.id, cb.position, b.title, a.name, b.copies_available, cb.read_on, count(h.id)
+    FROM club_book cb
+    JOIN book b ON b.id = cb.book_id
+    LEFT JOIN author a ON a.id = b.author_id
+    LEFT JOIN hold h ON h.book_id = cb.book_id AND h.status IN ('Waiting', 'Ready')
+        AND h.member_id IN (SELECT member_id FROM club_member WHERE club_id = cb.club_id)
+    WHERE cb.club_id = %(club)s
+    GROUP BY b.id, cb.position, b.title, a.name, b.copies_available, cb.read_on
+    ORDER BY cb.position
+"""
+
+
+def _rowcount(query, params):
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        count = cur.rowcount
+        cur.close()
+    return count
+
+
+def enrol_members(club_id, member_ids=(), emails=()):
+    # returns how many were newly enrolled; emails match case-insensitively
+    count = 0
+    if member_ids:
+        count += _rowcount(ENROL_MEMBERS_QUERY, (club_id, list(member_ids)))
+    if emails:
+        count += _rowcount(ENROL_EMAILS_QUERY, (club_id, [e.strip().lower() for e in emails if e.strip()]))
+    return count
+
+
+def remove_members(club_id, member_ids):
+    return _rowcount(REMOVE_MEMBERS_QUERY, (club_id, list(member_ids)))
+
+
+def add_to_reading_list(club_id, book_ids):
+    # books already on the list keep their place; returns how many were added
+    return _rowcount(ADD_READING_QUERY, {'club': club_id, 'books': list(book_ids)})
+
+
+def mark_club_book_read(club_id, book_id, read_on=None):
+    return _rowcount(MARK_READ_QUERY, (read_on or date.today(), club_id, book_id))
+
+
+def reserve_club_book(club_id):
+    # holds the club's next book for every member; returns
+    # (book id, holds placed, of which Ready), or None when the list is read
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(NEXT_CLUB_BOOK_QUERY, (club_id,))
+        row = cur.fetchone()
+        if row is None:
+            cur.close()
+            return None
+        book_id = row[0]
+        # shelf copies are counted and taken in one go
+        cur.execute("SELECT copies_available FROM book WHERE id = %s FOR UPDATE", (book_id,))
+        cur.execute(RESERVE_CLUB_BOOK_QUERY, {
+            'club': club_id, 'book': book_id, 'tiers': json.dumps(HOLD_CONFIG['tiers']),
+            'default_tier': HOLD_CONFIG['default_tier'], 'pickup_days': HOLD_CONFIG['pickup_days']})
+        placed, ready = cur.fetchone()
+        cur.close()
+    return book_id, placed, ready
+
+
+def club_members(club_id):
+    # [(member id, name, membership type, joined on, next book status)]
+    return run_query(CLUB_MEMBERS_QUERY, {'club': club_id}, fetch=True)
+
+
+def club_reading_list(club_id):
+    # [(book id, position, title, author, copies available, read on, club holds)]
+    return run_query(CLUB_READING_QUERY, {'club': club_id}, fetch=True)
+
+
+# ---------- SCHEMA MIGRATIONS ----------
+# Applied in version order, each version once per database, recorded in
+# schema_migrations. Entries run as plain statements or (sql, params) pairs;
+# 'optional' statements may fail (e.g. missing extension privileges) without
+# blocking the rest, and are not retried; 'when' (given a cursor) skips a
+# migration until its feature is enabled or available; 'after' runs once the
+# migration has committed.
+SCHEMA_MIGRATIONS = [
+    {'version': 1, 'name': 'base tables and default admin',
+     'statements': BASE_SCHEMA_DDL + [DEFAULT_ADMIN_SQL]},
+    {'version': 2, 'name': 'search indexes',
+     'statements': SEARCH_INDEX_DDL},
+    {'version': 3, 'name': 'open loan due date index',
+     'statements': ["CREATE INDEX IF NOT EXISTS loan_open_due_idx ON loan (due_date) WHERE return_date IS NULL;"]},
+    {'version': 4, 'name': 'foreign key and status indexes',
+     'statements': [
+         # loan joins and the ON DELETE CASCADE from book / member
+         "CREATE INDEX IF NOT EXISTS loan_book_id_idx ON loan (book_id);",
+         "CREATE INDEX IF NOT EXISTS loan_member_id_idx ON loan (member_id);",
+         "CREATE INDEX IF NOT EXISTS loan_status_idx ON loan (status);",
+         # ON DELETE SET NULL from author
+         "CREATE INDEX IF NOT EXISTS book_author_id_idx ON book (author_id);",
+         "CREATE INDEX IF NOT EXISTS book_copies_available_idx ON book (copies_available);",
+     ]},
+    {'version': 5, 'name': 'dashboard summary table',
+     'statements': STATS_SUMMARY_DDL, 'when': lambda cur: STATS_CONFIG['summary_table']},
+    {'version': 6, 'name': 'change notification triggers',
+     'statements': CHANGE_NOTIFY_DDL},
+    {'version': 7, 'name': 'circulation analytics rollups',
+     'statements': ANALYTICS_DDL + ANALYTICS_SEED},
+    {'version': 8, 'name': 'co-borrowing recommendations',
+     'statements': RECO_DDL, 'after': recommendations_notice},
+    {'version': 9, 'name': 'hold queue',
+     'statements': HOLD_DDL},
+    {'version': 10, 'name': 'bookclub membership and reading lists',
+     'statements': BOOKCLUB_DDL},
+    # recounted, since earlier genre changes left loans under their old genre
+    {'version': 11, 'name': 'journal book genre changes',
+     'statements': GENRE_JOURNAL_DDL + ANALYTICS_SEED},
+    # waits for the server to offer pg_trgm; a missing privilege is reported once
+    {'version': 12, 'name': 'trigram search indexes',
+     'statements': [], 'optional': TRIGRAM_INDEX_DDL,
+     'when': lambda cur: _extension_available(cur, 'pg_trgm')},
+]
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+# pg_advisory_xact_lock key so only one client migrates at a time
+MIGRATION_LOCK_ID = 7340021
+
+
+def applied_migrations(cur):
+    try:
+        cur.execute("SELECT version FROM schema_migrations")
+    except errors.UndefinedTable:
+        return set()
+    return {r[0] for r in cur.fetchall()}
+
+
+def _extension_available(cur, name):
+    cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = %s", (name,))
+    return cur.fetchone() is not None
+
+
+def pending_migrations(applied, cur):
+    return [m for m in SCHEMA_MIGRATIONS
+            if m['version'] not in applied and m.get('when', lambda cur: True)(cur)]
+
+
+def _execute_statement(cur, statement):
+    if isinstance(statement, tuple):
+        cur.execute(*statement)
+    else:
+        cur.execute(statement)
+
+
+def migrate():
+    # Applies pending migrations and returns their versions. When the schema
+    # is current this costs a SELECT or two and takes no DDL locks.
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        pending = pending_migrations(applied_migrations(cur), cur)
+        cur.close()
+    if not pending:
+        return []
+
+    done = []
+    with transaction() as conn:
+        cur = conn.cursor()
+        # other clients starting at the same time wait here, then find nothing left to do
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        cur.execute(SCHEMA_MIGRATIONS_DDL)
+        for m in pending_migrations(applied_migrations(cur), cur):
+            for statement in m['statements']:
+                _execute_statement(cur, statement)
+            for statement in m.get('optional', []):
+                cur.execute("SAVEPOINT optional_ddl")
+                try:
+                    _execute_statement(cur, statement)
+                    cur.execute("RELEASE SAVEPOINT optional_ddl")
+                except psycopg2.Error as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT optional_ddl")
+                    print(f"Migration {m['version']} ({m['name']}) skipped a statement:", e)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (m['version'], m['name']))
+            done.append(m['version'])
+        cur.close()
+    # follow-up work that cannot run inside the migration transaction
+    for m in SCHEMA_MIGRATIONS:
+        if m['version'] in done and 'after' in m:
+            m['after']()
+    return done
+
+
+# ---------- BENCHMARK ----------
+# synthetic library size relative to the number of loans: 1M loans come
+# with 50k books, 100k members and 5k authors
+BENCH_SCALE = {'books': 0.05, 'members': 0.1, 'authors': 0.005}
+
+# run in order inside one transaction; %(run)s keeps the unique columns of
+# repeated generations apart. Loans favour popular books (random() squared).
+BENCH_GENERATE_SQL = [
+    ('author', """
+        INSERT INTO author (name, nationality, birth_year)
+        SELECT 'Author ' || g, (ARRAY['Lesotho', 'South Africa', 'Kenya', 'Nigeria', 'UK', 'USA'])[1 + mod(g, 6)],
+               1900 + mod(g, 100)
+        FROM generate_series(1, %(authors)s) g
+    """),
+    ('member', """
+        INSERT INTO member (name, email, phone, membership_type, join_date)
+        SELECT 'Member ' || g, 'bench-' || %(run)s || '-' || g || '@example.com', '+266' || lpad(g::text, 8, '0'),
+               (ARRAY['Standard', 'Premium', 'Student', 'Senior'])[1 + mod(g, 4)], current_date - mod(g, 1500)
+        FROM generate_series(1, %(members)s) g
+    """),
+    ('book', """
+        INSERT INTO book (title, author_id, isbn, publisher, published_year, genre, copies_available)
+        SELECT 'Book ' || g, a.ids[1 + mod(g, array_length(a.ids, 1))], %(run)s || '-' || g,
+               'Publisher ' || mod(g, 50), 1950 + mod(g, 75),
+               (ARRAY['Fiction', 'Science', 'History', 'Poetry', 'Business'])[1 + mod(g, 5)],
+               (random() * 5)::int
+        FROM generate_series(1, %(books)s) g, (SELECT array_agg(id) AS ids FROM author) a
+    """),
+    ('loan', """
+        INSERT INTO loan (book_id, member_id, loan_date, due_date, return_date, status)
+        SELECT b.ids[1 + floor(power(random(), 2) * array_length(b.ids, 1))::int],
+               m.ids[1 + floor(random() * array_length(m.ids, 1))::int],
+               s.d, s.d + 14,
+               CASE WHEN s.r < 0.8 THEN s.d + (random() * 14)::int END,
+               CASE WHEN s.r < 0.8 THEN 'Returned' WHEN s.d + 14 < current_date THEN 'Overdue' ELSE 'On Loan' END
+        FROM (SELECT g, current_date - (random() * 730)::int AS d, random() AS r
+              FROM generate_series(1, %(loans)s) g) s,
+             (SELECT array_agg(id) AS ids FROM book) b,
+             (SELECT array_agg(id) AS ids FROM member) m
+    """),
+]
+
+BENCH_OPERATIONS = ('load_books', 'load_loans', 'refresh_stats', 'add_loan', 'mark_returned', 'login')
+
+
+def generate_library(loans, seed=None, progress=None):
+    # adds a synthetic library of `loans` loans to the current database;
+    # meant for a scratch database, it locks the tables while it runs
+    counts = {name: max(int(loans * share), 10) for name, share in BENCH_SCALE.items()}
+    counts['loans'] = loans
+    params = dict(counts, run=os.urandom(3).hex())
+    with transaction() as conn:
+        cur = conn.cursor()
+        if seed is not None:
+            cur.execute("SELECT setseed(%s)", (seed,))
+        # row triggers (notifications, summary counters) would fire per row
+        for table, _ in BENCH_GENERATE_SQL:
+            cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+        for table, query in BENCH_GENERATE_SQL:
+            start = time.monotonic()
+            cur.execute(query, params)
+            if progress:
+                progress(table, cur.rowcount, time.monotonic() - start)
+        for table, _ in BENCH_GENERATE_SQL:
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+        cur.execute("SELECT to_regclass('library_stats')")
+        if cur.fetchone()[0]:
+            cur.execute("UPDATE library_stats SET (" + ', '.join(STATS_KEYS) + ") = (" + STATS_QUERY + ") WHERE id = 1")
+        cur.close()
+    # the loan journal and recommendation queue triggers were off as well
+    rebuild_analytics()
+    seed_recommendations()
+    run_query("ANALYZE")
+    return counts
+
+
+def _percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def time_operation(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t)
+    wall = time.perf_counter() - started
+    if not timings:
+        return {'iterations': 0}
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': _percentile(timings, 50) * 1000,
+        'p95_ms': _percentile(timings, 95) * 1000,
+        'p99_ms': _percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000,
+        'per_sec': iterations / wall if wall else 0.0
+    }
+
+
+# removes the race book with its loans (ON DELETE CASCADE) and whatever the
+# loan triggers queued or a background refresh folded in for it
+RACE_CLEANUP_STEPS = [
+    "DELETE FROM book WHERE id = %(book)s",
+    "DELETE FROM reco_queue WHERE book_id = %(book)s",
+    "DELETE FROM member_book WHERE book_id = %(book)s",
+    "DELETE FROM book_borrowers WHERE book_id = %(book)s",
+    "DELETE FROM book_cooccurrence WHERE book_id = %(book)s OR other_id = %(book)s",
+    "DELETE FROM book_neighbours WHERE book_id = %(book)s OR neighbour_id = %(book)s",
+    "DELETE FROM member WHERE id = %(member)s",
+]
+
+
+def check_concurrent_checkout(threads=16, copies=5):
+    # `threads` clients race for `copies` copies of one book: exactly
+    # `copies` checkouts may succeed and none may leave the count negative.
+    # The clients need their own connections, so the rows are deleted
+    # afterwards rather than rolled back.
+    today = date.today()
+    book_id = run_query("INSERT INTO book (title, isbn, copies_available) VALUES (%s, %s, %s) RETURNING id",
+                        ('Benchmark race', f'race-{os.urandom(4).hex()}', copies), fetch=True)[0][0]
+    member = run_query("SELECT id FROM member LIMIT 1", fetch=True)
+    created_member = None
+    try:
+        if member:
+            member_id = member[0][0]
+        else:
+            member_id = created_member = run_query(
+                "INSERT INTO member (name) VALUES ('Benchmark member') RETURNING id", fetch=True)[0][0]
+        barrier = threading.Barrier(threads)
+        results = []
+
+        def client():
+            barrier.wait()
+            results.append(checkout_book(book_id, member_id, today, today + timedelta(days=14)))
+
+        workers = [threading.Thread(target=client) for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        left = run_query("SELECT copies_available FROM book WHERE id=%s", (book_id,), fetch=True)[0][0]
+    finally:
+        with transaction() as conn:
+            cur = conn.cursor()
+            for statement in RACE_CLEANUP_STEPS:
+                cur.execute(statement, {'book': book_id, 'member': created_member})
+            cur.close()
+    won = sum(1 for r in results if r is not None)
+    return {'threads': threads, 'copies': copies, 'checked_out': won, 'copies_left': left,
+            'ok': won == copies and left == 0}
+
+
+def benchmark_operations(iterations=200, seed=None):
+    # times the statements behind each GUI action, the way the tabs run them
+    rng = random.Random(seed)
+    book_max = run_query("SELECT COALESCE(max(id), 0) FROM book", fetch=True)[0][0]
+    loan_max = run_query("SELECT COALESCE(max(id), 0) FROM loan", fetch=True)[0][0]
+    book_ids = [r[0] for r in run_query(
+        "SELECT id FROM book WHERE copies_available > 0 ORDER BY random() LIMIT %s", (iterations,), fetch=True)]
+    member_ids = [r[0] for r in run_query(
+        "SELECT id FROM member ORDER BY random() LIMIT %s", (iterations,), fetch=True)]
+    today = date.today()
+    stats_cache = StatsCache(ttl=0)
+    admin_hash = hash_password('man')
+    opened = []
+
+    def page(entity, max_id):
+        # a keyset page starting at a random point, as when scrolling
+        return list_page(entity, rng.randint(0, max_id))
+
+    def add_loan():
+        row = checkout_book(rng.choice(book_ids), rng.choice(member_ids), today, today + timedelta(days=14))
+        if row is not None:
+            opened.append(row[0])
+
+    def mark_returned():
+        return_book(opened.pop(), today)
+
+    results = {
+        'load_books': time_operation(lambda: page('book', book_max), iterations),
+        'load_loans': time_operation(lambda: page('loan', loan_max), iterations),
+        'refresh_stats': time_operation(stats_cache.fetch, iterations),
+        'login': time_operation(lambda: lookup_user('man', admin_hash), iterations),
+    }
+    if book_ids and member_ids:
+        results['add_loan'] = time_operation(add_loan, iterations, warmup=0)
+        # returns the loans just created, which also restocks their copies
+        results['mark_returned'] = time_operation(mark_returned, len(opened), warmup=0)
+    return results
+
+
+def load_bench_results(path=BENCH_RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_benchmark(iterations=200, label='default', results_path=BENCH_RESULTS_PATH, seed=None):
+    # times every operation, checks concurrent checkouts, appends the result
+    # to results_path and returns (result, previous result with the same label)
+    previous = [r for r in load_bench_results(results_path) if r.get('label') == label]
+    rows = run_query("SELECT (SELECT count(*) FROM book), (SELECT count(*) FROM member), "
+                     "(SELECT count(*) FROM loan)", fetch=True)[0]
+    result = {
+        'label': label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rows': dict(zip(('books', 'members', 'loans'), rows)),
+        'page_size': PAGE_SIZE,
+        'seed': seed,
+        'operations': benchmark_operations(iterations, seed),
+        'concurrent_checkout': check_concurrent_checkout(),
+        'entity_cache': get_entity_cache().report()
+    }
+    with open(results_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    return result, previous[-1] if previous else None
+
+
+def format_bench_result(result, previous=None):
+    lines = [f"{result['label']}: {result['rows']['books']} books, {result['rows']['members']} members, "
+             f"{result['rows']['loans']} loans",
+             f"{'operation':<15}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'p95 vs prev':>14}"]
+    for name in BENCH_OPERATIONS:
+        op = result['operations'].get(name)
+        if not op or not op['iterations']:
+            continue
+        change = ''
+        before = (previous or {}).get('operations', {}).get(name)
+        if before and before.get('p95_ms'):
+            change = f"{(op['p95_ms'] / before['p95_ms'] - 1) * 100:+.1f}%"
+        lines.append(f"{name:<15}{op['p50_ms']:>10.2f}{op['p95_ms']:>10.2f}{op['p99_ms']:>10.2f}"
+                     f"{op['per_sec']:>10.1f}{change:>14}")
+    race = result['concurrent_checkout']
+    lines.append(f"concurrent checkout: {race['checked_out']} of {race['threads']} clients got the "
+                 f"{race['copies']} copies, {race['copies_left']} left -> {'ok' if race['ok'] else 'FAILED'}")
+    return '\n'.join(lines)
+
+
+# ---------- Command Line ----------
+def run_cli(argv):
+    # headless entry point: python main.py import book catalogue.csv
+    #                        python main.py export loan loans.parquet
+    parser = argparse.ArgumentParser(prog='main.py', description='Smart Library maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    imp = commands.add_parser('import', help='bulk import CSV or JSON Lines records')
+    imp.add_argument('entity', choices=sorted(IMPORT_SPECS))
+    imp.add_argument('path')
+    imp.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    imp.add_argument('--rejects', help='where to write rejected records (default: <path>.rejected.jsonl)')
+
+    exp = commands.add_parser('export', help='stream a table to CSV or Parquet')
+    exp.add_argument('entity', choices=sorted(EXPORT_SPECS))
+    exp.add_argument('path')
+    exp.add_argument('--format', choices=EXPORT_FORMATS, help='default: taken from the file extension')
+    exp.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+
+    commands.add_parser('sweep-overdue', help="mark every past-due open loan 'Overdue' (e.g. from cron)")
+
+    ana = commands.add_parser('refresh-analytics', help='fold new loan changes into the report rollups')
+    ana.add_argument('--rebuild', action='store_true', help='recount the rollups from the whole loan table')
+
+    hist = commands.add_parser('loan-analytics', help='what-if and segment reports over the loan history (needs numpy)')
+    hist.add_argument('--due-days', type=int, nargs='+', default=[7, 14, 21, 28],
+                      help='loan periods to compare against the recorded durations')
+
+    reco = commands.add_parser('refresh-recommendations', help='fold new loans into the co-borrowing neighbours')
+    reco.add_argument('--rebuild', action='store_true',
+                      help='recompute the whole matrix with NumPy on all cores (needs numpy)')
+    reco.add_argument('--workers', type=int, help='rebuild processes (default: RECO_CONFIG, else every core)')
+
+    gen = commands.add_parser('bench-generate', help='fill a scratch database with a synthetic library')
+    gen.add_argument('--dbname', required=True, help='scratch database to fill (never the live one)')
+    gen.add_argument('--loans', type=int, default=100000)
+    gen.add_argument('--seed', type=float, help='setseed() value in [-1, 1] for repeatable data')
+
+    bench = commands.add_parser('bench', help='time the data-layer operations and store the results')
+    bench.add_argument('--dbname', required=True, help='scratch database to run against (never the live one)')
+    bench.add_argument('--iterations', type=int, default=200)
+    bench.add_argument('--seed', type=int, help='seed for the picked pages, books and members')
+    bench.add_argument('--label', default='default', help='results are compared with the last run of this label')
+    bench.add_argument('--results', default=BENCH_RESULTS_PATH)
+
+    serve = commands.add_parser('serve', help='run the HTTP/JSON API (needs aiohttp and asyncpg)')
+    serve.add_argument('--host', default=API_CONFIG['host'])
+    serve.add_argument('--port', type=int, default=API_CONFIG['port'])
+
+    args = parser.parse_args(argv)
+    if args.command in ('bench-generate', 'bench') and args.dbname == DB_CONFIG['dbname']:
+        # both write synthetic books, members and loans
+        parser.error(f"{args.command} must not run against the live database {DB_CONFIG['dbname']!r}")
+    if getattr(args, 'dbname', None):
+        DB_CONFIG['dbname'] = args.dbname
+    create_tables()
+    try:
+        if args.command == 'import':
+            stats = import_file(
+                args.entity, args.path, args.chunk_size, rejects_path=args.rejects,
+                progress=lambda st: print(f"\r{st['read']} read, {st['imported']} imported, "
+                                          f"{st['rejected']} rejected", end='', flush=True))
+            print()
+            return 1 if stats['rejected'] else 0
+        if args.command == 'export':
+            count = export_table(args.entity, args.path, args.format, args.batch_size,
+                                 progress=lambda n: print(f"\r{n} rows written", end='', flush=True))
+            print(f"\rExported {count} rows to {args.path}")
+            return 0
+        if args.command == 'sweep-overdue':
+            start = time.monotonic()
+            count = sweep_overdue()
+            expired = expire_holds()
+            print(f"Marked {count} loans overdue and expired {expired} uncollected holds "
+                  f"in {time.monotonic() - start:.3f}s")
+            return 0
+        if args.command == 'refresh-analytics':
+            start = time.monotonic()
+            if args.rebuild:
+                rebuild_analytics()
+                print(f"Rebuilt the rollups in {time.monotonic() - start:.3f}s")
+            else:
+                consumed = refresh_analytics()
+                if consumed is None:
+                    print("Another refresh is running")
+                else:
+                    print(f"Folded {consumed} loan changes in {time.monotonic() - start:.3f}s")
+            return 0
+        if args.command == 'loan-analytics':
+            from library_analytics import format_loan_report, load_loan_history
+            start = time.monotonic()
+            history = load_loan_history()
+            loaded = time.monotonic() - start
+            report = format_loan_report(history, args.due_days)
+            print(report)
+            print(f"\nLoaded in {loaded:.3f}s, computed in {time.monotonic() - start - loaded:.3f}s")
+            return 0
+        if args.command == 'refresh-recommendations':
+            start = time.monotonic()
+            if args.rebuild:
+                from library_recommend import rebuild_recommendations
+                counts = rebuild_recommendations(args.workers)
+                print(f"Rebuilt {counts} in {time.monotonic() - start:.3f}s")
+            else:
+                books = refresh_recommendations()
+                if books is None:
+                    print("Another refresh or rebuild is running")
+                else:
+                    print(f"Re-ranked {books} books in {time.monotonic() - start:.3f}s")
+            return 0
+        if args.command == 'serve':
+            from library_api import run_api
+            run_api(args.host, args.port)
+            return 0
+        if args.command == 'bench-generate':
+            counts = generate_library(args.loans, args.seed,
+                                      progress=lambda table, n, secs: print(f"{table}: {n} rows in {secs:.1f}s"))
+            print("Generated", counts)
+            return 0
+        if args.command == 'bench':
+            result, previous = run_benchmark(args.iterations, args.label, args.results, args.seed)
+            print(format_bench_result(result, previous))
+            if QUERY_LOG_CONFIG['enabled']:
+                print("\nTop statements by total time:")
+                for tag, calls, total, mean, worst, rows, statement in get_query_log().top(10):
+                    print(f"{total:>10.1f} ms {calls:>6}x {mean:>8.2f} ms  [{tag}] {statement[:100]}")
+            return 0 if result['concurrent_checkout']['ok'] else 1
+    finally:
+        close_pool()
+
+
+if __name__ == '__main__':
+    sys.exit(run_cli(sys.argv[1:]))
@@ -1,147 +1,957 @@
 import sys
-import hashlib
+import time
+import bisect
+import select
+import threading
 import psycopg2
-from psycopg2 import sql
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QTabWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QTableWidget, QTableWidgetItem, QMessageBox,
-    QComboBox, QSpinBox, QTextEdit, QDateEdit, QDialog, QFormLayout, QGridLayout
+    QLabel, QLineEdit, QPushButton, QTableView, QHeaderView, QAbstractItemView, QMessageBox,
+    QComboBox, QSpinBox, QTextEdit, QDateEdit, QDialog, QFormLayout, QGridLayout, QCompleter,
+    QFileDialog, QInputDialog
+)
+from PyQt5.QtCore import (
+    QDate, Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal,
+    QStringListModel
 )
-from PyQt5.QtCore import QDate, Qt
 from datetime import date, timedelta
+from library_service import (
+    ANALYTICS_CONFIG, ANALYTICS_REPORTS, CHANGE_CONFIG, ENTITY_CACHE_QUERIES, EXPORT_BATCH_SIZE,
+    IMPORT_CHUNK_SIZE, OVERDUE_CONFIG, PAGE_SIZE, POOL_CONFIG, QUERY_LOG_CONFIG, RECO_CONFIG, STATS_KEYS,
+    add_to_reading_list, analytics_report, authenticate, checkout_book, close_pool, club_members,
+    club_reading_list, create_tables, current_query_tag, delete_entity, drain_recommendation_queue,
+    enrol_members, expire_holds,
+    export_table, get_connection, get_entity_cache, get_pool, get_query_log, get_stats_cache, hold_queue,
+    import_file, listing, listing_page_query, mark_club_book_read, member_suggestions, parse_change,
+    place_hold, query_tag, refresh_analytics, remove_members, reserve_club_book, resolve_listing,
+    return_book, run_cli, run_query, save_entity, similar_books, sweep_overdue
+)
+
+# quiet period after the last keystroke before a search query is sent
+SEARCH_DEBOUNCE_MS = 300
+
+
+# ---------- BACKGROUND QUERIES ----------
+class _QueryTask(QRunnable):
+    def __init__(self, executor, ticket, cancelled, fn, args, tag):
+        super().__init__()
+        self.tag = tag
+        self.executor = executor
+        self.ticket = ticket
+        self.cancelled = cancelled
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        try:
+            with query_tag(self.tag):
+                result = self.fn(*self.args)
+        except Exception as e:
+            self.executor.task_done.emit(self.ticket, None, e)
+        else:
+            self.executor.task_done.emit(self.ticket, result, None)
+
+
+class QueryExecutor(QObject):
+    # Runs database calls on a thread pool and hands the results back to the
+    # GUI thread through a queued signal. A new submit under a key that is still
+    # pending supersedes the old request: it is skipped if it has not started
+    # yet, and its result is dropped if it has.
+    task_done = pyqtSignal(int, object, object)
+
+    def __init__(self, max_threads=None, parent=None):
+        super().__init__(parent)
+        self.thread_pool = QThreadPool(self)
+        # never run more queries at once than the connection pool can serve
+        self.thread_pool.setMaxThreadCount(max_threads or POOL_CONFIG['maxconn'])
+        self._next_ticket = 0
+        self._pending = {}  # ticket -> (key, on_result, on_error, cancelled)
+        self._latest = {}  # key -> ticket
+        self.task_done.connect(self._deliver)
+
+    def submit(self, key, fn, *args, on_result=None, on_error=None):
+        self._next_ticket += 1
+        ticket = self._next_ticket
+        if key is not None:
+            self.cancel(key)
+            self._latest[key] = ticket
+        cancelled = threading.Event()
+        self._pending[ticket] = (key, on_result, on_error, cancelled)
+        # statements the task runs are recorded under the submitting call site
+        self.thread_pool.start(_QueryTask(self, ticket, cancelled, fn, args, current_query_tag()))
+        return ticket
+
+    def cancel(self, key):
+        ticket = self._latest.pop(key, None)
+        entry = self._pending.pop(ticket, None)
+        if entry is not None:
+            entry[3].set()
+
+    def is_pending(self, key):
+        return key in self._latest
+
+    def _deliver(self, ticket, result, error):
+        entry = self._pending.pop(ticket, None)
+        if entry is None:
+            return  # superseded or cancelled
+        key, on_result, on_error, _ = entry
+        if key is not None and self._latest.get(key) == ticket:
+            del self._latest[key]
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                print("Query Error:", error)
+        elif on_result:
+            on_result(result)
+
+    def shutdown(self):
+        for key in list(self._latest):
+            self.cancel(key)
+        self.thread_pool.waitForDone()
+
+
+class ProgressSignal(QObject):
+    # created on the GUI thread; a worker calls updated.emit(...) to report progress
+    updated = pyqtSignal(object)
+
+
+class OverdueSweeper(QObject):
+    # Runs sweep_overdue on the query executor every `interval` seconds and
+    # keeps timings for the runs in `stats`.
+    swept = pyqtSignal(int)
+
+    def __init__(self, interval=300.0, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(interval * 1000))
+        self.timer.timeout.connect(self.run)
+        self.stats = {
+            'runs': 0,
+            'failures': 0,
+            'marked_total': 0,
+            'last_marked': 0,
+            'last_run_at': None,
+            'last_duration': 0.0,
+            'max_duration': 0.0,
+            'total_duration': 0.0
+        }
+
+    def start(self):
+        self.run()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def run(self):
+        get_executor().submit(('overdue', id(self)), self._timed_sweep,
+                              on_result=self._finished, on_error=self._failed)
+
+    def _timed_sweep(self):
+        # runs on a worker thread; uncollected holds pass their copy on too
+        start = time.monotonic()
+        count = sweep_overdue()
+        expire_holds()
+        return count, time.monotonic() - start
+
+    def _finished(self, result):
+        count, duration = result
+        self.stats['runs'] += 1
+        self.stats['marked_total'] += count
+        self.stats['last_marked'] = count
+        self.stats['last_run_at'] = time.time()
+        self.stats['last_duration'] = duration
+        self.stats['max_duration'] = max(self.stats['max_duration'], duration)
+        self.stats['total_duration'] += duration
+        if count:
+            get_stats_cache().invalidate()
+            self.swept.emit(count)
+
+    def _failed(self, error):
+        self.stats['failures'] += 1
+        print("Overdue sweep Error:", error)
+
+
+class RecommendationRefresher(QObject):
+    # Folds queued loans into the recommendation tables on the query executor
+    # every `interval` seconds, so similar-book lookups stay read-only.
+    def __init__(self, interval=60.0, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(interval * 1000))
+        self.timer.timeout.connect(self.run)
+
+    def start(self):
+        self.run()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def run(self):
+        get_executor().submit(('recommendations', id(self)), drain_recommendation_queue,
+                              on_error=lambda e: print("Recommendation refresh Error:", e))
+
+
+class ChangeListener(QObject):
+    # LISTENs for trigger notifications on a dedicated connection (never one
+    # from the pool) in a daemon thread. Notifications are collected on the GUI
+    # thread and handed out as one {table: {ids}} batch per flush interval.
+    # After a dropped connection `resync` is emitted, since changes made while
+    # it was down were missed.
+    changed = pyqtSignal(object)
+    resync = pyqtSignal()
+    _received = pyqtSignal(str)
+
+    def __init__(self, channel=None, flush_ms=None, parent=None):
+        super().__init__(parent)
+        self.channel = channel or CHANGE_CONFIG['channel']
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(CHANGE_CONFIG['flush_ms'] if flush_ms is None else flush_ms)
+        self.flush_timer.timeout.connect(self.flush)
+        self._received.connect(self._queue)
+        self.stats = {'received': 0, 'batches': 0, 'reconnects': 0}
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._listen, name='change-listener', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush_timer.stop()
+        if self._thread is not None:
+            # the thread checks for stop at least once a second
+            self._thread.join(2.0)
+            self._thread = None
+
+    def _listen(self):
+        # runs on the listener thread
+        missed = False
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = get_connection()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                if missed:
+                    missed = False
+                    self._received.emit('')
+                while not self._stop.is_set():
+                    # wake up once a second to notice stop()
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies and not self._stop.is_set():
+                        self._received.emit(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError) as e:
+                print("Change listener Error:", e)
+                missed = True
+                self._stop.wait(CHANGE_CONFIG['reconnect_after'])
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _queue(self, payload):
+        if not payload:
+            # reconnected: whatever is pending is superseded by a full reload
+            self.stats['reconnects'] += 1
+            self._pending = {}
+            self.resync.emit()
+            return
+        change = parse_change(payload)
+        if change is None:
+            return
+        self.stats['received'] += 1
+        table, row_id = change
+        self._pending.setdefault(table, set()).add(row_id)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            self.stats['batches'] += 1
+            self.changed.emit(batch)
+
+
+_executor = None
+
+
+def get_executor():
+    # created lazily because it needs a running QApplication
+    global _executor
+    if _executor is None:
+        _executor = QueryExecutor()
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+# ---------- PICKER INDEX ----------
+class PrefixIndex:
+    # Sorted array of (term, id) pairs searched with bisect. Terms are the
+    # lower-cased text starting at each word, so 'potter' finds
+    # 'Harry Potter and the Philosopher's Stone'.
+    def __init__(self):
+        self._keys = []
+        self._ids = []
+        self._labels = {}
+        self._terms = {}
+
+    @staticmethod
+    def make_terms(*texts):
+        terms = set()
+        for text in texts:
+            words = (text or '').lower().split()
+            for i in range(len(words)):
+                terms.add(' '.join(words[i:]))
+        return terms
+
+    def build(self, entries):
+        # bulk load: one sort instead of an insort per term
+        pairs = []
+        self._labels = {}
+        self._terms = {}
+        for item_id, label, terms in entries:
+            self._labels[item_id] = label
+            self._terms[item_id] = terms
+            pairs.extend((term, item_id) for term in terms)
+        pairs.sort()
+        self._keys = [p[0] for p in pairs]
+        self._ids = [p[1] for p in pairs]
+
+    def add(self, item_id, label, terms):
+        self.remove(item_id)
+        self._labels[item_id] = label
+        self._terms[item_id] = terms
+        for term in terms:
+            pos = bisect.bisect_left(self._keys, term)
+            self._keys.insert(pos, term)
+            self._ids.insert(pos, item_id)
+
+    def remove(self, item_id):
+        self._labels.pop(item_id, None)
+        for term in self._terms.pop(item_id, ()):
+            lo = bisect.bisect_left(self._keys, term)
+            hi = bisect.bisect_right(self._keys, term)
+            for pos in range(lo, hi):
+                if self._ids[pos] == item_id:
+                    del self._keys[pos]
+                    del self._ids[pos]
+                    break
+
+    def search(self, prefix, limit=20):
+        # returns up to `limit` (id, label) pairs whose terms start with prefix
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        pos = bisect.bisect_left(self._keys, prefix)
+        while pos < len(self._keys) and self._keys[pos].startswith(prefix) and len(results) < limit:
+            item_id = self._ids[pos]
+            if item_id not in seen:
+                seen.add(item_id)
+                results.append((item_id, self._labels[item_id]))
+            pos += 1
+        return results
+
+    def __len__(self):
+        return len(self._labels)
+
+
+def book_lookup_entry(row):
+    book_id, title, isbn = row
+    label = f"{title} [{isbn}]" if isbn else f"{title} (#{book_id})"
+    return book_id, label, PrefixIndex.make_terms(title, isbn)
+
+
+def member_lookup_entry(row):
+    member_id, name = row
+    return member_id, f"{name} (#{member_id})", PrefixIndex.make_terms(name)
+
+
+class LookupIndex:
+    # Shared picker index, loaded on first use by a worker thread and then kept
+    # in sync by upsert()/remove() as rows are written. Writes that land while
+    # the initial load is running are replayed on top of it.
+    def __init__(self, query, make_entry):
+        self.query = query
+        self.make_entry = make_entry
+        self.index = None
+        self._loading = False
+        self._waiters = []
+        self._pending = []
+
+    @property
+    def loaded(self):
+        return self.index is not None
+
+    def ensure_loaded(self, callback=None):
+        if self.index is not None:
+            if callback:
+                callback()
+            return
+        if callback:
+            self._waiters.append(callback)
+        if not self._loading:
+            self._loading = True
+            get_executor().submit(('lookup', id(self)), self._build,
+                                  on_result=self._loaded, on_error=self._failed)
+
+    def _build(self):
+        # runs on a worker thread
+        index = PrefixIndex()
+        index.build(self.make_entry(r) for r in run_query(self.query, fetch=True) or [])
+        return index
+
+    def _loaded(self, index):
+        for op, arg in self._pending:
+            if op == 'upsert':
+                index.add(*self.make_entry(arg))
+            else:
+                index.remove(arg)
+        self._pending = []
+        self._loading = False
+        self.index = index
+        waiters, self._waiters = self._waiters, []
+        for callback in waiters:
+            callback()
+
+    def _failed(self, error):
+        print("Picker index Error:", error)
+        self._loading = False
+        self._waiters = []
+
+    def upsert(self, row):
+        if self.index is not None:
+            self.index.add(*self.make_entry(row))
+        elif self._loading:
+            self._pending.append(('upsert', row))
+
+    def remove(self, item_id):
+        if self.index is not None:
+            self.index.remove(item_id)
+        elif self._loading:
+            self._pending.append(('remove', item_id))
+
+    def patch(self, ids):
+        # re-read just the changed rows; ids that no longer exist are removed
+        if self.index is None and not self._loading:
+            return
+        ids = sorted(ids)
+        get_executor().submit(None, run_query, self.query + " WHERE id = ANY(%s)", (ids,), True,
+                              on_result=lambda rows: self._patched(ids, rows or []),
+                              on_error=self._failed_patch)
 
-# ---------- DATABASE CONFIGURATION ----------
-DB_CONFIG = {
-    'host': 'localhost',
-    'port': 5432,
-    'dbname': 'Limkokwing Smart Library System',
-    'user': 'postgres',
-    'password': 'julie22'
-}
-
-
-# ---------- HELPERS ----------
-def get_connection():
-    conn = psycopg2.connect(**DB_CONFIG)
-    conn.autocommit = True
-    return conn
-
-
-def hash_password(plain: str) -> str:
-    return hashlib.sha256(plain.encode('utf-8')).hexdigest()
-
-
-def create_tables():
-    # Creates all required tables
-
-    queries = [
-        # users table for authentication
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            full_name TEXT,
-            role TEXT DEFAULT 'staff'
-        );
-        """,
-        # authors (expanded)
-        """
-        CREATE TABLE IF NOT EXISTS author (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            bio TEXT,
-            nationality TEXT,
-            birth_year INTEGER
-        );
-        """,
-        # members (expanded)
-        """
-        CREATE TABLE IF NOT EXISTS member (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            phone TEXT,
-            membership_type TEXT,
-            join_date DATE
-        );
-        """,
-        # bookclubs (expanded)
-        """
-        CREATE TABLE IF NOT EXISTS bookclub (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT,
-            meeting_day TEXT
-        );
-        """,
-        # books (expanded)
-        """
-        CREATE TABLE IF NOT EXISTS book (
-            id SERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            author_id INTEGER REFERENCES author(id) ON DELETE SET NULL,
-            isbn TEXT UNIQUE,
-            publisher TEXT,
-            published_year INTEGER,
-            genre TEXT,
-            copies_available INTEGER DEFAULT 1
-        );
-        """,
-        # loans table
-        """
-        CREATE TABLE IF NOT EXISTS loan (
-            id SERIAL PRIMARY KEY,
-            book_id INTEGER REFERENCES book(id) ON DELETE CASCADE,
-            member_id INTEGER REFERENCES member(id) ON DELETE CASCADE,
-            loan_date DATE,
-            due_date DATE,
-            return_date DATE,
-            status TEXT
-        );
-        """
-    ]
-
-    conn = get_connection()
-    cur = conn.cursor()
-    for q in queries:
-        cur.execute(q)
-
-    # create default admin user if not exists (username: admin, password: admin)
-    admin_hash = hash_password("man")
-    cur.execute(
-        "INSERT INTO users (username, password_hash, full_name, role) VALUES (%s, %s, %s, %s) ON CONFLICT (username) DO NOTHING;",
-        ('man', admin_hash, 'Administrator', 'admin'))
-
-    cur.close()
-    conn.close()
+    def _patched(self, ids, rows):
+        for row in rows:
+            self.upsert(row)
+        for item_id in set(ids) - {row[0] for row in rows}:
+            self.remove(item_id)
+
+    def _failed_patch(self, error):
+        print("Picker index Error:", error)
+        self.invalidate()
+
+    def invalidate(self):
+        # drop the index; the next picker use reloads it
+        if not self._loading:
+            self.index = None
+
+    def search(self, prefix, limit=20):
+        return self.index.search(prefix, limit) if self.index is not None else []
+
+
+_book_lookup = None
+_member_lookup = None
+
+
+def get_book_lookup():
+    global _book_lookup
+    if _book_lookup is None:
+        _book_lookup = LookupIndex("SELECT id, title, isbn FROM book", book_lookup_entry)
+    return _book_lookup
+
+
+def get_member_lookup():
+    global _member_lookup
+    if _member_lookup is None:
+        _member_lookup = LookupIndex("SELECT id, name FROM member", member_lookup_entry)
+    return _member_lookup
+
+
+# ---------- TABLE MODEL ----------
+class EntityTableModel(QAbstractTableModel):
+    # Read-only model that keeps query results column by column instead of
+    # allocating one item object per cell. Display strings are produced on
+    # demand, so only the rows inside the visible viewport are ever formatted.
+    loading_changed = pyqtSignal(bool)
+    load_failed = pyqtSignal(object)
+
+    def __init__(self, headers, parent=None):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self._columns = [[] for _ in self.headers]
+        self._count = 0
+        self._fetch_page = None
+        self._tag = None
+        self._exhausted = True
+        self._fetching = False
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        if rows:
+            self._columns = [list(col) for col in zip(*rows)]
+        else:
+            self._columns = [[] for _ in self.headers]
+        self._count = len(rows) if rows else 0
+        self._fetch_page = None
+        self._exhausted = True
+        self._set_fetching(False)
+        self.endResetModel()
+
+    def set_pager(self, fetch_page, page_size=PAGE_SIZE):
+        # fetch_page(last_id, limit) returns the next rows ordered by id and
+        # runs on the query executor; the view pulls further pages through
+        # canFetchMore/fetchMore, and a new pager supersedes any pending page
+        self.set_rows([])
+        self._fetch_page = fetch_page
+        # later pages are pulled by the view; record them under the original load
+        self._tag = current_query_tag()
+        self.page_size = page_size
+        self._exhausted = False
+        self.fetchMore()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted and not self._fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted or self._fetching:
+            return
+        last_id = self.last_id()
+        self._set_fetching(True)
+        with query_tag(self._tag):
+            get_executor().submit(('page', id(self)), self._fetch_page, last_id, self.page_size,
+                                  on_result=self._append_page, on_error=self._page_failed)
+
+    def _set_fetching(self, fetching):
+        if fetching != self._fetching:
+            self._fetching = fetching
+            self.loading_changed.emit(fetching)
+
+    def _page_failed(self, error):
+        self._set_fetching(False)
+        self._exhausted = True
+        self.load_failed.emit(error)
+
+    def _append_page(self, rows):
+        self._set_fetching(False)
+        rows = rows or []
+        if len(rows) < self.page_size:
+            self._exhausted = True
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), self._count, self._count + len(rows) - 1)
+        for col, vals in zip(self._columns, zip(*rows)):
+            col.extend(vals)
+        self._count += len(rows)
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        val = self._columns[index.column()][index.row()]
+        return str(val) if val is not None else ''
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def value(self, row, col):
+        return self._columns[col][row]
+
+    def last_id(self):
+        return self._columns[0][-1] if self._count else 0
+
+    def find_row(self, row_id):
+        # rows are kept in id order, so a lookup is a binary search
+        ids = self._columns[0]
+        i = bisect.bisect_left(ids, row_id, 0, self._count)
+        return i if i < self._count and ids[i] == row_id else -1
+
+    def upsert_row(self, row, insert=True):
+        # replace the row with the same id in place, or insert it at its id
+        # position; rows past the loaded pages arrive with a later page instead
+        i = bisect.bisect_left(self._columns[0], row[0], 0, self._count)
+        if i < self._count and self._columns[0][i] == row[0]:
+            for col, val in zip(self._columns, row):
+                col[i] = val
+            self.dataChanged.emit(self.index(i, 0), self.index(i, len(self.headers) - 1))
+            return
+        if not insert or (i == self._count and not self._exhausted):
+            return
+        self.beginInsertRows(QModelIndex(), i, i)
+        for col, val in zip(self._columns, row):
+            col.insert(i, val)
+        self._count += 1
+        self.endInsertRows()
+
+    def remove_row(self, row_id):
+        i = self.find_row(row_id)
+        if i < 0:
+            return
+        self.beginRemoveRows(QModelIndex(), i, i)
+        for col in self._columns:
+            del col[i]
+        self._count -= 1
+        self.endRemoveRows()
 
 
 # ---------- GUI COMPONENTS ----------
+class EntityPicker(QLineEdit):
+    # Type-ahead replacement for a QComboBox listing every row. Suggestions
+    # come from a LookupIndex, which is loaded the first time the picker is used.
+    def __init__(self, lookup, placeholder='', parent=None):
+        super().__init__(parent)
+        self.lookup = lookup
+        self.setPlaceholderText(placeholder)
+        self._selected = None
+        self._choices = {}
+        self.choice_model = QStringListModel(self)
+        completer = QCompleter(self.choice_model, self)
+        # the index already filtered the choices; show them as they are
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        completer.activated[str].connect(self.choose)
+        self.setCompleter(completer)
+        self.textEdited.connect(self.update_choices)
+
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        self.lookup.ensure_loaded()
+
+    def update_choices(self, text):
+        self._selected = None
+        if not self.lookup.loaded:
+            self.lookup.ensure_loaded(lambda: self.update_choices(self.text()))
+            return
+        matches = self.lookup.search(text)
+        self._choices = {label: item_id for item_id, label in matches}
+        self.choice_model.setStringList([label for _, label in matches])
+        if matches and self.hasFocus():
+            self.completer().complete()
+
+    def choose(self, label):
+        self._selected = self._choices.get(label)
+
+    def currentData(self):
+        if self._selected is None:
+            return self._choices.get(self.text())
+        return self._selected
+
+    def clear(self):
+        super().clear()
+        self._selected = None
+        self._choices = {}
+
+
 class EntityTab(QWidget):
     # Base helper for entity tabs
+    entity = None
+    change_dependencies = {}
+    # a row this tab wrote, in listing column order / the id of a row it deleted
+    row_saved = pyqtSignal(object)
+    row_deleted = pyqtSignal(object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
+        self._busy = set()
+        # data is fetched on first activation, not at construction
+        self._needs_load = True
+        self.loading_label = QLabel('Loading...')
+        self.loading_label.setVisible(False)
+        self.layout.addWidget(self.loading_label)
+
+    def build_table(self, headers):
+        # model/view table: the first column holds the hidden row id
+        self.model = EntityTableModel(headers, self)
+        self.model.loading_changed.connect(lambda busy: self.set_busy('page', busy))
+        self.model.load_failed.connect(lambda e: self.show_error(f'Could not load rows: {e}'))
+        view = QTableView()
+        view.setModel(self.model)
+        view.setColumnHidden(0, True)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setSelectionMode(QAbstractItemView.SingleSelection)
+        view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # fixed row heights let the view skip measuring every row
+        view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        view.clicked.connect(lambda index: self.on_row_selected(index.row(), index.column()))
+        return view
+
+    def build_side_table(self, title, headers):
+        # compact read-only table under the listing; the first column holds the
+        # id. Returns the view; its model() takes the rows.
+        model = EntityTableModel(headers, self)
+        view = QTableView()
+        view.setModel(model)
+        view.setColumnHidden(0, True)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        view.horizontalHeader().setStretchLastSection(True)
+        view.setMaximumHeight(160)
+        self.layout.addWidget(QLabel(title))
+        self.layout.addWidget(view)
+        return view
+
+    def load_paged(self, select, id_col, search='', search_params=()):
+        # select has no WHERE clause; search is an optional "AND ..." condition.
+        # Pages are keyset on id_col, and the same listing is reused to re-read
+        # single rows when change notifications arrive.
+        listing = (select, id_col, search, tuple(search_params))
+        self._listing = listing
+        query = listing_page_query(select, id_col, search)
+        self.model.set_pager(
+            lambda last_id, limit: self.read_rows(query, (last_id, *listing[3], limit)))
+
+    def read_rows(self, query, params):
+        # runs on a worker thread
+        return self.resolve_rows(self.run_query(query, params, fetch=True) or [])
+
+    def resolve_rows(self, rows):
+        # listings return ids for columns showing another entity's name; they
+        # are swapped for names read through the entity cache
+        return resolve_listing(self.entity, rows)
+
+    def apply_changes(self, table, ids):
+        # patch just the rows a batch of change notifications touched.
+        # change_dependencies maps a table to the column of this tab's listing
+        # that refers to it; the tab's own table maps to its id column.
+        column = self.change_dependencies.get(table)
+        listing = getattr(self, '_listing', None)
+        if column is None or listing is None or self._needs_load:
+            return
+        select, id_col, search, search_params = listing
+        ids = sorted(ids)
+        own = column == id_col
+        query, params = f"{select} WHERE {column} = ANY(%s)", [ids]
+        if not own:
+            # only rows already loaded can be showing the changed value
+            query += f" AND {id_col} <= %s"
+            params.append(self.model.last_id())
+        get_executor().submit(None, self.read_rows, f"{query} {search}", (*params, *search_params),
+                              on_result=lambda rows: self._patch_rows(listing, ids, rows, own),
+                              on_error=lambda e: print("Change patch Error:", e))
+
+    def save_row(self, fields, entity_id, action):
+        # insert (entity_id None) or update through save_entity; only the
+        # returned row is patched into the table instead of reloading it
+        self.run_async(None, self.write_row, fields, entity_id,
+                       on_result=self.row_written,
+                       on_error=lambda e: self.show_error(f'Could not {action}: {e}'))
+
+    def write_row(self, fields, entity_id):
+        # runs on a worker thread
+        row = save_entity(self.entity, fields, entity_id)
+        return self.resolve_rows([row]) if row is not None else []
+
+    def delete_row(self, entity_id, action):
+        self.run_async(None, delete_entity, self.entity, entity_id,
+                       on_result=lambda _: self.row_removed(entity_id),
+                       on_error=lambda e: self.show_error(f'Could not {action}: {e}'))
+
+    def row_written(self, row):
+        # accepts a single row or the fetchall() of a RETURNING statement
+        rows = row if isinstance(row, list) else [row]
+        if self.entity in ENTITY_CACHE_QUERIES:
+            get_entity_cache().invalidate(self.entity, [r[0] for r in rows])
+        for r in rows:
+            self.model.upsert_row(r)
+            self.row_saved.emit(r)
+
+    def row_removed(self, row_id):
+        if self.entity in ENTITY_CACHE_QUERIES:
+            get_entity_cache().invalidate(self.entity, [row_id])
+        self.model.remove_row(row_id)
+        self.row_deleted.emit(row_id)
+
+    def _patch_rows(self, listing, ids, rows, own):
+        if listing is not self._listing:
+            # reloaded since (e.g. a new search); the fresh pages already have it
+            return
+        for row in rows:
+            self.model.upsert_row(row, insert=own)
+        if own:
+            # deleted, or no longer matching the search
+            for row_id in set(ids) - {row[0] for row in rows}:
+                self.model.remove_row(row_id)
+
+    def build_search_bar(self, placeholder, reload):
+        # debounced: reload() runs once typing pauses for SEARCH_DEBOUNCE_MS
+        self.search_text = ''
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText(placeholder)
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_input.textChanged.connect(self.search_timer.start)
+
+        def apply_search():
+            text = self.search_input.text().strip()
+            if text != self.search_text:
+                self.search_text = text
+                reload()
+
+        self.search_timer.timeout.connect(apply_search)
+        self.search_input.returnPressed.connect(apply_search)
+        return self.search_input
+
+    def cell_text(self, row, col):
+        return self.model.data(self.model.index(row, col))
+
+    def get_selected_id(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        return self.model.value(rows[0].row(), 0)
+
+    def on_row_selected(self, row, col):
+        pass
+
+    def load_data(self):
+        # fetch everything the tab displays; subclasses override
+        pass
+
+    def activate(self):
+        # called by MainWindow when the tab becomes current
+        if self._needs_load:
+            self._needs_load = False
+            self.load_data()
+
+    def refresh(self):
+        # reload now if the tab is on screen, otherwise on its next activation
+        if self.isVisible():
+            self._needs_load = False
+            self.load_data()
+        else:
+            self._needs_load = True
+
+    def set_busy(self, key, busy):
+        if busy:
+            self._busy.add(key)
+        else:
+            self._busy.discard(key)
+        self.loading_label.setVisible(bool(self._busy))
+
+    def show_error(self, message):
+        QMessageBox.critical(self, 'Error', message)
+
+    def run_async(self, key, fn, *args, on_result=None, on_error=None):
+        # run fn(*args) off the GUI thread; a later call with the same key
+        # supersedes this one (e.g. a second Refresh click). Writes pass
+        # key=None so they are never skipped.
+        busy_key = key if key is not None else object()
+
+        def finish(callback, value):
+            self.set_busy(busy_key, False)
+            if key is None:
+                # a write may have changed what the dashboard counts
+                get_stats_cache().invalidate()
+            if callback:
+                callback(value)
+
+        self.set_busy(busy_key, True)
+        get_executor().submit(
+            (id(self), key) if key is not None else None, fn, *args,
+            on_result=lambda result: finish(on_result, result),
+            on_error=lambda e: finish(on_error or (lambda err: self.show_error(f'Database error: {err}')), e))
 
     def run_query(self, query, params=None, fetch=False):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(query, params or ())
-        data = None
-        if fetch:
-            data = cur.fetchall()
-        cur.close()
-        conn.close()
-        return data
+        # blocking; call directly only from worker threads or through run_async
+        return run_query(query, params, fetch)
+
+    def import_rows(self, entity, on_done):
+        path, _ = QFileDialog.getOpenFileName(self, f'Import {entity} records', '',
+                                              'CSV or JSON Lines (*.csv *.jsonl *.json);;All files (*)')
+        if not path:
+            return
+        progress = ProgressSignal(self)
+        progress.updated.connect(lambda st: self.loading_label.setText(
+            f"Importing... {st['read']} read, {st['imported']} imported, {st['rejected']} rejected"))
+
+        def finished(stats):
+            self.loading_label.setText('Loading...')
+            msg = f"Imported {stats['imported']} of {stats['read']} records."
+            if stats['rejected']:
+                msg += f"\n{stats['rejected']} rejected records were written to\n{path}.rejected.jsonl"
+            QMessageBox.information(self, 'Import', msg)
+            on_done()
+
+        def failed(e):
+            self.loading_label.setText('Loading...')
+            self.show_error(f'Import failed: {e}')
+            on_done()
+
+        self.run_async(None, import_file, entity, path, IMPORT_CHUNK_SIZE, progress.updated.emit,
+                       on_result=finished, on_error=failed)
+
+    def export_rows(self, entity):
+        path, selected = QFileDialog.getSaveFileName(self, f'Export {entity} records', f'{entity}.csv',
+                                                     'CSV (*.csv);;Parquet (*.parquet)')
+        if not path:
+            return
+        fmt = 'parquet' if 'Parquet' in selected or path.lower().endswith('.parquet') else 'csv'
+        progress = ProgressSignal(self)
+        progress.updated.connect(lambda n: self.loading_label.setText(f'Exporting... {n} rows written'))
+
+        def finished(count):
+            self.loading_label.setText('Loading...')
+            QMessageBox.information(self, 'Export', f'Exported {count} rows to\n{path}')
+
+        def failed(e):
+            self.loading_label.setText('Loading...')
+            self.show_error(f'Export failed: {e}')
+
+        # keyed by file, so a second export elsewhere does not drop this one's result
+        self.run_async(('export', path), export_table, entity, path, fmt, EXPORT_BATCH_SIZE,
+                       progress.updated.emit, on_result=finished, on_error=failed)
 
 
 # ---------- Author Tab ----------
 class AuthorTab(EntityTab):
+    entity = 'author'
+    change_dependencies = {'author': 'id'}
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.build_ui()
+
+    def load_data(self):
         self.load_authors()
 
     def build_ui(self):
@@ -173,24 +983,28 @@ class AuthorTab(EntityTab):
         self.update_btn = QPushButton('Update Selected')
         self.delete_btn = QPushButton('Delete Selected')
         self.refresh_btn = QPushButton('Refresh')
+        self.import_btn = QPushButton('Import...')
+        self.export_btn = QPushButton('Export...')
         btn_layout.addWidget(self.add_btn)
         btn_layout.addWidget(self.update_btn)
         btn_layout.addWidget(self.delete_btn)
         btn_layout.addWidget(self.refresh_btn)
+        btn_layout.addWidget(self.import_btn)
+        btn_layout.addWidget(self.export_btn)
 
-        self.table = QTableWidget(0, 5)
-        self.table.setHorizontalHeaderLabels(['ID', 'Name', 'Nationality', 'Birth Year', 'Bio'])
-        self.table.setColumnHidden(0, True)
+        self.table = self.build_table(['ID', 'Name', 'Nationality', 'Birth Year', 'Bio'])
 
         self.layout.addLayout(form_layout)
         self.layout.addLayout(btn_layout)
+        self.layout.addWidget(self.build_search_bar('Search authors by name...', self.load_authors))
         self.layout.addWidget(self.table)
 
         self.add_btn.clicked.connect(self.add_author)
         self.update_btn.clicked.connect(self.update_author)
         self.delete_btn.clicked.connect(self.delete_author)
         self.refresh_btn.clicked.connect(self.load_authors)
-        self.table.cellClicked.connect(self.on_row_selected)
+        self.import_btn.clicked.connect(lambda: self.import_rows('author', self.load_authors))
+        self.export_btn.clicked.connect(lambda: self.export_rows('author'))
 
     def add_author(self):
         name = self.name_input.text().strip()
@@ -200,41 +1014,23 @@ class AuthorTab(EntityTab):
         if not name:
             QMessageBox.warning(self, 'Validation', 'Author name is required')
             return
-        q = "INSERT INTO author (name, bio, nationality, birth_year) VALUES (%s, %s, %s, %s)"
-        self.run_query(q, (name, bio, nationality, birth_year))
-        self.load_authors()
+        self.save_row({'name': name, 'bio': bio, 'nationality': nationality, 'birth_year': birth_year},
+                      None, 'add author')
         self.clear_form()
 
     def load_authors(self):
-        q = "SELECT id, name, nationality, birth_year, bio FROM author ORDER BY id"
-        rows = self.run_query(q, fetch=True) or []
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            self.table.setItem(row, 0, QTableWidgetItem(str(r[0])))
-            self.table.setItem(row, 1, QTableWidgetItem(r[1] or ''))
-            self.table.setItem(row, 2, QTableWidgetItem(r[2] or ''))
-            self.table.setItem(row, 3, QTableWidgetItem(str(r[3]) if r[3] else ''))
-            self.table.setItem(row, 4, QTableWidgetItem(r[4] or ''))
+        self.load_paged(*listing('author', self.search_text))
 
     def on_row_selected(self, row, col):
-        if not self.table.item(row, 0):
+        if row < 0 or row >= self.model.rowCount():
             return
-        self.name_input.setText(self.table.item(row, 1).text())
-        self.nationality_input.setText(self.table.item(row, 2).text())
+        self.name_input.setText(self.cell_text(row, 1))
+        self.nationality_input.setText(self.cell_text(row, 2))
         try:
-            self.birthyear_input.setValue(int(self.table.item(row, 3).text()) if self.table.item(row, 3).text() else 0)
+            self.birthyear_input.setValue(int(self.cell_text(row, 3)) if self.cell_text(row, 3) else 0)
         except Exception:
             self.birthyear_input.setValue(0)
-        self.bio_input.setPlainText(self.table.item(row, 4).text())
-
-    def get_selected_id(self):
-        rows = self.table.selectionModel().selectedRows()
-        if not rows:
-            return None
-        row = rows[0].row()
-        return int(self.table.item(row, 0).text())
+        self.bio_input.setPlainText(self.cell_text(row, 4))
 
     def update_author(self):
         sel_id = self.get_selected_id()
@@ -248,9 +1044,8 @@ class AuthorTab(EntityTab):
         if not name:
             QMessageBox.warning(self, 'Validation', 'Author name is required')
             return
-        q = "UPDATE author SET name=%s, bio=%s, nationality=%s, birth_year=%s WHERE id=%s"
-        self.run_query(q, (name, bio, nationality, birth_year, sel_id))
-        self.load_authors()
+        self.save_row({'name': name, 'bio': bio, 'nationality': nationality, 'birth_year': birth_year},
+                      sel_id, 'update author')
 
     def delete_author(self):
         sel_id = self.get_selected_id()
@@ -260,9 +1055,7 @@ class AuthorTab(EntityTab):
         reply = QMessageBox.question(self, 'Confirm', 'Delete selected author?')
         if reply != QMessageBox.Yes:
             return
-        q = "DELETE FROM author WHERE id=%s"
-        self.run_query(q, (sel_id,))
-        self.load_authors()
+        self.delete_row(sel_id, 'delete author')
 
     def clear_form(self):
         self.name_input.clear()
@@ -273,10 +1066,20 @@ class AuthorTab(EntityTab):
 
 # ---------- Book Tab ----------
 class BookTab(EntityTab):
+    # author renames show up in the Author column
+    entity = 'book'
+    change_dependencies = {'book': 'b.id', 'author': 'b.author_id'}
+
     def __init__(self, author_tab: AuthorTab, parent=None):
         super().__init__(parent)
         self.author_tab = author_tab
         self.build_ui()
+        self.row_saved.connect(self.book_saved)
+        self.row_deleted.connect(self.book_deleted)
+        author_tab.row_saved.connect(lambda row: self.author_saved(row[0], row[1]))
+        author_tab.row_deleted.connect(self.author_removed)
+
+    def load_data(self):
         self.load_books()
         self.load_authors_into_combo()
 
@@ -319,35 +1122,66 @@ class BookTab(EntityTab):
         self.update_btn = QPushButton('Update Selected')
         self.delete_btn = QPushButton('Delete Selected')
         self.refresh_btn = QPushButton('Refresh')
+        self.import_btn = QPushButton('Import...')
+        self.export_btn = QPushButton('Export...')
         btn_layout.addWidget(self.add_btn)
         btn_layout.addWidget(self.update_btn)
         btn_layout.addWidget(self.delete_btn)
         btn_layout.addWidget(self.refresh_btn)
+        btn_layout.addWidget(self.import_btn)
+        btn_layout.addWidget(self.export_btn)
 
-        self.table = QTableWidget(0, 8)
-        self.table.setHorizontalHeaderLabels(['ID', 'Title', 'Author', 'ISBN', 'Publisher', 'Year', 'Genre', 'Copies'])
-        self.table.setColumnHidden(0, True)
+        self.table = self.build_table(['ID', 'Title', 'Author', 'ISBN', 'Publisher', 'Year', 'Genre', 'Copies'])
 
         self.layout.addLayout(form_layout)
         self.layout.addLayout(btn_layout)
+        self.layout.addWidget(self.build_search_bar('Search books by title, author or ISBN...', self.load_books))
         self.layout.addWidget(self.table)
+        self.also_borrowed = self.build_side_table('Members who borrowed this also borrowed',
+                                                   ['ID', 'Title', 'Borrowed together']).model()
+        self.holds = self.build_side_table('Holds', ['ID', 'Member', 'Status', 'Requested', 'Pickup by',
+                                                     'Expected']).model()
 
         self.add_btn.clicked.connect(self.add_book)
         self.update_btn.clicked.connect(self.update_book)
         self.delete_btn.clicked.connect(self.delete_book)
         self.refresh_btn.clicked.connect(self.load_books)
-        self.table.cellClicked.connect(self.on_row_selected)
+        self.import_btn.clicked.connect(lambda: self.import_rows('book', self.imported_books))
+        self.export_btn.clicked.connect(lambda: self.export_rows('book'))
 
     def run_query(self, query, params=None, fetch=False):
         return super().run_query(query, params, fetch)
 
     def load_authors_into_combo(self):
         q = "SELECT id, name FROM author ORDER BY name"
-        rows = self.run_query(q, fetch=True) or []
+        self.run_async('authors_combo', self.run_query, q, None, True, on_result=self.fill_author_combo)
+
+    def fill_author_combo(self, rows):
+        rows = rows or []
+        get_entity_cache().put_many('author', rows)
+        # keep the selection of a form being edited
+        selected = self.author_combo.currentData()
         self.author_combo.clear()
         self.author_combo.addItem('--- None ---', None)
         for r in rows:
             self.author_combo.addItem(r[1], r[0])
+        idx = self.author_combo.findData(selected)
+        self.author_combo.setCurrentIndex(max(idx, 0))
+
+    def apply_changes(self, table, ids):
+        super().apply_changes(table, ids)
+        if table == 'author' and not self._needs_load:
+            ids = sorted(ids)
+            q = "SELECT id, name FROM author WHERE id = ANY(%s)"
+            get_executor().submit(None, self.run_query, q, (ids,), True,
+                                  on_result=lambda rows: self.authors_changed(ids, rows or []),
+                                  on_error=lambda e: print("Change patch Error:", e))
+
+    def authors_changed(self, ids, rows):
+        for author_id, name in rows:
+            self.author_saved(author_id, name)
+        for author_id in set(ids) - {r[0] for r in rows}:
+            self.author_removed(author_id)
 
     def add_book(self):
         title = self.title_input.text().strip()
@@ -360,57 +1194,40 @@ class BookTab(EntityTab):
         if not title:
             QMessageBox.warning(self, 'Validation', 'Book title is required')
             return
-        q = "INSERT INTO book (title, author_id, isbn, publisher, published_year, genre, copies_available) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-        try:
-            self.run_query(q, (title, author_id, isbn, publisher, year, genre, copies))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not add book: {e}')
-        self.load_books()
+        self.save_row({'title': title, 'author_id': author_id, 'isbn': isbn, 'publisher': publisher,
+                       'published_year': year, 'genre': genre, 'copies_available': copies},
+                      None, 'add book')
         self.clear_form()
 
     def load_books(self):
-        q = """
-            SELECT b.id, b.title, a.name, b.isbn, b.publisher, b.published_year, b.genre, b.copies_available
-            FROM book b LEFT JOIN author a ON b.author_id = a.id
-            ORDER BY b.id
-        """
-        rows = self.run_query(q, fetch=True) or []
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            for col_index, val in enumerate(r):
-                self.table.setItem(row, col_index, QTableWidgetItem(str(val) if val is not None else ''))
+        # author names are filled in by resolve_rows
+        self.load_paged(*listing('book', self.search_text))
 
     def on_row_selected(self, row, col):
-        if not self.table.item(row, 0):
+        if row < 0 or row >= self.model.rowCount():
             return
-        self.title_input.setText(self.table.item(row, 1).text())
-        self.isbn_input.setText(self.table.item(row, 3).text())
-        self.publisher_input.setText(self.table.item(row, 4).text())
+        self.title_input.setText(self.cell_text(row, 1))
+        self.isbn_input.setText(self.cell_text(row, 3))
+        self.publisher_input.setText(self.cell_text(row, 4))
         try:
-            self.pubyear_input.setValue(int(self.table.item(row, 5).text()) if self.table.item(row, 5).text() else 0)
+            self.pubyear_input.setValue(int(self.cell_text(row, 5)) if self.cell_text(row, 5) else 0)
         except Exception:
             self.pubyear_input.setValue(0)
-        self.genre_input.setText(self.table.item(row, 6).text())
+        self.genre_input.setText(self.cell_text(row, 6))
         try:
-            self.copies_input.setValue(int(self.table.item(row, 7).text()) if self.table.item(row, 7).text() else 1)
+            self.copies_input.setValue(int(self.cell_text(row, 7)) if self.cell_text(row, 7) else 1)
         except Exception:
             self.copies_input.setValue(1)
         # select author in combo
-        name = self.table.item(row, 2).text()
+        name = self.cell_text(row, 2)
         idx = self.author_combo.findText(name)
         if idx >= 0:
             self.author_combo.setCurrentIndex(idx)
         else:
             self.author_combo.setCurrentIndex(0)
-
-    def get_selected_id(self):
-        rows = self.table.selectionModel().selectedRows()
-        if not rows:
-            return None
-        row = rows[0].row()
-        return int(self.table.item(row, 0).text())
+        self.run_async('also_borrowed', similar_books, self.model.value(row, 0),
+                       on_result=self.also_borrowed.set_rows)
+        self.run_async('holds', hold_queue, self.model.value(row, 0), on_result=self.holds.set_rows)
 
     def update_book(self):
         sel_id = self.get_selected_id()
@@ -427,12 +1244,9 @@ class BookTab(EntityTab):
         if not title:
             QMessageBox.warning(self, 'Validation', 'Book title is required')
             return
-        q = "UPDATE book SET title=%s, author_id=%s, isbn=%s, publisher=%s, published_year=%s, genre=%s, copies_available=%s WHERE id=%s"
-        try:
-            self.run_query(q, (title, author_id, isbn, publisher, year, genre, copies, sel_id))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not update book: {e}')
-        self.load_books()
+        self.save_row({'title': title, 'author_id': author_id, 'isbn': isbn, 'publisher': publisher,
+                       'published_year': year, 'genre': genre, 'copies_available': copies},
+                      sel_id, 'update book')
 
     def delete_book(self):
         sel_id = self.get_selected_id()
@@ -442,9 +1256,36 @@ class BookTab(EntityTab):
         reply = QMessageBox.question(self, 'Confirm', 'Delete selected book?')
         if reply != QMessageBox.Yes:
             return
-        q = "DELETE FROM book WHERE id=%s"
-        self.run_query(q, (sel_id,))
+        self.delete_row(sel_id, 'delete book')
+
+    def book_saved(self, row):
+        get_book_lookup().upsert((row[0], row[1], row[3]))
+
+    def book_deleted(self, book_id):
+        get_book_lookup().remove(book_id)
+
+    def author_saved(self, author_id, name):
+        # keep the name-ordered combo current without re-querying it
+        if self._needs_load:
+            return
+        selected = self.author_combo.currentData()
+        self.author_removed(author_id)
+        pos = 1
+        while pos < self.author_combo.count() and self.author_combo.itemText(pos).lower() < name.lower():
+            pos += 1
+        self.author_combo.insertItem(pos, name, author_id)
+        self.author_combo.setCurrentIndex(max(self.author_combo.findData(selected), 0))
+
+    def author_removed(self, author_id):
+        idx = self.author_combo.findData(author_id)
+        if idx > 0:
+            self.author_combo.removeItem(idx)
+
+    def imported_books(self):
+        # an import may also have created authors
+        get_book_lookup().invalidate()
         self.load_books()
+        self.load_authors_into_combo()
 
     def clear_form(self):
         self.title_input.clear()
@@ -458,9 +1299,16 @@ class BookTab(EntityTab):
 
 # ---------- Member Tab ----------
 class MemberTab(EntityTab):
+    entity = 'member'
+    change_dependencies = {'member': 'id'}
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.build_ui()
+        self.row_saved.connect(self.member_saved)
+        self.row_deleted.connect(self.member_deleted)
+
+    def load_data(self):
         self.load_members()
 
     def build_ui(self):
@@ -497,24 +1345,29 @@ class MemberTab(EntityTab):
         self.update_btn = QPushButton('Update Selected')
         self.delete_btn = QPushButton('Delete Selected')
         self.refresh_btn = QPushButton('Refresh')
+        self.import_btn = QPushButton('Import...')
+        self.export_btn = QPushButton('Export...')
         btn_layout.addWidget(self.add_btn)
         btn_layout.addWidget(self.update_btn)
         btn_layout.addWidget(self.delete_btn)
         btn_layout.addWidget(self.refresh_btn)
+        btn_layout.addWidget(self.import_btn)
+        btn_layout.addWidget(self.export_btn)
 
-        self.table = QTableWidget(0, 6)
-        self.table.setHorizontalHeaderLabels(['ID', 'Name', 'Email', 'Phone', 'Membership', 'Join Date'])
-        self.table.setColumnHidden(0, True)
+        self.table = self.build_table(['ID', 'Name', 'Email', 'Phone', 'Membership', 'Join Date'])
 
         self.layout.addLayout(form_layout)
         self.layout.addLayout(btn_layout)
+        self.layout.addWidget(self.build_search_bar('Search members by name, email or phone...', self.load_members))
         self.layout.addWidget(self.table)
+        self.suggestions = self.build_side_table('Suggested for this member', ['ID', 'Title', 'Score']).model()
 
         self.add_btn.clicked.connect(self.add_member)
         self.update_btn.clicked.connect(self.update_member)
         self.delete_btn.clicked.connect(self.delete_member)
         self.refresh_btn.clicked.connect(self.load_members)
-        self.table.cellClicked.connect(self.on_row_selected)
+        self.import_btn.clicked.connect(lambda: self.import_rows('member', self.imported_members))
+        self.export_btn.clicked.connect(lambda: self.export_rows('member'))
 
     def add_member(self):
         name = self.name_input.text().strip()
@@ -525,46 +1378,31 @@ class MemberTab(EntityTab):
         if not name:
             QMessageBox.warning(self, 'Validation', 'Member name is required')
             return
-        q = "INSERT INTO member (name, email, phone, membership_type, join_date) VALUES (%s, %s, %s, %s, %s)"
-        try:
-            self.run_query(q, (name, email, phone, membership_type, join_date))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not add member: {e}')
-        self.load_members()
+        self.save_row({'name': name, 'email': email, 'phone': phone, 'membership_type': membership_type,
+                       'join_date': join_date},
+                      None, 'add member')
         self.clear_form()
 
     def load_members(self):
-        q = "SELECT id, name, email, phone, membership_type, join_date FROM member ORDER BY id"
-        rows = self.run_query(q, fetch=True) or []
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            for i, val in enumerate(r):
-                self.table.setItem(row, i, QTableWidgetItem(str(val) if val is not None else ''))
+        self.load_paged(*listing('member', self.search_text))
 
     def on_row_selected(self, row, col):
-        if not self.table.item(row, 0):
+        if row < 0 or row >= self.model.rowCount():
             return
-        self.name_input.setText(self.table.item(row, 1).text())
-        self.email_input.setText(self.table.item(row, 2).text())
-        self.phone_input.setText(self.table.item(row, 3).text())
-        idx = self.membership_type_input.findText(self.table.item(row, 4).text())
+        self.name_input.setText(self.cell_text(row, 1))
+        self.email_input.setText(self.cell_text(row, 2))
+        self.phone_input.setText(self.cell_text(row, 3))
+        idx = self.membership_type_input.findText(self.cell_text(row, 4))
         if idx >= 0:
             self.membership_type_input.setCurrentIndex(idx)
         try:
-            qdate = QDate.fromString(self.table.item(row, 5).text(), 'yyyy-MM-dd')
+            qdate = QDate.fromString(self.cell_text(row, 5), 'yyyy-MM-dd')
             if qdate.isValid():
                 self.join_date.setDate(qdate)
         except Exception:
             pass
-
-    def get_selected_id(self):
-        rows = self.table.selectionModel().selectedRows()
-        if not rows:
-            return None
-        row = rows[0].row()
-        return int(self.table.item(row, 0).text())
+        self.run_async('suggestions', member_suggestions, self.model.value(row, 0),
+                       on_result=self.suggestions.set_rows)
 
     def update_member(self):
         sel_id = self.get_selected_id()
@@ -579,12 +1417,9 @@ class MemberTab(EntityTab):
         if not name:
             QMessageBox.warning(self, 'Validation', 'Member name is required')
             return
-        q = "UPDATE member SET name=%s, email=%s, phone=%s, membership_type=%s, join_date=%s WHERE id=%s"
-        try:
-            self.run_query(q, (name, email, phone, membership_type, join_date, sel_id))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not update member: {e}')
-        self.load_members()
+        self.save_row({'name': name, 'email': email, 'phone': phone, 'membership_type': membership_type,
+                       'join_date': join_date},
+                      sel_id, 'update member')
 
     def delete_member(self):
         sel_id = self.get_selected_id()
@@ -594,8 +1429,16 @@ class MemberTab(EntityTab):
         reply = QMessageBox.question(self, 'Confirm', 'Delete selected member?')
         if reply != QMessageBox.Yes:
             return
-        q = "DELETE FROM member WHERE id=%s"
-        self.run_query(q, (sel_id,))
+        self.delete_row(sel_id, 'delete member')
+
+    def member_saved(self, row):
+        get_member_lookup().upsert((row[0], row[1]))
+
+    def member_deleted(self, member_id):
+        get_member_lookup().remove(member_id)
+
+    def imported_members(self):
+        get_member_lookup().invalidate()
         self.load_members()
 
     def clear_form(self):
@@ -608,9 +1451,15 @@ class MemberTab(EntityTab):
 
 # ---------- Bookclub Tab ----------
 class BookclubTab(EntityTab):
+    entity = 'bookclub'
+    change_dependencies = {'bookclub': 'id'}
+
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.club_id = None
         self.build_ui()
+
+    def load_data(self):
         self.load_bookclubs()
 
     def build_ui(self):
@@ -638,24 +1487,56 @@ class BookclubTab(EntityTab):
         self.update_btn = QPushButton('Update Selected')
         self.delete_btn = QPushButton('Delete Selected')
         self.refresh_btn = QPushButton('Refresh')
+        self.export_btn = QPushButton('Export...')
         btn_layout.addWidget(self.add_btn)
         btn_layout.addWidget(self.update_btn)
         btn_layout.addWidget(self.delete_btn)
         btn_layout.addWidget(self.refresh_btn)
-
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(['ID', 'Name', 'Meeting Day', 'Description'])
-        self.table.setColumnHidden(0, True)
+        btn_layout.addWidget(self.export_btn)
+
+        self.table = self.build_table(['ID', 'Name', 'Meeting Day', 'Description'])
+
+        # membership and reading list of the selected club
+        member_layout = QHBoxLayout()
+        self.member_picker = EntityPicker(get_member_lookup(), 'Type a member name...')
+        self.enrol_btn = QPushButton('Enrol')
+        self.enrol_list_btn = QPushButton('Enrol List...')
+        self.remove_member_btn = QPushButton('Remove Selected Member')
+        member_layout.addWidget(self.member_picker)
+        member_layout.addWidget(self.enrol_btn)
+        member_layout.addWidget(self.enrol_list_btn)
+        member_layout.addWidget(self.remove_member_btn)
+
+        reading_layout = QHBoxLayout()
+        self.book_picker = EntityPicker(get_book_lookup(), 'Type a title or ISBN...')
+        self.add_reading_btn = QPushButton('Add to Reading List')
+        self.mark_read_btn = QPushButton('Mark Next Book Read')
+        self.reserve_btn = QPushButton('Reserve Next Book for Members')
+        reading_layout.addWidget(self.book_picker)
+        reading_layout.addWidget(self.add_reading_btn)
+        reading_layout.addWidget(self.mark_read_btn)
+        reading_layout.addWidget(self.reserve_btn)
 
         self.layout.addLayout(form_layout)
         self.layout.addLayout(btn_layout)
         self.layout.addWidget(self.table)
+        self.layout.addLayout(member_layout)
+        self.members_view = self.build_side_table('Members', ['ID', 'Name', 'Membership', 'Joined', 'Next book'])
+        self.layout.addLayout(reading_layout)
+        self.reading_list = self.build_side_table(
+            'Reading list', ['ID', '#', 'Title', 'Author', 'Copies', 'Read on', 'Club holds']).model()
 
         self.add_btn.clicked.connect(self.add_bookclub)
         self.update_btn.clicked.connect(self.update_bookclub)
         self.delete_btn.clicked.connect(self.delete_bookclub)
         self.refresh_btn.clicked.connect(self.load_bookclubs)
-        self.table.cellClicked.connect(self.on_row_selected)
+        self.export_btn.clicked.connect(lambda: self.export_rows('bookclub'))
+        self.enrol_btn.clicked.connect(self.enrol_member)
+        self.enrol_list_btn.clicked.connect(self.enrol_list)
+        self.remove_member_btn.clicked.connect(self.remove_member)
+        self.add_reading_btn.clicked.connect(self.add_reading)
+        self.mark_read_btn.clicked.connect(self.mark_next_read)
+        self.reserve_btn.clicked.connect(self.reserve_next_book)
 
     def add_bookclub(self):
         name = self.name_input.text().strip()
@@ -664,34 +1545,104 @@ class BookclubTab(EntityTab):
         if not name:
             QMessageBox.warning(self, 'Validation', 'Bookclub name is required')
             return
-        q = "INSERT INTO bookclub (name, description, meeting_day) VALUES (%s, %s, %s)"
-        self.run_query(q, (name, desc, meeting_day))
-        self.load_bookclubs()
+        self.save_row({'name': name, 'description': desc, 'meeting_day': meeting_day},
+                      None, 'add bookclub')
         self.clear_form()
 
     def load_bookclubs(self):
-        q = "SELECT id, name, meeting_day, description FROM bookclub ORDER BY id"
-        rows = self.run_query(q, fetch=True) or []
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            for i, val in enumerate(r):
-                self.table.setItem(row, i, QTableWidgetItem(str(val) if val is not None else ''))
+        self.load_paged(*listing('bookclub'))
 
     def on_row_selected(self, row, col):
-        if not self.table.item(row, 0):
+        if row < 0 or row >= self.model.rowCount():
+            return
+        self.name_input.setText(self.cell_text(row, 1))
+        self.meeting_day_input.setText(self.cell_text(row, 2))
+        self.desc_input.setPlainText(self.cell_text(row, 3))
+        self.club_id = self.model.value(row, 0)
+        self.load_club()
+
+    def load_club(self):
+        # one query each for the members and the reading list
+        if self.club_id is None:
+            return
+        self.run_async('club_members', club_members, self.club_id, on_result=self.members_view.model().set_rows)
+        self.run_async('club_reading', club_reading_list, self.club_id, on_result=self.reading_list.set_rows)
+
+    def club_changed(self, message=None):
+        if message:
+            QMessageBox.information(self, 'Bookclub', message)
+        self.load_club()
+
+    def require_club(self):
+        if self.club_id is None:
+            QMessageBox.warning(self, 'Selection', 'Select a bookclub first')
+        return self.club_id
+
+    def enrol_member(self):
+        member_id = self.member_picker.currentData()
+        if not self.require_club():
+            return
+        if not member_id:
+            QMessageBox.warning(self, 'Validation', 'Select a member to enrol')
             return
-        self.name_input.setText(self.table.item(row, 1).text())
-        self.meeting_day_input.setText(self.table.item(row, 2).text())
-        self.desc_input.setPlainText(self.table.item(row, 3).text())
+        self.run_async(None, enrol_members, self.club_id, [member_id], on_result=lambda _: self.club_changed())
+        self.member_picker.clear()
 
-    def get_selected_id(self):
-        rows = self.table.selectionModel().selectedRows()
-        if not rows:
-            return None
-        row = rows[0].row()
-        return int(self.table.item(row, 0).text())
+    def enrol_list(self):
+        # paste a member list by email, one per line or comma separated
+        if not self.require_club():
+            return
+        text, ok = QInputDialog.getMultiLineText(self, 'Enrol members', 'Member emails:')
+        emails = [e for e in text.replace(',', '\n').split('\n') if e.strip()]
+        if not ok or not emails:
+            return
+        self.run_async(None, enrol_members, self.club_id, (), emails,
+                       on_result=lambda n: self.club_changed(f'Enrolled {n} of {len(emails)} members.'))
+
+    def remove_member(self):
+        if not self.require_club():
+            return
+        view = self.members_view
+        member_ids = [view.model().value(index.row(), 0) for index in view.selectionModel().selectedRows()]
+        if not member_ids:
+            QMessageBox.warning(self, 'Selection', 'Select members to remove')
+            return
+        self.run_async(None, remove_members, self.club_id, member_ids, on_result=lambda _: self.club_changed())
+
+    def add_reading(self):
+        book_id = self.book_picker.currentData()
+        if not self.require_club():
+            return
+        if not book_id:
+            QMessageBox.warning(self, 'Validation', 'Select a book to add')
+            return
+        self.run_async(None, add_to_reading_list, self.club_id, [book_id], on_result=lambda _: self.club_changed())
+        self.book_picker.clear()
+
+    def mark_next_read(self):
+        if not self.require_club():
+            return
+        # first unread book of the loaded list
+        model = self.reading_list
+        unread = [model.value(row, 0) for row in range(model.rowCount()) if model.value(row, 5) is None]
+        if not unread:
+            QMessageBox.information(self, 'Bookclub', 'Every book on the reading list has been read.')
+            return
+        self.run_async(None, mark_club_book_read, self.club_id, unread[0], on_result=lambda _: self.club_changed())
+
+    def reserve_next_book(self):
+        if not self.require_club():
+            return
+        self.run_async(None, reserve_club_book, self.club_id, on_result=self.club_book_reserved,
+                       on_error=lambda e: self.show_error(f'Could not reserve: {e}'))
+
+    def club_book_reserved(self, result):
+        if result is None:
+            self.club_changed('Every book on the reading list has been read.')
+            return
+        _, placed, ready = result
+        self.club_changed(f'Placed {placed} holds: {ready} copies are ready for pickup, '
+                          f'{placed - ready} members are in the queue.')
 
     def update_bookclub(self):
         sel_id = self.get_selected_id()
@@ -704,9 +1655,8 @@ class BookclubTab(EntityTab):
         if not name:
             QMessageBox.warning(self, 'Validation', 'Bookclub name is required')
             return
-        q = "UPDATE bookclub SET name=%s, description=%s, meeting_day=%s WHERE id=%s"
-        self.run_query(q, (name, desc, meeting_day, sel_id))
-        self.load_bookclubs()
+        self.save_row({'name': name, 'description': desc, 'meeting_day': meeting_day},
+                      sel_id, 'update bookclub')
 
     def delete_bookclub(self):
         sel_id = self.get_selected_id()
@@ -716,9 +1666,7 @@ class BookclubTab(EntityTab):
         reply = QMessageBox.question(self, 'Confirm', 'Delete selected bookclub?')
         if reply != QMessageBox.Yes:
             return
-        q = "DELETE FROM bookclub WHERE id=%s"
-        self.run_query(q, (sel_id,))
-        self.load_bookclubs()
+        self.delete_row(sel_id, 'delete bookclub')
 
     def clear_form(self):
         self.name_input.clear()
@@ -727,40 +1675,52 @@ class BookclubTab(EntityTab):
 
 
 # ---------- Loan Tab ----------
+def due_period_forecast(days):
+    # runs on a worker thread; numpy is optional, so the import waits until here
+    from library_analytics import get_loan_history
+    return get_loan_history().what_if([days])[0]
+
+
 class LoanTab(EntityTab):
+    entity = 'loan'
+    change_dependencies = {'loan': 'l.id', 'book': 'l.book_id', 'member': 'l.member_id'}
+
     def __init__(self, book_tab: BookTab, member_tab: MemberTab, parent=None):
         super().__init__(parent)
         self.book_tab = book_tab
         self.member_tab = member_tab
         self.build_ui()
+
+    def load_data(self):
         self.load_loans()
-        self.load_books_members()
 
     def build_ui(self):
         form_layout = QHBoxLayout()
         left = QVBoxLayout()
         right = QVBoxLayout()
 
-        self.book_combo = QComboBox()
-        self.member_combo = QComboBox()
+        self.book_picker = EntityPicker(get_book_lookup(), 'Type a title or ISBN...')
+        self.member_picker = EntityPicker(get_member_lookup(), 'Type a member name...')
         self.loan_date = QDateEdit()
         self.loan_date.setCalendarPopup(True)
         self.loan_date.setDate(QDate.currentDate())
         self.due_days_spin = QSpinBox()
         self.due_days_spin.setRange(1, 365)
         self.due_days_spin.setValue(14)
+        self.due_forecast_label = QLabel('')
         self.status_combo = QComboBox()
         self.status_combo.addItems(['On Loan', 'Returned', 'Overdue'])
 
         left.addWidget(QLabel('Book'))
-        left.addWidget(self.book_combo)
+        left.addWidget(self.book_picker)
         left.addWidget(QLabel('Member'))
-        left.addWidget(self.member_combo)
+        left.addWidget(self.member_picker)
 
         right.addWidget(QLabel('Loan Date'))
         right.addWidget(self.loan_date)
         right.addWidget(QLabel('Due in (days)'))
         right.addWidget(self.due_days_spin)
+        right.addWidget(self.due_forecast_label)
         right.addWidget(QLabel('Status'))
         right.addWidget(self.status_combo)
 
@@ -772,14 +1732,14 @@ class LoanTab(EntityTab):
         self.return_btn = QPushButton('Mark Returned')
         self.delete_btn = QPushButton('Delete Loan')
         self.refresh_btn = QPushButton('Refresh')
+        self.export_btn = QPushButton('Export...')
         btn_layout.addWidget(self.add_btn)
         btn_layout.addWidget(self.return_btn)
         btn_layout.addWidget(self.delete_btn)
         btn_layout.addWidget(self.refresh_btn)
+        btn_layout.addWidget(self.export_btn)
 
-        self.table = QTableWidget(0, 7)
-        self.table.setHorizontalHeaderLabels(['ID', 'Book', 'Member', 'Loan Date', 'Due Date', 'Return Date', 'Status'])
-        self.table.setColumnHidden(0, True)
+        self.table = self.build_table(['ID', 'Book', 'Member', 'Loan Date', 'Due Date', 'Return Date', 'Status'])
 
         self.layout.addLayout(form_layout)
         self.layout.addLayout(btn_layout)
@@ -789,26 +1749,31 @@ class LoanTab(EntityTab):
         self.return_btn.clicked.connect(self.mark_returned)
         self.delete_btn.clicked.connect(self.delete_loan)
         self.refresh_btn.clicked.connect(self.load_loans)
-        self.table.cellClicked.connect(self.on_row_selected)
+        self.export_btn.clicked.connect(lambda: self.export_rows('loan'))
+        self.due_days_spin.valueChanged.connect(self.update_due_forecast)
+
+    def update_due_forecast(self):
+        # what-if for the chosen period over the whole loan history
+        self.run_async('due_forecast', due_period_forecast, self.due_days_spin.value(),
+                       on_result=self.show_due_forecast, on_error=self.due_forecast_failed)
+
+    def show_due_forecast(self, result):
+        days, over, rate = result
+        self.due_forecast_label.setText(f'{rate:.0%} of past loans ran over {days} days')
+
+    def due_forecast_failed(self, error):
+        print("Due forecast Error:", error)
+        self.due_forecast_label.setText('')
 
     def load_books_members(self):
-        # populate book combo (only books with copies >= 1)
-        books = self.run_query("SELECT id, title, copies_available FROM book ORDER BY title", fetch=True) or []
-        self.book_combo.clear()
-        self.book_combo.addItem('--- Select ---', None)
-        for b in books:
-            disp = f"{b[1]} (copies: {b[2]})"
-            self.book_combo.addItem(disp, b[0])
-
-        members = self.run_query("SELECT id, name FROM member ORDER BY name", fetch=True) or []
-        self.member_combo.clear()
-        self.member_combo.addItem('--- Select ---', None)
-        for m in members:
-            self.member_combo.addItem(m[1], m[0])
+        # pickers are kept in sync as rows are written; an explicit refresh
+        # drops their indexes so the next lookup reloads them
+        get_book_lookup().invalidate()
+        get_member_lookup().invalidate()
 
     def add_loan(self):
-        book_id = self.book_combo.currentData()
-        member_id = self.member_combo.currentData()
+        book_id = self.book_picker.currentData()
+        member_id = self.member_picker.currentData()
         loan_date = self.loan_date.date().toPyDate()
         due_date = loan_date + timedelta(days=self.due_days_spin.value())
         status = self.status_combo.currentText()
@@ -817,69 +1782,57 @@ class LoanTab(EntityTab):
             QMessageBox.warning(self, 'Validation', 'Select both book and member')
             return
 
-        # check copies availability
-        copies_row = self.run_query("SELECT copies_available FROM book WHERE id=%s", (book_id,), fetch=True)
-        copies = copies_row[0][0] if copies_row and copies_row[0] else 0
-        if copies < 1:
-            QMessageBox.warning(self, 'Unavailable', 'No available copies for this book')
+        self.run_async(None, checkout_book, book_id, member_id, loan_date, due_date, status,
+                       on_result=lambda row: self.loan_created(row, book_id, member_id),
+                       on_error=lambda e: self.show_error(f'Could not create loan: {e}'))
+
+    def loan_created(self, row, book_id, member_id):
+        if row is None:
+            reply = QMessageBox.question(self, 'Unavailable',
+                                         'No available copies for this book.\nPlace a hold for this member?',
+                                         QMessageBox.Yes | QMessageBox.No)
+            if reply == QMessageBox.Yes:
+                self.run_async(None, place_hold, book_id, member_id, on_result=self.hold_placed,
+                               on_error=lambda e: self.show_error(f'Could not place hold: {e}'))
             return
+        self.row_written(row)
 
-        q = "INSERT INTO loan (book_id, member_id, loan_date, due_date, status) VALUES (%s, %s, %s, %s, %s)"
-        try:
-            self.run_query(q, (book_id, member_id, loan_date, due_date, status))
-            # decrement copies available
-            self.run_query("UPDATE book SET copies_available = copies_available - 1 WHERE id=%s", (book_id,))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not create loan: {e}')
-        self.load_loans()
-        self.load_books_members()
+    def hold_placed(self, result):
+        if result is None:
+            QMessageBox.warning(self, 'Hold', 'A copy has come back in the meantime, '
+                                              'or this member already holds the book')
+            return
+        _, position, expected = result
+        when = f'expected around {expected:%Y-%m-%d}' if expected else 'no copy is out on loan to wait for'
+        QMessageBox.information(self, 'Hold', f'Hold placed: number {position} in the queue, {when}.')
 
     def load_loans(self):
-        q = """
-            SELECT l.id, b.title, m.name, l.loan_date, l.due_date, l.return_date, l.status
-            FROM loan l
-            LEFT JOIN book b ON l.book_id = b.id
-            LEFT JOIN member m ON l.member_id = m.id
-            ORDER BY l.id
-        """
-        rows = self.run_query(q, fetch=True) or []
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            for i, val in enumerate(r):
-                self.table.setItem(row, i, QTableWidgetItem(str(val) if val is not None else ''))
+        self.load_paged(*listing('loan'))
 
     def on_row_selected(self, row, col):
-        if not self.table.item(row, 0):
+        if row < 0 or row >= self.model.rowCount():
             return
         # selecting a loan doesn't auto-fill combos here (keeps process simple)
         pass
 
-    def get_selected_id(self):
-        rows = self.table.selectionModel().selectedRows()
-        if not rows:
-            return None
-        row = rows[0].row()
-        return int(self.table.item(row, 0).text())
-
     def mark_returned(self):
         sel_id = self.get_selected_id()
         if not sel_id:
             QMessageBox.warning(self, 'Selection', 'Select a loan to mark returned')
             return
         return_date = date.today()
-        try:
-            # find book id for this loan
-            b = self.run_query("SELECT book_id FROM loan WHERE id=%s", (sel_id,), fetch=True)
-            book_id = b[0][0] if b else None
-            self.run_query("UPDATE loan SET return_date=%s, status=%s WHERE id=%s", (return_date, 'Returned', sel_id))
-            if book_id:
-                self.run_query("UPDATE book SET copies_available = copies_available + 1 WHERE id=%s", (book_id,))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not mark returned: {e}')
-        self.load_loans()
-        self.load_books_members()
+        self.run_async(None, return_book, sel_id, return_date,
+                       on_result=self.loan_returned,
+                       on_error=lambda e: self.show_error(f'Could not mark returned: {e}'))
+
+    def loan_returned(self, result):
+        if result is None:
+            QMessageBox.warning(self, 'Already Returned', 'This loan has already been returned')
+            return
+        row, held_for = result
+        self.row_written(row)
+        if held_for:
+            QMessageBox.information(self, 'Hold', f'Set this copy aside for {held_for}, who has a hold on it.')
 
     def delete_loan(self):
         sel_id = self.get_selected_id()
@@ -891,13 +1844,7 @@ class LoanTab(EntityTab):
                                      QMessageBox.Yes | QMessageBox.No)
         if reply != QMessageBox.Yes:
             return
-        q = "DELETE FROM loan WHERE id=%s"
-        try:
-            self.run_query(q, (sel_id,))
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Could not delete loan: {e}')
-        self.load_loans()
-        self.load_books_members()
+        self.delete_row(sel_id, 'delete loan')
 
 
 class DashboardTab(QWidget):
@@ -905,6 +1852,9 @@ class DashboardTab(QWidget):
         super().__init__()
         self.db = db
         self.build_ui()
+        # the dashboard is the first tab shown, so it loads straight away
+        self._needs_load = False
+        self._stale = False
         self.refresh_stats()
 
     def build_ui(self):
@@ -945,16 +1895,42 @@ class DashboardTab(QWidget):
 
         main_layout.addLayout(grid)
 
-        refresh_btn = QPushButton("Refresh Dashboard")
-        refresh_btn.clicked.connect(self.refresh_stats)
-        refresh_btn.setStyleSheet("""
+        self.refresh_btn = QPushButton("Refresh Dashboard")
+        self.refresh_btn.clicked.connect(self.refresh_stats)
+        self.refresh_btn.setStyleSheet("""
             font-size: 16px; 
             padding: 10px;
         """)
-        main_layout.addWidget(refresh_btn, alignment=Qt.AlignCenter)
+        main_layout.addWidget(self.refresh_btn, alignment=Qt.AlignCenter)
 
         self.setLayout(main_layout)
 
+    def activate(self):
+        if self._stale:
+            # one stats query however many change batches came in meanwhile
+            self._stale = False
+            get_stats_cache().invalidate()
+        if self._needs_load:
+            self._needs_load = False
+            self.refresh_stats()
+
+    def refresh(self):
+        # refresh now if on screen, otherwise on next activation
+        if self.isVisible():
+            self.refresh_stats()
+        else:
+            self._needs_load = True
+
+    def stale(self):
+        # rows changed elsewhere: re-read from the database now if on screen,
+        # otherwise on next activation
+        if self.isVisible():
+            get_stats_cache().invalidate()
+            self.refresh_stats()
+        else:
+            self._stale = True
+            self._needs_load = True
+
     # ---------- CARD CREATOR ----------
     def create_card(self):
         card = QWidget()
@@ -972,25 +1948,20 @@ class DashboardTab(QWidget):
         return card
 
     def refresh_stats(self):
-        queries = {
-            "books": "SELECT COUNT(*) FROM book;",
-            "authors": "SELECT COUNT(*) FROM author;",
-            "members": "SELECT COUNT(*) FROM member;",
-            "active_loans": "SELECT COUNT(*) FROM loan WHERE status='On Loan';",
-            "overdue_loans": "SELECT COUNT(*) FROM loan WHERE status='Overdue';",
-            "out_of_stock": "SELECT COUNT(*) FROM book WHERE copies_available = 0;"
-        }
+        # counts are collected on a worker thread; clicking again while a
+        # refresh is running supersedes it
+        self.refresh_btn.setText("Refreshing...")
+        get_executor().submit(('dashboard', id(self)), self.collect_stats, on_result=self.show_stats)
 
-        results = {}
-        for key, query in queries.items():
-            try:
-                cur = self.db.cursor()
-                cur.execute(query)
-                results[key] = cur.fetchone()[0]
-            except Exception as e:
-                print("Dashboard Error:", e)
-                results[key] = 0
+    def collect_stats(self):
+        try:
+            return get_stats_cache().snapshot()
+        except Exception as e:
+            print("Dashboard Error:", e)
+            return dict.fromkeys(STATS_KEYS, 0)
 
+    def show_stats(self, results):
+        self.refresh_btn.setText("Refresh Dashboard")
         # Update the cards
         self.total_books.layout().itemAt(0).widget().setText(f"Total Books: {results['books']}")
         self.total_authors.layout().itemAt(0).widget().setText(f"Total Authors: {results['authors']}")
@@ -1000,6 +1971,140 @@ class DashboardTab(QWidget):
         self.out_of_stock.layout().itemAt(0).widget().setText(f"Books Out of Stock: {results['out_of_stock']}")
 
 
+# ---------- Reports Tab ----------
+class ReportsTab(QWidget):
+    # Circulation reports read from the analytics rollups; new loan changes
+    # are folded in first when ANALYTICS_CONFIG['refresh_on_open'] is set
+    TITLES = {
+        'top_books': 'Most borrowed books',
+        'busiest_members': 'Busiest members',
+        'genre_months': 'Loans per genre per month',
+        'loan_duration': 'Average loan duration'
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout()
+        grid = QGridLayout()
+        self.models = {}
+        for i, (name, (_, headers)) in enumerate(ANALYTICS_REPORTS.items()):
+            box = QVBoxLayout()
+            box.addWidget(QLabel(self.TITLES[name]))
+            model = EntityTableModel(headers, self)
+            table = QTableView()
+            table.setModel(model)
+            table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+            box.addWidget(table)
+            grid.addLayout(box, i // 2, i % 2)
+            self.models[name] = model
+        layout.addLayout(grid)
+
+        btn_layout = QHBoxLayout()
+        self.status_label = QLabel('')
+        self.refresh_btn = QPushButton('Refresh')
+        btn_layout.addWidget(self.status_label)
+        btn_layout.addStretch()
+        btn_layout.addWidget(self.refresh_btn)
+        layout.addLayout(btn_layout)
+        self.setLayout(layout)
+
+        self.refresh_btn.clicked.connect(self.refresh)
+        self._needs_load = True
+
+    def activate(self):
+        if self._needs_load:
+            self._needs_load = False
+            self.refresh()
+
+    def stale(self):
+        # loans changed; reload now if on screen, otherwise on next activation
+        if self.isVisible():
+            self.refresh()
+        else:
+            self._needs_load = True
+
+    def refresh(self):
+        self.refresh_btn.setText('Refreshing...')
+        get_executor().submit(('reports', id(self)), self.collect, on_result=self.show_reports,
+                              on_error=self.failed)
+
+    def collect(self):
+        # runs on a worker thread
+        start = time.perf_counter()
+        if ANALYTICS_CONFIG['refresh_on_open']:
+            refresh_analytics()
+        return analytics_report(), time.perf_counter() - start
+
+    def show_reports(self, result):
+        reports, duration = result
+        self.refresh_btn.setText('Refresh')
+        for name, rows in reports.items():
+            self.models[name].set_rows(rows)
+        self.status_label.setText(f'Updated in {duration * 1000:.0f} ms')
+
+    def failed(self, error):
+        self.refresh_btn.setText('Refresh')
+        print("Reports Error:", error)
+        self.status_label.setText('Reports unavailable')
+
+
+# ---------- Query Stats Tab ----------
+class QueryStatsTab(QWidget):
+    # Top statements by total time from the query log, per call site
+    HEADERS = ['Call site', 'Calls', 'Total ms', 'Mean ms', 'Max ms', 'Rows', 'Statement']
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout()
+        self.model = EntityTableModel(self.HEADERS, self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+        # hit/miss counts for sizing ENTITY_CACHE_CONFIG
+        self.cache_label = QLabel()
+        layout.addWidget(self.cache_label)
+
+        btn_layout = QHBoxLayout()
+        self.refresh_btn = QPushButton('Refresh')
+        self.reset_btn = QPushButton('Reset')
+        self.export_btn = QPushButton('Export CSV')
+        btn_layout.addWidget(self.refresh_btn)
+        btn_layout.addWidget(self.reset_btn)
+        btn_layout.addWidget(self.export_btn)
+        layout.addLayout(btn_layout)
+        self.setLayout(layout)
+
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.reset_btn.clicked.connect(self.reset)
+        self.export_btn.clicked.connect(self.export)
+
+    def activate(self):
+        self.refresh()
+
+    def refresh(self):
+        rows = [(tag, calls, round(total, 1), round(mean, 2), round(worst, 1), rows, statement)
+                for tag, calls, total, mean, worst, rows, statement in get_query_log().top(200)]
+        self.model.set_rows(rows)
+        cache = get_entity_cache().report()
+        self.cache_label.setText(
+            f"Entity cache: {cache['size']} entries, {cache['hits']} hits, {cache['misses']} misses "
+            f"({cache['hit_rate']:.0%} hit rate), {cache['expired']} expired, {cache['evictions']} evicted")
+
+    def reset(self):
+        get_query_log().reset()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Export query report', 'query_report.csv', 'CSV (*.csv)')
+        if path:
+            count = get_query_log().export(path)
+            QMessageBox.information(self, 'Export', f'Exported {count} statements to\n{path}')
+
+
 # ---------- Login Dialog ----------
 class LoginDialog(QDialog):
     def __init__(self, parent=None):
@@ -1037,17 +2142,22 @@ class LoginDialog(QDialog):
         if not username or not password:
             QMessageBox.warning(self, 'Validation', 'Enter username and password')
             return
-        hashed = hash_password(password)
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, username, full_name, role FROM users WHERE username=%s AND password_hash=%s",
-                    (username, hashed))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-        if row:
+        self.login_btn.setEnabled(False)
+        self.login_btn.setText("Logging in...")
+        get_executor().submit(('login', id(self)), authenticate, username, password,
+                              on_result=self.login_finished, on_error=self.login_failed)
+
+    def login_failed(self, error):
+        self.login_btn.setEnabled(True)
+        self.login_btn.setText("Login")
+        QMessageBox.critical(self, 'Error', f'Could not reach the database: {error}')
+
+    def login_finished(self, user):
+        self.login_btn.setEnabled(True)
+        self.login_btn.setText("Login")
+        if user:
             self.authenticated = True
-            self.user = {'id': row[0], 'username': row[1], 'full_name': row[2], 'role': row[3]}
+            self.user = user
             self.accept()
         else:
             QMessageBox.warning(self, 'Login Failed', 'Invalid credentials')
@@ -1059,12 +2169,8 @@ class MainWindow(QMainWindow):
         super().__init__()
 
         try:
-            self.db = psycopg2.connect(
-                host="localhost",
-                database="Limkokwing Smart Library System",
-                user="postgres",
-                password="julie22"
-            )
+            # all tabs share the process-wide connection pool
+            self.db = get_pool()
         except Exception as e:
             print("Database connection failed:", e)
             sys.exit(1)  # Exit if DB fails
@@ -1074,7 +2180,7 @@ class MainWindow(QMainWindow):
         self.resize(1000, 650)
         self.tabs = QTabWidget()
 
-        # create table structure if needed
+        # the schema was checked by main() before login
         create_tables()
 
         # instantiate tabs
@@ -1084,6 +2190,7 @@ class MainWindow(QMainWindow):
         self.member_tab = MemberTab()
         self.bookclub_tab = BookclubTab()
         self.loan_tab = LoanTab(self.book_tab, self.member_tab)
+        self.reports_tab = ReportsTab()
 
         # add tabs
         self.tabs.addTab(self.dashboard_tab, "Dashboard")
@@ -1092,6 +2199,9 @@ class MainWindow(QMainWindow):
         self.tabs.addTab(self.member_tab, 'Members')
         self.tabs.addTab(self.bookclub_tab, 'Bookclubs')
         self.tabs.addTab(self.loan_tab, 'Loans')
+        self.tabs.addTab(self.reports_tab, 'Reports')
+        if QUERY_LOG_CONFIG['enabled'] and self.current_user and self.current_user.get('role') == 'admin':
+            self.tabs.addTab(QueryStatsTab(), 'Queries')
 
         central = QWidget()
         layout = QVBoxLayout()
@@ -1110,37 +2220,128 @@ class MainWindow(QMainWindow):
         central.setLayout(layout)
         self.setCentralWidget(central)
 
-        # when authors change, refresh author combo in books tab
-        self.author_tab.refresh_btn.clicked.connect(self.book_tab.load_authors_into_combo)
-        # when members or books change, refresh loan tab combos
-        self.book_tab.refresh_btn.clicked.connect(self.loan_tab.load_books_members)
-        self.member_tab.refresh_btn.clicked.connect(self.loan_tab.load_books_members)
+        # tabs load their data the first time they are opened
+        self.tabs.currentChanged.connect(lambda index: self.tabs.widget(index).activate())
+
+        # row changes from any client arrive as notifications and are patched
+        # into the open tabs, combos and pickers
+        self.entity_tabs = (self.author_tab, self.book_tab, self.member_tab, self.bookclub_tab, self.loan_tab)
+        self.change_listener = ChangeListener(parent=self)
+        self.change_listener.changed.connect(self.apply_changes)
+        self.change_listener.resync.connect(self.resync)
+        if CHANGE_CONFIG['enabled']:
+            QTimer.singleShot(0, self.change_listener.start)
+        else:
+            # without notifications, fall back to reloading on Refresh clicks
+            self.author_tab.refresh_btn.clicked.connect(self.book_tab.refresh)
+            self.book_tab.refresh_btn.clicked.connect(self.loan_tab.load_books_members)
+            self.member_tab.refresh_btn.clicked.connect(self.loan_tab.load_books_members)
+
+        # keep loan.status current while the app is open
+        self.overdue_sweeper = OverdueSweeper(OVERDUE_CONFIG['interval'], self)
+        if not CHANGE_CONFIG['enabled']:
+            # otherwise the swept loans arrive as change notifications
+            self.overdue_sweeper.swept.connect(lambda _: self.loan_tab.refresh())
+            self.overdue_sweeper.swept.connect(lambda _: self.dashboard_tab.refresh())
+        if OVERDUE_CONFIG['enabled']:
+            # not needed for the first paint; start once the event loop is running
+            QTimer.singleShot(0, self.overdue_sweeper.start)
+
+        # new loans reach similar books / suggestions in the background
+        self.reco_refresher = RecommendationRefresher(RECO_CONFIG['refresh_interval'] or 0, self)
+        if RECO_CONFIG['refresh_interval']:
+            QTimer.singleShot(0, self.reco_refresher.start)
+
+    def apply_changes(self, changes):
+        # drop cached names first so the tabs' patch reads see the new ones
+        for table, ids in changes.items():
+            if table in ENTITY_CACHE_QUERIES:
+                get_entity_cache().invalidate(table, ids)
+        for table, ids in changes.items():
+            for tab in self.entity_tabs:
+                tab.apply_changes(table, ids)
+        if 'book' in changes:
+            get_book_lookup().patch(changes['book'])
+        if 'member' in changes:
+            get_member_lookup().patch(changes['member'])
+        if 'loan' in changes:
+            self.reports_tab.stale()
+        self.dashboard_tab.stale()
+
+    def resync(self):
+        # notifications were missed while the listener was disconnected
+        get_stats_cache().invalidate()
+        get_entity_cache().invalidate()
+        get_book_lookup().invalidate()
+        get_member_lookup().invalidate()
+        for tab in self.entity_tabs:
+            tab.refresh()
+        self.dashboard_tab.refresh()
+        self.reports_tab.stale()
+
+    def closeEvent(self, event):
+        self.change_listener.stop()
+        self.overdue_sweeper.stop()
+        self.reco_refresher.stop()
+        super().closeEvent(event)
 
     def logout(self):
         reply = QMessageBox.question(self, 'Logout', 'Are you sure you want to logout?',
                                      QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
+            app = QApplication.instance()
+            # closing this window must not end the app while the login dialog is up
+            app.setQuitOnLastWindowClosed(False)
             self.close()
             # show login dialog again
-            main()
+            window = show_login()
+            app.setQuitOnLastWindowClosed(True)
+            if window is None:
+                app.quit()
 
 
 # ---------- Application Entrypoint ----------
+_main_window = None
+
+
+def report_startup(label, since):
+    # printed once the event loop has painted the window
+    QTimer.singleShot(0, lambda: print(f"{label}: {(time.perf_counter() - since) * 1000:.0f} ms"))
+
+
+def show_login():
+    # returns the opened MainWindow, or None when login is cancelled
+    global _main_window
+    login = LoginDialog()
+    if login.exec_() == QDialog.Accepted and login.authenticated:
+        started = time.perf_counter()
+        _main_window = MainWindow(user_info=login.user)
+        _main_window.show()
+        report_startup("Main window shown after login", started)
+        return _main_window
+    return None
+
+
 def main():
+    started = time.perf_counter()
     app = QApplication(sys.argv)
+    # let in-flight queries finish before their connections are closed
+    app.aboutToQuit.connect(shutdown_executor)
+    app.aboutToQuit.connect(close_pool)
 
-    # ensure tables exist before login (so admin user gets created)
+    # ensure tables exist before login (so admin user gets created);
+    # a current schema costs one SELECT
     create_tables()
+    print(f"Schema check: {(time.perf_counter() - started) * 1000:.0f} ms")
+    report_startup("Login window shown", started)
 
-    login = LoginDialog()
-    if login.exec_() == QDialog.Accepted and login.authenticated:
-        w = MainWindow(user_info=login.user)
-        w.show()
-        sys.exit(app.exec_())
-    else:
+    if show_login() is None:
         # login canceled or failed -> exit
         sys.exit(0)
+    sys.exit(app.exec_())
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
\ No newline at end of file
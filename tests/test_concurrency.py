@@ -0,0 +1,116 @@
+import os
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import library_service as service
+
+# Runs against a real database only: LIBRARY_TEST_DB names one the DB_CONFIG
+# user may create tables in, e.g. LIBRARY_TEST_DB=library_test python -m pytest tests
+TEST_DB = os.environ.get('LIBRARY_TEST_DB')
+pytestmark = pytest.mark.skipif(not TEST_DB, reason="set LIBRARY_TEST_DB to run the concurrency tests")
+
+THREADS = 16
+TODAY = date.today()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def database():
+    saved = service.DB_CONFIG['dbname']
+    service.DB_CONFIG['dbname'] = TEST_DB
+    service.close_pool()
+    service.create_tables()
+    yield
+    service.close_pool()
+    service.DB_CONFIG['dbname'] = saved
+
+
+@pytest.fixture
+def race_book():
+    # one book and one member per test, removed with everything their loans touched
+    created = []
+
+    def make(copies):
+        book_id = service.run_query(
+            "INSERT INTO book (title, isbn, copies_available) VALUES (%s, %s, %s) RETURNING id",
+            ('Concurrency test', f'race-{os.urandom(4).hex()}', copies), fetch=True)[0][0]
+        member_id = service.run_query(
+            "INSERT INTO member (name) VALUES ('Concurrency test member') RETURNING id", fetch=True)[0][0]
+        created.append((book_id, member_id))
+        return book_id, member_id
+
+    yield make
+    with service.transaction() as conn:
+        cur = conn.cursor()
+        for book_id, member_id in created:
+            for statement in service.RACE_CLEANUP_STEPS:
+                cur.execute(statement, {'book': book_id, 'member': member_id})
+        cur.close()
+
+
+def race(calls):
+    # starts every call at once on its own thread; results in call order
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+    errors = []
+
+    def client(i, fn, args):
+        barrier.wait()
+        try:
+            results[i] = fn(*args)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=client, args=(i, fn, args)) for i, (fn, args) in enumerate(calls)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert not errors, errors
+    return results
+
+
+def copies_available(book_id):
+    return service.run_query("SELECT copies_available FROM book WHERE id=%s", (book_id,), fetch=True)[0][0]
+
+
+def open_loans(book_id):
+    return service.run_query("SELECT count(*) FROM loan WHERE book_id=%s AND return_date IS NULL",
+                             (book_id,), fetch=True)[0][0]
+
+
+def checkout(book_id, member_id):
+    return service.checkout_book(book_id, member_id, TODAY, TODAY + timedelta(days=14))
+
+
+def test_last_copy_goes_to_one_client(race_book):
+    book_id, member_id = race_book(1)
+    results = race([(checkout, (book_id, member_id))] * THREADS)
+    assert sum(1 for r in results if r is not None) == 1
+    assert copies_available(book_id) == 0
+    assert open_loans(book_id) == 1
+
+
+def test_loan_is_returned_once(race_book):
+    book_id, member_id = race_book(1)
+    loan_id = checkout(book_id, member_id)[0]
+    results = race([(service.return_book, (loan_id, TODAY))] * THREADS)
+    assert sum(1 for r in results if r is not None) == 1
+    assert copies_available(book_id) == 1
+    assert open_loans(book_id) == 0
+
+
+def test_returns_and_checkouts_keep_the_count(race_book):
+    # every copy starts out on loan; returns and checkouts then interleave
+    copies = 4
+    book_id, member_id = race_book(copies)
+    loans = [checkout(book_id, member_id)[0] for _ in range(copies)]
+    calls = [(service.return_book, (loan_id, TODAY)) for loan_id in loans]
+    calls += [(checkout, (book_id, member_id))] * (THREADS - copies)
+    results = race(calls)
+    returned = sum(1 for r in results[:copies] if r is not None)
+    checked_out = sum(1 for r in results[copies:] if r is not None)
+    assert returned == copies
+    assert checked_out <= returned
+    assert copies_available(book_id) == copies - open_loans(book_id) == returned - checked_out